@@ -0,0 +1,81 @@
+# test_channel_sender.py
+# utils.ChannelSender + telemetry_protocol.classify: chỉ frame trạng thái (STATE, CRC đúng) được bỏ khi hàng đợi đầy
+#   python -m pytest -q test/test_channel_sender.py   (hoặc python test/test_channel_sender.py)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+from telemetry_protocol import STATE, classify, crc_x25, message_key, unpack
+from utils import ChannelManager, ChannelSender
+
+def mavlink_v2(msgid: int, payload: bytes, compid: int = 1) -> bytes:
+    frame = bytes((0xFD, len(payload), 0, 0, 0, 1, compid)) + msgid.to_bytes(3, "little") + payload
+    return frame + crc_x25(bytes((STATE.get(msgid, 0),)), crc_x25(frame[1:])).to_bytes(2, "little")
+
+class CongestedChannel:
+    """Data channel giả: bufferedAmount tự đặt, on()/emit() như RTCDataChannel."""
+    readyState = "open"
+    bufferedAmountLowThreshold = 0
+
+    def __init__(self, buffered: int):
+        self.bufferedAmount = buffered
+        self.handlers = {}
+        self.sent = []
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def emit(self, event, *args):
+        for handler in self.handlers.get(event, []):
+            handler(*args)
+
+    def send(self, message):
+        self.sent.append(message)
+
+def test_message_key():
+    attitude = mavlink_v2(30, bytes(28))
+    assert message_key(attitude) == (1, 1, 30)
+    assert message_key(mavlink_v2(46, bytes(2))) is None  # MISSION_ITEM_REACHED: không có trong STATE
+    assert message_key(mavlink_v2(60001, bytes(4))) is None  # message của dialect khác
+    broken = attitude[:-1] + bytes((attitude[-1] ^ 0xFF,))
+    assert message_key(broken) is None  # CRC sai: có thể là byte lệch khung
+
+def test_unlisted_frame_survives_overflow():
+    channel = CongestedChannel(buffered=10 ** 6)  # nghẽn: mọi thứ vào hàng đợi
+    sender = ChannelSender(channel, high=1000, low=100, max_queue=600, split=classify, pack_size=1200)
+    reached = mavlink_v2(46, bytes(2))
+    assert sender.send(reached)
+    # trạng thái của nhiều component khác nhau (không thay nhau) cho tới khi tràn hàng đợi
+    for compid in range(1, 40):
+        sender.send(mavlink_v2(30, bytes(28), compid))
+    assert sender.stats["dropped"] > 0
+    assert sender.stats["overflow"] == 0
+    channel.bufferedAmount = 0
+    channel.emit("bufferedamountlow")
+    frames = [frame for message in channel.sent for frame in unpack(message)]
+    assert frames[0] == reached
+    assert sender.depth == 0
+
+class FakePeerConnection:
+    def createDataChannel(self, label, **options):
+        channel = CongestedChannel(buffered=0)
+        channel.label = label
+        return channel
+
+def test_state_waits_for_peer_ready():
+    table = {"telemetry": ("reliable", True, None, None), "telemetry_state": ("state", False, 0, None)}
+    manager = ChannelManager(FakePeerConnection(), table)
+    first, state = manager.channels["telemetry"], manager.channels["telemetry_state"]
+    attitude, reached = mavlink_v2(30, bytes(28)), mavlink_v2(46, bytes(2))
+    manager.send(attitude + reached)  # peer cũ chưa trả READY: cả hai đi kênh "telemetry"
+    assert first.sent == [attitude + reached] and state.sent == []
+    state.emit("message", ChannelManager.READY)
+    manager.send(attitude + reached)
+    assert first.sent[-1] == reached and state.sent == [attitude]
+
+if __name__ == "__main__":
+    test_message_key()
+    test_unlisted_frame_survives_overflow()
+    test_state_waits_for_peer_ready()
+    print("ok")
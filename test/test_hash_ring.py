@@ -0,0 +1,38 @@
+# test_hash_ring.py
+# signaling_server_pro.HashRing: mọi node cùng danh sách thì cùng chủ phòng; thêm node chỉ chuyển ~1/N phòng, và chỉ sang node mới
+#   python -m pytest -q test/test_hash_ring.py   (hoặc python test/test_hash_ring.py)
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+from signaling_server_pro import HashRing
+
+NODES = ["ws://10.0.0.1:8889", "ws://10.0.0.2:8889", "ws://10.0.0.3:8889"]
+ROOMS = [f"room-{i}" for i in range(3000)]
+
+def test_empty_ring():
+    assert HashRing([]).owner("room-1") is None
+
+def test_same_owner_whatever_the_order():
+    a, b = HashRing(NODES), HashRing(list(reversed(NODES)) + NODES[:1])  # thứ tự / trùng lặp không đổi kết quả
+    assert all(a.owner(room) == b.owner(room) for room in ROOMS)
+
+def test_rooms_spread_over_nodes():
+    counts = Counter(HashRing(NODES).owner(room) for room in ROOMS)
+    assert set(counts) == set(NODES)
+    assert max(counts.values()) < 1.25 * len(ROOMS) / len(NODES)
+
+def test_adding_a_node_moves_only_to_it():
+    before, after = HashRing(NODES), HashRing(NODES + ["ws://10.0.0.4:8889"])
+    moved = [room for room in ROOMS if before.owner(room) != after.owner(room)]
+    assert all(after.owner(room) == "ws://10.0.0.4:8889" for room in moved)
+    assert 0.15 < len(moved) / len(ROOMS) < 0.35  # ~1/4
+
+if __name__ == "__main__":
+    test_empty_ring()
+    test_same_owner_whatever_the_order()
+    test_rooms_spread_over_nodes()
+    test_adding_a_node_moves_only_to_it()
+    print("ok")
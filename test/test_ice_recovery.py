@@ -0,0 +1,56 @@
+# test_ice_recovery.py
+# utils.IceRecovery dùng thuộc tính private của aiortc / aioice: báo lỗi ngay khi bản cài đặt nằm ngoài ICE_RESTART_VERSIONS
+# hoặc thiếu thuộc tính nào đó (thử lại bench_ice_restart.py rồi mới nới ICE_RESTART_VERSIONS)
+#   python -m pytest -q test/test_ice_recovery.py   (hoặc python test/test_ice_recovery.py)
+import os
+import sys
+import asyncio
+import inspect
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+import aioice
+import aiortc
+from aioice import Connection
+from aiortc import RTCConfiguration, RTCPeerConnection
+
+from utils import ICE_RESTART_VERSIONS, ice_restart_supported, ice_transport
+
+def test_installed_versions_in_gate():
+    installed = {"aiortc": aiortc.__version__, "aioice": aioice.__version__}
+    for name, prefix in ICE_RESTART_VERSIONS.items():
+        assert installed[name].startswith(prefix), (
+            f"{name} {installed[name]} is outside ICE_RESTART_VERSIONS {ICE_RESTART_VERSIONS}: IceRecovery "
+            f"turns itself off and every network fault rebuilds the peer connection")
+
+def test_private_internals_present():
+    async def run():
+        config = RTCConfiguration(iceServers=[])
+        publisher, viewer = RTCPeerConnection(config), RTCPeerConnection(config)
+        channel = publisher.createDataChannel("telemetry")
+        opened = asyncio.Event()
+        channel.on("open", opened.set)
+        try:
+            await publisher.setLocalDescription(await publisher.createOffer())
+            await viewer.setRemoteDescription(publisher.localDescription)
+            await viewer.setLocalDescription(await viewer.createAnswer())
+            await publisher.setRemoteDescription(viewer.localDescription)
+            await asyncio.wait_for(opened.wait(), 20)
+            return [ice_restart_supported(pc) for pc in (publisher, viewer)], ice_transport(publisher)
+        finally:
+            await publisher.close()
+            await viewer.close()
+
+    supported, transport = asyncio.run(run())
+    assert supported == [True, True], "aiortc / aioice no longer have the private attributes IceRecovery swaps"
+    # IceRecovery._new_connection dựng Connection mới với đúng các tham số của Connection cũ
+    params = inspect.signature(Connection).parameters
+    for name in ("ice_controlling", "stun_server", "turn_server", "turn_username", "turn_password", "turn_ssl",
+                 "turn_transport", "use_ipv4", "use_ipv6", "transport_policy"):
+        assert name in params, f"aioice.Connection() has no {name} argument"
+    assert transport is not None
+
+if __name__ == "__main__":
+    test_installed_versions_in_gate()
+    test_private_internals_present()
+    print("ok")
@@ -0,0 +1,72 @@
+# test_rate_limit.py
+# signaling_server_pro.RateLimiter / admit_message: bucket lồng nhau peer -> IP -> phòng -> toàn server, 0 = không giới hạn
+#   python -m pytest -q test/test_rate_limit.py   (hoặc python test/test_rate_limit.py)
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+import signaling_server_pro as server
+from signaling_server_pro import RateLimiter, Room, Session, admit_message
+
+class FakeWebSocket:
+    subprotocol = None
+
+def session(room: Room = None) -> Session:
+    s = Session(FakeWebSocket())
+    s.room = room
+    return s
+
+def test_bucket_refills_at_rate():
+    async def run():
+        bucket = RateLimiter(10, burst=2)
+        now = bucket.updated
+        assert bucket.refill(now) == 2
+        bucket.tokens = 0
+        assert abs(bucket.refill(now + 0.05) - 0.5) < 1e-9
+        assert bucket.refill(now + 10) == 2  # không vượt capacity
+    asyncio.run(run())
+
+def test_refusing_level_does_not_drain_others():
+    async def run():
+        room = Room("r")
+        room.limiter = RateLimiter(1, burst=1)
+        a, b = session(room), session(room)
+        now = asyncio.get_running_loop().time()
+        assert admit_message(a, now) is None
+        bucket, level = admit_message(b, now)  # phòng hết token
+        assert level == "room" and bucket is room.limiter
+        assert b.tokens == b.capacity  # bucket của b không bị trừ
+        assert a.tokens == a.capacity - 1
+    asyncio.run(run())
+
+def test_peer_limit_off(monkeypatch):
+    monkeypatch.setattr(server, "MAX_MSGS_PER_SEC", 0.0)
+
+    async def run():
+        s = session()
+        now = s.updated
+        assert all(admit_message(s, now) is None for _ in range(1000))  # 0 = không giới hạn, không chia cho rate 0
+    asyncio.run(run())
+
+def test_peer_limit_refuses_after_burst():
+    async def run():
+        s = session()
+        now = s.updated
+        admitted = sum(1 for _ in range(s.capacity + 5) if admit_message(s, now) is None)
+        assert admitted == s.capacity
+        bucket, level = admit_message(s, now)
+        assert level == "peer" and bucket.rate == server.MAX_MSGS_PER_SEC
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    class MonkeyPatch:
+        def setattr(self, target, name, value):
+            setattr(target, name, value)
+
+    test_bucket_refills_at_rate()
+    test_refusing_level_does_not_drain_others()
+    test_peer_limit_refuses_after_burst()
+    test_peer_limit_off(MonkeyPatch())
+    print("ok")
@@ -0,0 +1,43 @@
+# test_resume_token.py
+# signaling_server_pro.resume_token / check_resume: token chỉ hợp lệ cho đúng phòng + peer đã cấp, không sửa được
+#   python -m pytest -q test/test_resume_token.py   (hoặc python test/test_resume_token.py)
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+import signaling_server_pro as server
+from signaling_server_pro import check_resume, resume_token
+
+def test_token_checks_out_for_its_seat():
+    token = resume_token("room-1", "drone-1")
+    assert check_resume(token, "room-1", "drone-1")
+    assert not check_resume(token, "room-2", "drone-1")
+    assert not check_resume(token, "room-1", "drone-2")
+    assert not check_resume(token, "room-1\ndrone-1", "")  # phòng / peer ghép khác cách cắt
+
+def test_tampered_tokens():
+    token = resume_token("room-1", "drone-1")
+    nonce, _, mac = token.partition(".")
+    flipped = mac[:-1] + ("0" if mac[-1] != "0" else "1")
+    for bad in (f"{nonce}.{flipped}", f"x{nonce}.{mac}", nonce, "", ".", f"{nonce}."):
+        assert not check_resume(bad, "room-1", "drone-1")
+
+def test_fresh_nonce_each_time():
+    assert resume_token("room-1", "drone-1") != resume_token("room-1", "drone-1")
+
+def test_other_secret_rejects(monkeypatch):
+    token = resume_token("room-1", "drone-1")
+    monkeypatch.setattr(server, "RESUME_SECRET", b"another worker set")  # worker không dùng chung RESUME_SECRET
+    assert not check_resume(token, "room-1", "drone-1")
+
+if __name__ == "__main__":
+    class MonkeyPatch:
+        def setattr(self, target, name, value):
+            setattr(target, name, value)
+
+    test_token_checks_out_for_its_seat()
+    test_tampered_tokens()
+    test_fresh_nonce_each_time()
+    test_other_secret_rejects(MonkeyPatch())
+    print("ok")
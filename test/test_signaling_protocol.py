@@ -0,0 +1,48 @@
+# test_signaling_protocol.py
+# signaling_protocol: frame nhị phân "signal.bin.v1" <-> JSON, check_body, with_sender
+#   python -m pytest -q test/test_signaling_protocol.py   (hoặc python test/test_signaling_protocol.py)
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+from signaling_protocol import ROUTED_TYPES, check_body, decode_header, encode_frame, frame_from_json, frame_to_json, with_sender
+
+def test_round_trip():
+    for msg_type in ROUTED_TYPES:
+        msg = {"type": msg_type, "from": "drone-1", "to": "gcs", "sdp": "v=0\r\n", "sdpType": "offer"}
+        frame = frame_from_json(msg)
+        assert decode_header(frame)[:3] == (msg_type, "drone-1", "gcs")
+        assert frame_to_json(frame) == {"type": msg_type, "from": "drone-1", "sdp": "v=0\r\n", "sdpType": "offer"}
+
+def test_with_sender_keeps_body_bytes():
+    frame = frame_from_json({"type": "candidate", "from": "spoofed", "to": "viewer-7", "candidate": "a=candidate:1"})
+    _, _, _, body_at = decode_header(frame)
+    routed = with_sender(frame, "publisher-üñí")  # id không phải ASCII: độ dài tính theo byte
+    msg_type, frm, to, routed_at = decode_header(routed)
+    assert (msg_type, frm, to) == ("candidate", "publisher-üñí", "viewer-7")
+    assert routed[routed_at:] == frame[body_at:]
+
+def test_check_body():
+    for frame in (frame_from_json({"type": "offer", "to": "a", "sdp": "x"}), encode_frame("offer", "", "a", b"")):
+        check_body(frame, decode_header(frame)[3])  # JSON object hoặc body rỗng
+    for body in (b"[1, 2]", b"not json", b"\xff\xfe"):
+        frame = encode_frame("offer", "", "a", body)
+        with pytest.raises(ValueError):  # json.JSONDecodeError / UnicodeDecodeError cũng là ValueError
+            check_body(frame, decode_header(frame)[3])
+
+def test_bad_headers():
+    for frame in (b"", b"\x01\x00", b"\x63\x00\x00{}", b"\x01\x05\x00ab"):
+        with pytest.raises(ValueError):
+            decode_header(frame)
+    with pytest.raises(ValueError):
+        encode_frame("offer", "x" * 256, "a", b"")
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_with_sender_keeps_body_bytes()
+    test_check_body()
+    test_bad_headers()
+    print("ok")
@@ -0,0 +1,72 @@
+# test_telemetry_protocol.py
+# telemetry_protocol.MavlinkFramer / unpack / TelemetryPacker: byte start (0xFE/0xFD) lạc trong dữ liệu thô không thành frame
+#   python -m pytest -q test/test_telemetry_protocol.py   (hoặc python test/test_telemetry_protocol.py)
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "webrtc_signaling_server"))
+
+from telemetry_protocol import STATE, MavlinkFramer, TelemetryPacker, crc_x25, unpack
+
+def mavlink_v2(msgid: int, payload: bytes, seq: int = 0) -> bytes:
+    frame = bytes((0xFD, len(payload), 0, 0, seq, 1, 1)) + msgid.to_bytes(3, "little") + payload
+    return frame + crc_x25(bytes((STATE.get(msgid, 0),)), crc_x25(frame[1:])).to_bytes(2, "little")
+
+def mavlink_v1(msgid: int, payload: bytes) -> bytes:
+    frame = bytes((0xFE, len(payload), 0, 1, 1, msgid)) + payload
+    return frame + crc_x25(bytes((STATE.get(msgid, 0),)), crc_x25(frame[1:])).to_bytes(2, "little")
+
+def test_frames_split_across_reads():
+    attitude, heartbeat = mavlink_v2(30, bytes(28)), mavlink_v1(0, bytes(9))
+    stream = attitude + heartbeat
+    framer = MavlinkFramer()
+    pieces = framer.feed(stream[:5]) + framer.feed(stream[5:40]) + framer.feed(stream[40:])
+    assert pieces == [(True, attitude), (True, heartbeat)]
+    assert framer.buffer == bytearray() and framer.raw == 0
+
+def test_stray_start_byte_keeps_datagram_boundaries():
+    framer = MavlinkFramer()
+    first = framer.feed(b"GPGGA,\xfe\x20abc")  # 0xFE: đầu một frame v1 32 byte payload? chưa biết, chờ
+    second = framer.feed(b"second datagram, 40 bytes long.....")
+    pieces = first + second + framer.flush()
+    assert all(not is_frame for is_frame, _ in pieces)
+    assert [piece for _, piece in pieces] == [b"GPGGA,", b"\xfe\x20abc", b"second datagram, 40 bytes long....."]
+    assert framer.buffer == bytearray() and framer.marks == []
+
+def test_stray_start_byte_then_real_frame():
+    attitude = mavlink_v2(30, bytes(28))
+    framer = MavlinkFramer()
+    pieces = framer.feed(b"$\xfd\x05\x00xyz" + attitude) + framer.flush()
+    assert pieces == [(False, b"$\xfd\x05\x00xyz"), (True, attitude)]  # CRC không khớp: resync ở byte start sau
+
+def test_unpack_raw_with_start_bytes():
+    assert unpack(b"hello\xfd\x01\x00world........!") == [b"hello\xfd\x01\x00world........!"]
+    assert unpack(b"\xfd\x10\x04" + bytes(40)) == [b"\xfd\x10\x04" + bytes(40)]  # incompat flag không có trong MAVLink
+    reached = mavlink_v2(46, bytes(2))
+    assert unpack(b"\xfe" + reached + b"tail") == [b"\xfe", reached, b"tail"]
+
+def test_packer_keeps_raw_apart():
+    async def run():
+        sent = []
+        packer = TelemetryPacker(sent.append, max_size=1200, max_delay=0.01, hold=0.05)
+        frames = [mavlink_v2(30, bytes(28), seq) for seq in range(3)]
+        for frame in frames:
+            packer.feed(frame)
+        packer.feed(b"NMEA \xfe\x30 not mavlink")
+        await asyncio.sleep(0.2)
+        packer.close()
+        return frames, sent
+
+    frames, sent = asyncio.run(run())
+    assert sent[0] == b"".join(frames)
+    assert sent[1:] == [b"NMEA ", b"\xfe\x30 not mavlink"]
+    assert [frame for message in sent[:1] for frame in unpack(message)] == frames
+
+if __name__ == "__main__":
+    test_frames_split_across_reads()
+    test_stray_start_byte_keeps_datagram_boundaries()
+    test_stray_start_byte_then_real_frame()
+    test_unpack_raw_with_start_bytes()
+    test_packer_keeps_raw_apart()
+    print("ok")
@@ -0,0 +1,116 @@
+# bench_bootstrap.py
+"""
+Time to first frame for a late-joining viewer, with and without the
+server's bootstrap cache (BOOTSTRAP_TTL).
+
+Each trial starts a publisher (aiortc's synthetic VideoStreamTrack) on
+signaling_loop_pro, waits until it sits in the room, then starts a viewer
+and times:
+  - offer: viewer start -> offer received (have-remote-offer)
+  - frame: viewer start -> first decoded video frame
+
+Without the cache the offer needs peer-joined to reach the publisher and a
+fresh createOffer. With it, the publisher offers to "*" as soon as it joins
+and the viewer gets that offer together with the "peers" reply.
+
+Uses no STUN/TURN, so ICE gathering is loopback-only; with real ice_servers
+createOffer takes longer and the cache saves more.
+
+    python bench_bootstrap.py --trials 10
+"""
+import io
+import os
+import time
+import asyncio
+import argparse
+import statistics
+import contextlib
+
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from loadgen import start_server
+from utils import signaling_loop_pro
+
+async def trial(url: str, warmup: float, timeout: float):
+    loop = asyncio.get_running_loop()
+
+    async def pub_ice(candidate):
+        pass
+
+    async def view_ice(candidate):
+        pass
+
+    pub_pc = RTCPeerConnection()
+    pub_pc.addTrack(VideoStreamTrack())
+    pub_task = asyncio.create_task(signaling_loop_pro(pub_pc, asyncio.Event(), pub_ice, "publisher", 1, url))
+    await asyncio.sleep(warmup)
+
+    view_pc = RTCPeerConnection()
+    got_offer = loop.create_future()
+    got_frame = loop.create_future()
+
+    @view_pc.on("signalingstatechange")
+    def on_signaling():
+        if view_pc.signalingState == "have-remote-offer" and not got_offer.done():
+            got_offer.set_result(time.perf_counter())
+
+    @view_pc.on("track")
+    def on_track(track):
+        async def first_frame():
+            try:
+                await track.recv()
+            except Exception:
+                return  # track ended before a frame arrived: the trial times out
+            if not got_frame.done():
+                got_frame.set_result(time.perf_counter())
+        asyncio.ensure_future(first_frame())
+
+    t0 = time.perf_counter()
+    view_task = asyncio.create_task(signaling_loop_pro(view_pc, asyncio.Event(), view_ice, "viewer", 1, url))
+    try:
+        t_frame = await asyncio.wait_for(got_frame, timeout)
+        result = (got_offer.result() - t0, t_frame - t0)
+    except asyncio.TimeoutError:
+        result = None
+    for task in (view_task, pub_task):
+        task.cancel()
+    await asyncio.gather(view_task, pub_task, return_exceptions=True)
+    await view_pc.close()
+    await pub_pc.close()
+    await asyncio.sleep(0.5)  # let the server see both leave
+    return result
+
+async def run(url: str, args):
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):  # signaling_loop_pro is chatty
+        for _ in range(args.trials):
+            results.append(await trial(url, args.warmup, args.timeout))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="late viewer time to first frame, bootstrap cache on/off")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--ttl", type=float, default=30, help="BOOTSTRAP_TTL for the cached run")
+    parser.add_argument("--warmup", type=float, default=1.0, help="s between publisher and viewer start")
+    parser.add_argument("--timeout", type=float, default=20)
+    parser.add_argument("--port", type=int, default=18896)
+    args = parser.parse_args()
+
+    url = f"ws://127.0.0.1:{args.port}"
+    print(f"trials={args.trials}")
+    print(f"{'cache':>6} {'offer p50 ms':>13} {'frame p50 ms':>13} {'frame max ms':>13} {'failed':>7}")
+    for ttl in (0, args.ttl):
+        proc = start_server(args.port, {"BOOTSTRAP_TTL": str(ttl)})
+        try:
+            results = asyncio.run(run(url, args))
+        finally:
+            proc.terminate()
+            proc.wait()
+        ok = [r for r in results if r]
+        offer = statistics.median(r[0] for r in ok) * 1000 if ok else float("nan")
+        frame = [r[1] * 1000 for r in ok]
+        print(f"{'on' if ttl else 'off':>6} {offer:>13.1f} {statistics.median(frame) if frame else float('nan'):>13.1f} "
+              f"{max(frame) if frame else float('nan'):>13.1f} {len(results) - len(ok):>7}")
+
+if __name__ == "__main__":
+    main()
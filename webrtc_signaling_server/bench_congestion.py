@@ -0,0 +1,227 @@
+# bench_congestion.py
+"""
+Telemetry over a congested or lossy data channel: channel.send as before vs
+utils.ChannelSender (bounded queue, latest value wins for state frames,
+must-deliver frames kept in order) vs utils.ChannelManager (state frames on
+an unordered, unreliable channel of their own).
+
+Two aiortc peers on loopback, connected in-process. Publisher -> viewer
+traffic goes through an emulated satellite link: --link kbit/s (0 =
+unlimited), --rtt ms round trip, a --queue-ms router buffer (tail drop past
+it), --loss % random loss. The viewer's SACKs get the delay and the loss. The publisher is fed ArduPilot-shaped telemetry
+(ATTITUDE 50 Hz, ... about 115 frames/s, times --rate-scale), one frame per
+datagram as send_telemetry_from_udp gets it, plus must-deliver frames:
+COMMAND_ACK at 2 Hz, STATUSTEXT and TIMESYNC at 1 Hz. Every frame goes through
+TelemetryPacker (TELEMETRY_PACK_SIZE, TELEMETRY_PACK_DELAY), then:
+
+  before: channel.send, aiortc queues whatever the link cannot take
+  sender: ChannelSender(--high, --low, --max-queue, classify,
+          TELEMETRY_PACK_SIZE), defaults from config.py
+  channels: ChannelManager(TELEMETRY_CHANNELS, same settings): state on
+          "telemetry_state" (unordered, maxRetransmits=0), the rest on
+          "telemetry" (reliable, ordered)
+
+Reported: state frame age on arrival (generated -> unpacked on the viewer)
+over the last half of the run, p50 / p99 (nan: none of them arrived); state
+frames delivered, over the run and over its last half; must-
+deliver frames delivered and their p99 latency; largest bufferedAmount
+(what aiortc holds in memory) and the sender's queue; frames the sender
+replaced with newer ones; link packets tail-dropped and randomly lost.
+
+    python bench_congestion.py --link 64 --rtt 600 --duration 30
+    python bench_congestion.py --link 0 --loss 5 --modes before channels
+"""
+import time
+import random
+import asyncio
+import argparse
+
+from aioice import ice
+from aiortc import RTCConfiguration, RTCPeerConnection
+
+from loadgen import pct
+from config import (TELEMETRY_PACK_SIZE, TELEMETRY_PACK_DELAY,
+                    CHANNEL_BUFFER_HIGH, CHANNEL_BUFFER_LOW, CHANNEL_QUEUE_MAX, TELEMETRY_CHANNELS)
+from telemetry_protocol import STATE, TelemetryPacker, classify, crc_x25, message_key, unpack
+from utils import ChannelSender, ChannelManager
+
+# (message id, payload bytes, Hz): ArduPilot's usual stream set
+STREAMS = [(0, 9, 1), (1, 31, 2), (24, 52, 5), (27, 29, 10), (29, 16, 10), (30, 28, 50), (33, 28, 10),
+           (65, 42, 5), (36, 37, 10), (74, 20, 10), (147, 54, 1)]
+MUST = [(77, 10, 2), (253, 54, 1), (111, 16, 1)]  # COMMAND_ACK, STATUSTEXT, TIMESYNC (not in STATE)
+IP_UDP = 28
+
+# ------------------ emulated link ------------------
+class Link:
+    """One direction of a path: random loss, serialization at rate, a tail-drop queue, propagation delay."""
+
+    def __init__(self, kbps: float, delay: float, queue: float, loss: float = 0.0):
+        self.rate = kbps * 1000 / 8 if kbps else 0  # bytes/s, 0 = unlimited
+        self.delay, self.queue, self.loss = delay, queue, loss
+        self.random = random.Random(2)
+        self.busy_until = 0.0
+        self.sent = self.dropped = self.lost = 0
+
+    def schedule(self, size: int, now: float):
+        """Arrival time, or None if the packet is lost or the router queue is full."""
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return None
+        if not self.rate:
+            return now + self.delay
+        start = max(now, self.busy_until)
+        if start - now > self.queue:
+            self.dropped += 1
+            return None
+        self.busy_until = start + size / self.rate
+        self.sent += 1
+        return self.busy_until + self.delay
+
+links = {}  # id(StunProtocol) -> Link
+_send_data = ice.StunProtocol.send_data
+
+async def send_data(self, data: bytes, addr) -> None:
+    link = links.get(id(self))
+    if link is None or not data or data[0] != 23:  # only DTLS application data (SCTP) goes through the link
+        await _send_data(self, data, addr)
+        return
+    loop = asyncio.get_running_loop()
+    arrival = link.schedule(len(data) + IP_UDP, loop.time())
+    if arrival is not None:
+        loop.call_at(arrival, deliver, self, data, addr)
+
+def deliver(protocol, data: bytes, addr):
+    if protocol.transport is not None and not protocol.transport.is_closing():
+        asyncio.ensure_future(_send_data(protocol, data, addr))
+
+ice.StunProtocol.send_data = send_data
+
+def protocols(pc: RTCPeerConnection) -> list:
+    return list(pc.sctp.transport.transport._connection._protocols)
+
+# ------------------ MAVLink source ------------------
+def mavlink_v2(msgid: int, length: int, seq: int) -> bytes:
+    frame = bytes((0xFD, length, 0, 0, seq & 0xFF, 1, 1)) + msgid.to_bytes(3, "little") + random.randbytes(length)
+    return frame + crc_x25(bytes((STATE.get(msgid, 0),)), crc_x25(frame[1:])).to_bytes(2, "little")
+
+async def source(args, feed, sent: dict):
+    """One frame per feed() call at its stream's rate for --duration s; sent: frame -> generation time."""
+    loop = asyncio.get_running_loop()
+    streams = [(msgid, length, hz * args.rate_scale) for msgid, length, hz in STREAMS] + MUST
+    due = [(i / (len(streams) * hz), msgid, length, hz) for i, (msgid, length, hz) in enumerate(streams)]
+    started = loop.time()
+    seq = 0
+    while loop.time() - started < args.duration:
+        now = loop.time() - started
+        for k, (t, msgid, length, hz) in enumerate(due):
+            while t <= now:
+                frame = mavlink_v2(msgid, length, seq)
+                seq += 1
+                sent[frame] = time.monotonic()
+                feed(frame)
+                t += 1 / hz
+            due[k] = (t, msgid, length, hz)
+        await asyncio.sleep(0.001)
+
+# ------------------ one run ------------------
+async def run(args, mode: str) -> dict:
+    config = RTCConfiguration(iceServers=[])
+    publisher, viewer = RTCPeerConnection(config), RTCPeerConnection(config)
+    if mode == "channels":
+        sender = ChannelManager(publisher, TELEMETRY_CHANNELS, args.high, args.low, args.max_queue, TELEMETRY_PACK_SIZE)
+        channels = list(sender.channels.values())
+    else:
+        channels = [publisher.createDataChannel("telemetry")]
+        sender = ChannelSender(channels[0], args.high, args.low, args.max_queue, classify, TELEMETRY_PACK_SIZE) \
+            if mode == "sender" else None
+    channel = channels[0]
+    opened = asyncio.Event()
+    channel.on("open", opened.set)
+    sent, received = {}, {}
+
+    @viewer.on("datachannel")
+    def on_datachannel(ch):
+        @ch.on("message")
+        def on_message(message):
+            if ChannelManager.accept(ch, message):
+                return
+            now = time.monotonic()
+            for frame in unpack(message):
+                received[frame] = now
+
+    await publisher.setLocalDescription(await publisher.createOffer())
+    await viewer.setRemoteDescription(publisher.localDescription)
+    await viewer.setLocalDescription(await viewer.createAnswer())
+    await publisher.setRemoteDescription(viewer.localDescription)
+    await asyncio.wait_for(opened.wait(), 20)
+    await asyncio.sleep(1)
+    while any(c.readyState != "open" for c in channels):
+        await asyncio.sleep(0.1)
+    up = Link(args.link, args.rtt / 2000, args.queue_ms / 1000, args.loss / 100)
+    for p in protocols(publisher):
+        links[id(p)] = up
+    for p in protocols(viewer):
+        links[id(p)] = Link(0, args.rtt / 2000, 0, args.loss / 100)
+
+    packer = TelemetryPacker(sender.send if sender else channel.send, TELEMETRY_PACK_SIZE, TELEMETRY_PACK_DELAY)
+    senders = list(sender.senders.values()) if mode == "channels" else [sender] if sender else []
+    buffered = [0, 0]  # largest bufferedAmount, largest sender queue
+
+    async def watch():
+        while True:
+            buffered[0] = max(buffered[0], sum(c.bufferedAmount for c in channels))
+            buffered[1] = max(buffered[1], sum(s.queued for s in senders))
+            await asyncio.sleep(0.05)
+
+    watcher = asyncio.create_task(watch())
+    started = time.monotonic()
+    await source(args, packer.feed, sent)
+    await asyncio.sleep(args.rtt / 1000 + 0.5)
+    watcher.cancel()
+    packer.close()
+    await publisher.close()
+    await viewer.close()
+    links.clear()
+
+    half = started + args.duration / 2
+    state = [(f, t) for f, t in sent.items() if message_key(f) is not None]
+    must = [(f, t) for f, t in sent.items() if message_key(f) is None]
+    late = [(f, t) for f, t in state if t >= half]
+    age = [received[f] - t for f, t in late if f in received]
+    must_lat = [received[f] - t for f, t in must if f in received]
+    return {
+        "age50": pct(age, 0.5) * 1000, "age99": pct(age, 0.99) * 1000,
+        "state": sum(1 for f, _ in state if f in received) / len(state),
+        "late": len(age) / len(late),
+        "must": len(must_lat) / len(must), "must99": pct(must_lat, 0.99) * 1000,
+        "buffered": buffered[0] / 1024, "queued": buffered[1] / 1024,
+        "replaced": sum(s.stats["replaced"] for s in senders),
+        "link_drops": up.dropped, "lost": up.lost,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="telemetry over a congested / lossy link: channel.send vs ChannelSender vs ChannelManager")
+    parser.add_argument("--link", type=float, default=64, help="publisher -> viewer link (kbit/s)")
+    parser.add_argument("--rtt", type=float, default=600, help="round trip (ms)")
+    parser.add_argument("--queue-ms", type=float, default=200, help="router buffer (ms of link time)")
+    parser.add_argument("--loss", type=float, default=0, help="random loss, both directions (%%)")
+    parser.add_argument("--rate-scale", type=float, default=2.0, help="multiply every state stream rate")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--high", type=int, default=CHANNEL_BUFFER_HIGH, help="ChannelSender high (bytes)")
+    parser.add_argument("--low", type=int, default=CHANNEL_BUFFER_LOW, help="ChannelSender low (bytes)")
+    parser.add_argument("--max-queue", type=int, default=CHANNEL_QUEUE_MAX, help="ChannelSender max_queue (bytes)")
+    parser.add_argument("--modes", nargs="+", default=["before", "sender", "channels"])
+    args = parser.parse_args()
+
+    print(f"link={args.link:g}kbit/s rtt={args.rtt:g}ms queue={args.queue_ms:g}ms loss={args.loss:g}% rate x{args.rate_scale:g} "
+          f"duration={args.duration:g}s high/low/max={args.high}/{args.low}/{args.max_queue}")
+    print(f"{'mode':>8} {'age p50':>8} {'age p99':>8} {'state got':>10} {'late got':>9} {'must got':>9} {'must p99':>9} "
+          f"{'buffered kB':>12} {'queue kB':>9} {'replaced':>9} {'link drops':>11} {'lost':>6}")
+    for mode in args.modes:
+        random.seed(1)
+        r = asyncio.run(run(args, mode))
+        print(f"{mode:>8} {r['age50']:>8.0f} {r['age99']:>8.0f} {r['state']:>10.1%} {r['late']:>9.1%} {r['must']:>9.1%} {r['must99']:>9.0f} "
+              f"{r['buffered']:>12.1f} {r['queued']:>9.1f} {r['replaced']:>9} {r['link_drops']:>11} {r['lost']:>6}")
+
+if __name__ == "__main__":
+    main()
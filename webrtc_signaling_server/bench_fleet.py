@@ -0,0 +1,184 @@
+# bench_fleet.py
+"""
+A whole fleet in one room: --publishers drones, each sending its own stream,
+and one viewer per drone joining at --viewer-rate/s.
+
+Clients are plain websockets speaking signaling_loop_pro's protocol (no
+aiortc: the SDP is --sdp-size bytes of filler), so the numbers are the
+signaling server's and the protocol's. Modes:
+
+  scoped:   unique peer ids (utils.peer_identity) and ?stream=drone-<i>.
+            A viewer only meets its drone; the drone offers to the viewer
+            it sees, the viewer answers that one offer
+  unscoped: unique peer ids, no stream. Every drone sees every viewer and,
+            like signaling_loop_pro before streams, offers to each viewer
+            that joins; viewers answer every offer
+  legacy:   peer id = role, as signaling_loop_pro used to connect: each
+            drone that joins replaces the previous one
+
+Reported: publisher join time (connect -> "peers"), viewer pairing time
+(connect -> offer from its own drone), viewers paired, offers a viewer got
+from other drones, messages pushed to the drones while viewers joined,
+drones kicked out, server CPU (/proc, Linux only) over the viewer phase.
+
+    python bench_fleet.py --publishers 500 --viewer-rate 100
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import websockets
+
+from loadgen import cpu_seconds, pct, start_server
+
+class Client:
+    """One drone or one viewer: a websocket and the reader that plays its side of the protocol."""
+
+    def __init__(self, fleet: "Fleet", index: int, role: str):
+        self.fleet, self.index, self.role = fleet, index, role
+        self.stream = f"drone-{index}"
+        if fleet.mode == "legacy":
+            self.peer = role
+        else:
+            self.peer = f"{role}-bench-{index:05d}"
+        self.ws = None
+        self.task = None
+        self.started = 0.0
+        self.joined = None  # s from connect to "peers"
+        self.paired = None  # viewer: s from connect to the offer from its drone
+        self.counterpart = None
+        self.kicked = False
+
+    async def connect(self):
+        q = f"?room=fleet&peer={self.peer}&role={self.role}"
+        if self.fleet.mode == "scoped":
+            q += f"&stream={self.stream}"
+        self.started = time.monotonic()
+        self.ws = await websockets.connect(self.fleet.url + q, ping_interval=None, compression=None, max_queue=None)
+        msg = json.loads(await self.ws.recv())
+        self.joined = time.monotonic() - self.started
+        self.task = asyncio.create_task(self.read())
+        if self.role == "publisher":
+            for viewer in msg.get("peers", []):
+                await self.seen(viewer)
+
+    async def send(self, msg: dict):
+        await self.ws.send(json.dumps(msg))
+
+    async def seen(self, viewer: str):
+        """A viewer joined: scoped drones offer if idle, old clients offer to everyone new."""
+        if self.fleet.mode == "scoped" and self.counterpart is not None:
+            return
+        self.counterpart = self.counterpart or viewer
+        await self.send({"type": "offer", "to": viewer, "sdp": self.fleet.sdp, "sdpType": "offer"})
+
+    async def read(self):
+        fleet = self.fleet
+        try:
+            async for raw in self.ws:
+                msg = json.loads(raw)
+                t = msg["type"]
+                if self.role == "publisher":
+                    if fleet.measuring:
+                        fleet.to_publishers += 1
+                    if t == "peer-joined":
+                        await self.seen(msg["peer"])
+                    elif t == "presence":
+                        for viewer in msg.get("joined", []):
+                            await self.seen(viewer)
+                    elif t == "error" and msg.get("reason") == "replaced-by-new-connection":
+                        self.kicked = True
+                elif t == "offer":
+                    if msg["from"] != f"publisher-bench-{self.index:05d}" and fleet.mode != "legacy":
+                        fleet.wrong_offers += 1
+                    elif self.paired is None:
+                        self.paired = time.monotonic() - self.started
+                    if fleet.mode == "scoped" and self.counterpart is not None:
+                        continue  # one peer connection, one offer
+                    self.counterpart = msg["from"]
+                    await self.send({"type": "answer", "to": msg["from"], "sdp": fleet.sdp, "sdpType": "answer"})
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+class Fleet:
+    def __init__(self, url: str, mode: str, sdp_size: int):
+        self.url, self.mode = url, mode
+        self.sdp = "v=0\r\n" + "a=x\r\n" * (sdp_size // 5)
+        self.measuring = False
+        self.to_publishers = 0
+        self.wrong_offers = 0
+
+async def connect_all(clients: list, rate: float, concurrency: int = 50):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(c):
+        async with gate:
+            await c.connect()
+
+    tasks = []
+    for c in clients:
+        tasks.append(asyncio.create_task(one(c)))
+        if rate:
+            await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+async def run(args, mode: str) -> dict:
+    proc = start_server(args.port, {"ROOM_CAP": "100000", "MAX_MSGS_PER_SEC": "100000", "OUTBOX_SIZE": "100000",
+                                     "PING_INTERVAL": "3600", "DRAIN_TIMEOUT": "0"})
+    fleet = Fleet(f"ws://127.0.0.1:{args.port}", mode, args.sdp_size)
+    publishers = [Client(fleet, i, "publisher") for i in range(args.publishers)]
+    viewers = [Client(fleet, i, "viewer") for i in range(args.publishers)]
+    try:
+        await connect_all(publishers, 0)
+        await asyncio.sleep(1)
+        fleet.measuring = True
+        cpu = cpu_seconds(proc.pid)
+        started = time.monotonic()
+        await connect_all(viewers, args.viewer_rate)
+        deadline = time.monotonic() + args.settle
+        while time.monotonic() < deadline and any(v.paired is None for v in viewers):
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1)  # late offers from other drones
+        fleet.measuring = False
+        return {
+            "join": [p.joined for p in publishers],
+            "pair": [v.paired for v in viewers if v.paired is not None],
+            "paired": sum(1 for v in viewers if v.paired is not None),
+            "wrong": fleet.wrong_offers,
+            "pushed": fleet.to_publishers,
+            "kicked": sum(1 for p in publishers if p.kicked),
+            "cpu": cpu_seconds(proc.pid) - cpu,
+            "wall": time.monotonic() - started,
+        }
+    finally:
+        for c in publishers + viewers:
+            if c.ws is not None:
+                await c.ws.close()
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="many publishers and their viewers in one signaling room")
+    parser.add_argument("--publishers", type=int, default=500)
+    parser.add_argument("--viewer-rate", type=float, default=100, help="viewer joins per second")
+    parser.add_argument("--sdp-size", type=int, default=2500)
+    parser.add_argument("--settle", type=float, default=60, help="max wait for every viewer to be paired (s)")
+    parser.add_argument("--modes", nargs="+", default=["scoped", "unscoped", "legacy"])
+    parser.add_argument("--port", type=int, default=18995)
+    args = parser.parse_args()
+
+    print(f"publishers={args.publishers} viewers={args.publishers} viewer rate={args.viewer_rate:.0f}/s "
+          f"sdp={args.sdp_size}B")
+    print(f"{'mode':>9} {'join p50':>9} {'join p99':>9} {'pair p50':>9} {'pair p99':>9} {'paired':>8} "
+          f"{'wrong':>7} {'pushed':>8} {'kicked':>7} {'cpu s':>6}")
+    for mode in args.modes:
+        r = asyncio.run(run(args, mode))
+        ms = lambda values, q: pct(values, q) * 1000
+        print(f"{mode:>9} {ms(r['join'], 0.5):>9.1f} {ms(r['join'], 0.99):>9.1f} {ms(r['pair'], 0.5):>9.1f} "
+              f"{ms(r['pair'], 0.99):>9.1f} {r['paired']:>4}/{args.publishers:<3} {r['wrong']:>7} {r['pushed']:>8} "
+              f"{r['kicked']:>7} {r['cpu']:>6.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# bench_flood.py
+"""
+Legitimate peers' routing latency while one abusive client floods the server.
+
+Legitimate load: --pairs rooms of two peers, each pair from its own
+loopback address (127.1.x.y, like peers behind separate NATs); each peer
+sends --rate candidates/s to its partner; latency is send -> receive at the
+other peer (same process, so one clock). Every second a fresh peer connects
+and leaves: connect time is "join ms".
+
+The abuser (a separate process, source 127.0.0.2) opens --flood-conns raw
+websocket connections into room-0 and writes pre-built masked frames
+(candidates for p0) as fast as the sockets take them, plus a loop that opens
+new connections back to back. It never reads.
+
+Scenarios (one fresh server each):
+  quiet:     no abuser
+  unlimited: abuser, no limits (MAX_MSGS_PER_SEC very high)
+  limited:   abuser, peer + IP + room + global buckets and handshake limits
+
+Reported: legitimate peers that got in (up), their latency p50/p99/max,
+messages lost, join ms, what the
+abuser got through (frames routed to p0, connections accepted / refused),
+server CPU.
+
+    python bench_flood.py --pairs 100 --rate 5 --duration 10
+    python bench_flood.py --server /path/to/older/signaling_server_pro.py --scenarios quiet unlimited
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+import argparse
+import statistics
+import multiprocessing
+import urllib.request
+
+import websockets
+
+from loadgen import cpu_seconds, pct, start_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+LIMITS = {"MAX_MSGS_PER_SEC": "50", "IP_MSGS_PER_SEC": "200", "ROOM_MSGS_PER_SEC": "500",
+          "GLOBAL_MSGS_PER_SEC": "20000", "IP_CONNS_PER_SEC": "20", "IP_MAX_CONNS": "100",
+          "GLOBAL_CONNS_PER_SEC": "500"}
+SCENARIOS = {
+    "quiet": ({}, False),
+    "unlimited": ({"MAX_MSGS_PER_SEC": "1000000000"}, True),
+    "limited": (LIMITS, True),
+}
+
+def metric_sum(port: int, name: str) -> float:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as r:
+        lines = r.read().decode().splitlines()
+    return sum(float(l.rsplit(" ", 1)[1]) for l in lines if l.split("{")[0].split(" ")[0] == name)
+
+# ====== abuser ======
+def masked_frame(text: str) -> bytes:
+    """Client text frame with a zero mask key (payload unchanged)."""
+    data = text.encode()
+    n = len(data)
+    head = bytes([0x81]) + (bytes([0x80 | n]) if n < 126 else bytes([0x80 | 126]) + n.to_bytes(2, "big"))
+    return head + b"\0\0\0\0" + data
+
+async def raw_upgrade(port: int, path: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, local_addr=("127.0.0.2", 0))
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode())
+    status = await reader.readuntil(b"\r\n\r\n")
+    return reader, writer, status.split(b" ", 2)[1] == b"101"
+
+async def abuse(port: int, conns: int, stop_at: float, counts):
+    chunk = masked_frame(json.dumps({"type": "candidate", "to": "p0", "candidate": {"candidate": "x" * 40}})) * 500
+
+    async def blaster(i: int):
+        try:
+            _, writer, ok = await raw_upgrade(port, f"/?room=room-0&peer=evil{i}")
+            if not ok:
+                return
+            while time.monotonic() < stop_at:
+                writer.write(chunk)
+                await writer.drain()
+                counts[0] += 500
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+
+    async def churn():
+        n = 0
+        while time.monotonic() < stop_at:
+            try:
+                _, writer, ok = await asyncio.wait_for(raw_upgrade(port, f"/?room=churn&peer=c{n}"), 5)
+                counts[1 if ok else 2] += 1
+                writer.transport.abort()
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                counts[2] += 1
+            n += 1
+
+    await asyncio.gather(*(blaster(i) for i in range(conns)), churn())
+
+def abuser_main(port: int, conns: int, stop_at: float, counts):
+    asyncio.run(abuse(port, conns, stop_at, counts))
+
+# ====== legitimate peers ======
+def legit_ip(n: int) -> str:
+    return f"127.1.{n // 250}.{n % 250 + 1}"
+
+async def legit(args, port: int, stop_at: float) -> dict:
+    url = f"ws://127.0.0.1:{port}"
+    latencies, sent, flood_seen, joins, up = [], [0], [0], [], [0]
+
+    async def reader(ws):
+        async for raw in ws:
+            msg = json.loads(raw)
+            if msg.get("type") != "candidate":
+                continue
+            if msg["from"].startswith("evil"):
+                flood_seen[0] += 1
+            elif "t" in msg:
+                latencies.append(time.monotonic() - msg["t"])
+
+    async def peer(i: int):
+        me, other = f"p{i}", f"p{i ^ 1}"
+        async with websockets.connect(f"{url}?room=room-{i // 2}&peer={me}", ping_interval=None,
+                                      compression=None, max_queue=None, local_addr=(legit_ip(i // 2), 0)) as ws:
+            await ws.recv()
+            up[0] += 1
+            task = asyncio.create_task(reader(ws))
+            await asyncio.sleep(1 + (i % 50) / 50)  # partners joined, sends spread
+            while time.monotonic() < stop_at - 1:
+                await ws.send(json.dumps({"type": "candidate", "to": other, "t": time.monotonic(), "candidate": {}}))
+                sent[0] += 1
+                await asyncio.sleep(1 / args.rate)
+            await asyncio.sleep(1)  # in-flight messages
+            task.cancel()
+
+    async def joiner():
+        n = 0
+        await asyncio.sleep(1.5)
+        while time.monotonic() < stop_at - 1:
+            t0 = time.monotonic()
+            try:
+                async with websockets.connect(f"{url}?room=fresh-{n}&peer=f{n}", ping_interval=None,
+                                              open_timeout=10, local_addr=(legit_ip(args.pairs + n), 0)) as ws:
+                    await ws.recv()
+                    joins.append(time.monotonic() - t0)
+            except Exception:
+                joins.append(float("inf"))
+            n += 1
+            await asyncio.sleep(max(0.0, 1 - (time.monotonic() - t0)))
+
+    await asyncio.gather(*(peer(i) for i in range(2 * args.pairs)), joiner(), return_exceptions=True)
+    return {"latencies": latencies, "sent": sent[0], "flood_seen": flood_seen[0], "joins": joins, "up": up[0]}
+
+def run(args, name: str) -> dict:
+    env, flood = SCENARIOS[name]
+    proc = start_server(args.port, {"HOST": "127.0.0.1", "ROOM_CAP": "100000", "LOG_LEVEL": "ERROR",
+                                     "DRAIN_TIMEOUT": "0", **env}, args.server, quiet=True)
+    try:
+        cpu0 = cpu_seconds(proc.pid)
+        stop_at = time.monotonic() + args.duration
+        counts = multiprocessing.Array("l", 3, lock=False)  # frames written, conns accepted, conns refused
+        abuser = None
+        if flood:
+            abuser = multiprocessing.Process(target=abuser_main, args=(args.port, args.flood_conns, stop_at, counts))
+            abuser.start()
+        result = asyncio.run(legit(args, args.port, stop_at))
+        if abuser:
+            abuser.join(10)
+            abuser.kill()
+        cpu = cpu_seconds(proc.pid) - cpu0
+        limited = metric_sum(args.port, "signaling_rate_limited_total")
+    finally:
+        proc.kill()
+        proc.wait()
+    lat = [x * 1000 for x in result["latencies"]]
+    return {"scenario": name, "p50_ms": pct(lat, 0.5), "p99_ms": pct(lat, 0.99), "max_ms": max(lat, default=float("nan")),
+            "up": result["up"], "lost": result["sent"] - len(lat), "sent": result["sent"],
+            "join_ms": statistics.median(result["joins"]) * 1000 if result["joins"] else float("nan"),
+            "flood_written": counts[0], "flood_routed": result["flood_seen"], "rate_limited": limited,
+            "abuser_conns": f"{counts[1]}/{counts[1] + counts[2]}", "server_cpu": cpu / args.duration}
+
+def main():
+    parser = argparse.ArgumentParser(description="legitimate routing latency under one abusive client")
+    parser.add_argument("--pairs", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=5, help="candidates/s per legitimate peer")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--flood-conns", type=int, default=20, help="abuser's flooding connections")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--server", default=os.path.join(HERE, "signaling_server_pro.py"))
+    parser.add_argument("--port", type=int, default=18920)
+    args = parser.parse_args()
+
+    print(f"pairs={args.pairs} rate={args.rate}/s duration={args.duration}s flood_conns={args.flood_conns}")
+    print(f"{'scenario':>10} {'up':>4} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>8} {'lost':>10} {'join ms':>8} "
+          f"{'flood sent':>11} {'to p0':>7} {'dropped':>8} {'abuser conns':>13} {'cpu':>5}")
+    for name in args.scenarios:
+        r = run(args, name)
+        print(f"{name:>10} {r['up']:>4} {r['p50_ms']:>7.1f} {r['p99_ms']:>7.1f} {r['max_ms']:>8.1f} "
+              f"{str(r['lost']) + '/' + str(r['sent']):>10} {r['join_ms']:>8.1f} {r['flood_written']:>11} "
+              f"{r['flood_routed']:>7} {r['rate_limited']:>8.0f} {r['abuser_conns']:>13} {r['server_cpu']:>5.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# bench_gcs_commands.py
+"""
+GCS commands, UDP -> "gcs_command" data channel: the old select() polling
+loops vs utils.GcsCommandProtocol (loop.create_datagram_endpoint).
+
+A "GCS" subprocess sends --cmd-size byte commands stamped with
+time.monotonic (shared by every process on the host) at --rate/s for
+--duration s, goes quiet for --idle s, then sends a burst of --burst
+commands back to back. --gcs picks how it talks to the viewer:
+
+  client: sends to the port the viewer bound (send_command_from_gcs_client,
+          what viewer_U3 runs)
+  server: waits for "Hello GCS" and answers to where it came from
+          (send_command_from_gcs_server)
+
+Modes (this process, the viewer side, a fake open data channel):
+
+  legacy:   the functions as they were: select(timeout=0), then sleep 5 ms
+            (client) or 5 ms + 100 ms (server) per pass
+  endpoint: send_command_from_gcs_client / _server on GcsCommandProtocol
+
+Reported: latency (stamp -> channel.send, steady phase), commands
+delivered, time for the burst to reach the channel (first stamp -> last
+send), "Hello GCS" the GCS got while idle, and viewer CPU while idle.
+
+    python bench_gcs_commands.py --rate 1000 --duration 10
+"""
+import io
+import os
+import sys
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import contextlib
+import subprocess
+
+from loadgen import pct
+from utils import send_command_from_gcs_client, send_command_from_gcs_server
+
+STAMP = struct.Struct("<dI")
+BURST = 1 << 31  # seq flag for burst commands
+
+# ------------------ GCS (subprocess) ------------------
+def gcs(port: int, role: str, args):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if role == "server":
+        sock.bind(("127.0.0.1", port))
+        print("ready", flush=True)
+        _, viewer = sock.recvfrom(65535)  # "Hello GCS"
+    else:
+        viewer = ("127.0.0.1", port)
+        print("ready", flush=True)
+    pad = b"\x00" * (args.cmd_size - STAMP.size)
+    started = time.monotonic()
+    seq = 0
+    while time.monotonic() - started < args.duration:
+        due = int((time.monotonic() - started) * args.rate) - seq
+        for _ in range(due):
+            sock.sendto(STAMP.pack(time.monotonic(), seq) + pad, viewer)
+            seq += 1
+        time.sleep(0.0002)
+    # idle: count the viewer's "Hello GCS"
+    sock.settimeout(0.05)
+    hellos = 0
+    idle_until = time.monotonic() + args.idle
+    while time.monotonic() < idle_until:
+        try:
+            if sock.recvfrom(65535)[0] == b"Hello GCS":
+                hellos += 1
+        except (socket.timeout, OSError):
+            pass
+    for i in range(args.burst):
+        sock.sendto(STAMP.pack(time.monotonic(), BURST | i) + pad, viewer)
+    time.sleep(1)
+    print(f"{seq} {hellos}", flush=True)
+
+# ------------------ viewer side ------------------
+class FakeChannel:
+    readyState = "open"
+    bufferedAmount = 0  # never congested: utils.ChannelSender passes everything straight through
+    bufferedAmountLowThreshold = 0
+
+    def __init__(self):
+        self.latency = []
+        self.burst_first = None
+        self.burst_last = None
+        self.burst_got = 0
+
+    def on(self, event, handler):
+        pass
+
+    def send(self, data: bytes):
+        now = time.monotonic()
+        stamp, seq = STAMP.unpack_from(data)
+        if seq & BURST:
+            self.burst_first = stamp if self.burst_first is None else min(self.burst_first, stamp)
+            self.burst_last = now
+            self.burst_got += 1
+        else:
+            self.latency.append(now - stamp)
+
+async def legacy_client(channel, lost_event, udp_sock, GCS_IP, TELEMETRY_PORT):
+    """send_command_from_gcs_client before GcsCommandProtocol."""
+    import select
+    udp_sock.bind((GCS_IP, TELEMETRY_PORT))
+    udp_sock.setblocking(False)
+    while not lost_event.is_set():
+        rlist, _, _ = select.select([udp_sock], [], [], 0)
+        while rlist:
+            packet, addr = udp_sock.recvfrom(65535)
+            if channel.readyState == "open":
+                channel.send(packet)
+            rlist, _, _ = select.select([udp_sock], [], [], 0)
+        await asyncio.sleep(0.005)
+
+async def legacy_server(channel, lost_event, udp_sock, GCS_IP, TELEMETRY_PORT):
+    """send_command_from_gcs_server before GcsCommandProtocol."""
+    import select
+    udp_sock.setblocking(False)
+    udp_sock.sendto(b"Hello GCS", (GCS_IP, TELEMETRY_PORT))
+    last_recv_time = time.time()
+    while not lost_event.is_set():
+        rlist, _, _ = select.select([udp_sock], [], [], 0)
+        if rlist:
+            packet, addr = udp_sock.recvfrom(65535)
+            last_recv_time = time.time()
+            if channel.readyState == "open":
+                channel.send(packet)
+        else:
+            await asyncio.sleep(0.005)
+        if time.time() - last_recv_time >= 2.0:
+            udp_sock.sendto(b"Hello GCS", (GCS_IP, TELEMETRY_PORT))
+            last_recv_time = time.time()
+        await asyncio.sleep(0.1)
+
+async def run(args, mode: str) -> dict:
+    loop = asyncio.get_running_loop()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--gcs-sender", str(args.port), "--gcs", args.gcs,
+                             "--rate", str(args.rate), "--duration", str(args.duration), "--idle", str(args.idle),
+                             "--burst", str(args.burst), "--cmd-size", str(args.cmd_size)], stdout=subprocess.PIPE)
+    await loop.run_in_executor(None, proc.stdout.readline)  # "ready"
+    channel, lost_event = FakeChannel(), asyncio.Event()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if mode == "legacy":
+        forward = legacy_server if args.gcs == "server" else legacy_client
+    else:
+        forward = send_command_from_gcs_server if args.gcs == "server" else send_command_from_gcs_client
+    task = asyncio.create_task(forward(channel, lost_event, sock, "127.0.0.1", args.port))
+
+    # viewer CPU over the middle of the idle phase
+    await asyncio.sleep(args.duration + args.idle * 0.25)
+    cpu, t = time.process_time(), time.monotonic()
+    await asyncio.sleep(args.idle * 0.5)
+    idle_cpu = (time.process_time() - cpu) / (time.monotonic() - t)
+
+    out, _ = await loop.run_in_executor(None, proc.communicate)
+    lost_event.set()
+    await asyncio.wait_for(task, 5)
+    sock.close()
+    sent, hellos = map(int, out.split())
+    return {
+        "lat50": pct(channel.latency, 0.5) * 1000, "lat99": pct(channel.latency, 0.99) * 1000,
+        "latmax": max(channel.latency, default=float("nan")) * 1000,
+        "got": len(channel.latency) / sent,
+        "burst": (channel.burst_last - channel.burst_first) * 1000 if channel.burst_got else float("nan"),
+        "burst_got": channel.burst_got, "hellos": hellos, "cpu": idle_cpu * 100,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="GCS UDP commands -> data channel: select polling vs datagram endpoint")
+    parser.add_argument("--gcs", choices=("client", "server"), default="client")
+    parser.add_argument("--rate", type=float, default=1000, help="commands per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--idle", type=float, default=5, help="quiet seconds before the burst")
+    parser.add_argument("--burst", type=int, default=200, help="commands sent back to back")
+    parser.add_argument("--cmd-size", type=int, default=64, help="bytes per command")
+    parser.add_argument("--modes", nargs="+", default=["legacy", "endpoint"])
+    parser.add_argument("--port", type=int, default=18996)
+    parser.add_argument("--gcs-sender", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.gcs_sender is not None:
+        gcs(args.gcs_sender, args.gcs, args)
+        return
+    print(f"gcs={args.gcs} rate={args.rate:g}/s cmd={args.cmd_size}B duration={args.duration:g}s "
+          f"idle={args.idle:g}s burst={args.burst}")
+    print(f"{'mode':>9} {'lat p50':>8} {'lat p99':>8} {'lat max':>8} {'got':>7} {'burst ms':>9} {'burst got':>10} "
+          f"{'hellos':>7} {'idle cpu %':>11}")
+    for mode in args.modes:
+        with contextlib.redirect_stdout(io.StringIO()):  # "UDP server is listening", "Resent Hello GCS"
+            r = asyncio.run(run(args, mode))
+        print(f"{mode:>9} {r['lat50']:>8.2f} {r['lat99']:>8.2f} {r['latmax']:>8.1f} {r['got']:>7.1%} {r['burst']:>9.2f} "
+              f"{r['burst_got']:>5}/{args.burst:<4} {r['hellos']:>7} {r['cpu']:>11.2f}")
+
+if __name__ == "__main__":
+    main()
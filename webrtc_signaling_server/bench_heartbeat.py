@@ -0,0 +1,129 @@
+# bench_heartbeat.py
+"""
+Memory and event-loop work per idle connection: one heartbeat task per
+connection (the old handler) vs the shared HeartbeatWheel.
+
+Runs in-process with fake idle connections whose pong is already there, so
+only the heartbeat machinery is measured. PING_INTERVAL etc. are scaled down
+so a few seconds cover several ping rounds. In wheel mode the bytes include
+the whole Session record, which carries the heartbeat state.
+
+    python bench_heartbeat.py --conns 10000 --interval 1 --duration 5
+"""
+import os
+import asyncio
+import argparse
+import tracemalloc
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("STATS_INTERVAL", "0")
+
+from signaling_server_pro import HeartbeatWheel, Session
+
+class CountingLoop(asyncio.SelectorEventLoop):
+    """Counts loop iterations, timers and ready callbacks."""
+
+    def __init__(self):
+        super().__init__()
+        self.iterations = 0
+        self.timers = 0
+        self.callbacks = 0
+
+    def _run_once(self):
+        self.iterations += 1
+        super()._run_once()
+
+    def call_at(self, when, callback, *args, context=None):
+        self.timers += 1
+        return super().call_at(when, callback, *args, context=context)
+
+    def _call_soon(self, callback, args, context):
+        self.callbacks += 1
+        return super()._call_soon(callback, args, context)
+
+class IdleWs:
+    """A connection that never sends anything and always answers pings."""
+
+    async def ping(self):
+        pong = asyncio.get_running_loop().create_future()
+        pong.set_result(0.0)
+        return pong
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+async def task_per_connection(conns, interval, timeout):
+    # the pre-wheel heartbeat loop from signaling_server_pro.handler
+    async def heartbeat(ws):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                pong_waiter = await ws.ping()
+                await asyncio.wait_for(pong_waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            await ws.close(code=1011, reason="ping-timeout")
+
+    tasks = [asyncio.create_task(heartbeat(ws)) for ws in conns]
+    await asyncio.sleep(0)
+
+    async def stop():
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return stop
+
+async def shared_wheel(conns, interval, timeout, tick):
+    wheel = HeartbeatWheel(interval, timeout, tick)
+    sessions = [Session(ws) for ws in conns]
+    for i, s in enumerate(sessions):
+        s.peer_id = f"p{i}"
+        wheel.add(s)
+    await asyncio.sleep(0)
+
+    async def stop():
+        for s in sessions:
+            wheel.remove(s)
+        await asyncio.sleep(2 * tick)  # let the wheel task notice it is empty
+    return stop
+
+async def measure(mode, args):
+    loop = asyncio.get_running_loop()
+    conns = [IdleWs() for _ in range(args.conns)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    if mode == "task":
+        stop = await task_per_connection(conns, args.interval, args.timeout)
+    else:
+        stop = await shared_wheel(conns, args.interval, args.timeout, args.tick)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    mem = sum(s.size_diff for s in after.compare_to(before, "filename"))
+
+    loop.iterations = loop.timers = loop.callbacks = 0
+    await asyncio.sleep(args.duration)
+    counts = (loop.iterations, loop.timers, loop.callbacks)
+    await stop()
+    return mem, counts
+
+def main():
+    parser = argparse.ArgumentParser(description="heartbeat cost per idle connection")
+    parser.add_argument("--conns", type=int, default=10000)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    parser.add_argument("--tick", type=float, default=0.1)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"conns={args.conns} interval={args.interval}s timeout={args.timeout}s tick={args.tick}s")
+    print(f"{'mode':>6} {'bytes/conn':>11} {'wakeups/s':>10} {'timers/conn/s':>14} {'callbacks/conn/s':>17}")
+    for mode in ("task", "wheel"):
+        loop = CountingLoop()
+        try:
+            mem, (iterations, timers, callbacks) = loop.run_until_complete(measure(mode, args))
+        finally:
+            loop.close()
+        n, d = args.conns, args.duration
+        print(f"{mode:>6} {mem / n:>11.0f} {iterations / d:>10.0f} {timers / n / d:>14.2f} {callbacks / n / d:>17.2f}")
+
+if __name__ == "__main__":
+    main()
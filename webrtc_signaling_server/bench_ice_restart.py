@@ -0,0 +1,182 @@
+# bench_ice_restart.py
+"""
+Media outage after a network fault: graded recovery (utils.IceRecovery) vs
+rebuilding the peer connection.
+
+A publisher (test video track) and a viewer connect through a local server
+with signaling_loop_pro, each in a loop like publisher_U3 / viewer_U3: when
+lost_event fires, close the peer connection, wait PC_RETRY_TIME, build a new
+one. Faults are injected in aioice (StunProtocol.datagram_received drops
+packets), so only the media path breaks, the websocket stays up:
+
+  blip:     every ICE socket drops everything for --blip s (shorter than the grace)
+  handover: the publisher's current ICE sockets go dead for good (its address
+            changed: a new uplink, a DHCP renewal); new sockets work
+
+Per trial the outage is the viewer's frame gap across the fault: last decoded
+frame before it -> first frame after it. Modes:
+
+  graded:     IceRecovery(restarts=ICE_RESTARTS): wait ICE_DISCONNECTED_GRACE,
+              then ICE restart, rebuild only if that fails
+  no-restart: IceRecovery(restarts=0): rebuild once the grace is over
+  legacy:     no IceRecovery: rebuild on "failed", i.e. when aioice consent
+              expires (~30s)
+
+The camera is a test track, so the camera re-probe a real rebuild also pays
+(udp_multicast_track in publisher_U3) is not in these numbers.
+
+    python bench_ice_restart.py --trials 3 --blip 1
+"""
+import io
+import os
+import time
+import asyncio
+import argparse
+import contextlib
+
+from aioice import ice
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from loadgen import pct, start_server
+from config import PC_RETRY_TIME, ICE_CHECK_INTERVAL, ICE_DISCONNECTED_GRACE, ICE_RESTART_TIMEOUT, ICE_RESTARTS
+from utils import IceRecovery, PeerSignaling, ice_transport, signaling_loop_pro
+
+# ------------------ fault injection ------------------
+blackout_until = 0.0
+dead = set()  # (host, port) of ICE sockets that no longer exist
+_datagram_received = ice.StunProtocol.datagram_received
+
+def datagram_received(self, data, addr):
+    if time.monotonic() < blackout_until or addr in dead or self.transport.get_extra_info("sockname") in dead:
+        return
+    _datagram_received(self, data, addr)
+
+ice.StunProtocol.datagram_received = datagram_received
+
+def no_icecandidate(candidate):
+    pass  # aiortc puts its candidates in the SDP
+
+class Peer:
+    """publisher_U3 / viewer_U3 run() loop: one peer connection at a time, rebuilt when lost."""
+    def __init__(self, role: str, url: str, mode: str, frames: list = None):
+        self.role, self.url, self.mode, self.frames = role, url, mode, frames
+        self.pc = None
+        self.recovery = None
+        self.builds = 0
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            pc = self.pc = RTCPeerConnection()
+            lost = asyncio.Event()
+            signal = PeerSignaling(pc, self.role)
+            self.recovery = None
+            if self.mode != "legacy":
+                self.recovery = IceRecovery(pc, signal, lost, ICE_CHECK_INTERVAL, ICE_DISCONNECTED_GRACE,
+                                            ICE_RESTART_TIMEOUT, ICE_RESTARTS if self.mode == "graded" else 0)
+            self.builds += 1
+            if self.role == "publisher":
+                pc.addTrack(VideoStreamTrack())
+            else:
+                @pc.on("track")
+                def on_track(track):
+                    async def pump():
+                        try:
+                            while True:
+                                await track.recv()
+                                self.frames.append(time.monotonic())
+                        except Exception:
+                            pass
+                    asyncio.ensure_future(pump())
+
+            @pc.on("connectionstatechange")
+            def on_state():
+                if pc.connectionState in ("failed", "closed"):
+                    lost.set()
+
+            task = asyncio.create_task(signaling_loop_pro(pc, lost, no_icecandidate, self.role, 3, self.url, signal))
+            await lost.wait()
+            task.cancel()
+            await pc.close()
+            await asyncio.sleep(PC_RETRY_TIME)
+
+    async def close(self):
+        self.task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.task
+        with contextlib.suppress(asyncio.CancelledError):  # cancelled half way through a rebuild's close()
+            await self.pc.close()
+
+async def flowing(frames: list, since: float, timeout: float) -> bool:
+    """Frames arriving steadily (>= 10 in the last second) after `since`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        if sum(1 for t in frames[-40:] if t > max(since, now - 1)) >= 10:
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+async def trial(args, mode: str, fault: str) -> dict:
+    global blackout_until
+    port = args.port
+    proc = start_server(port, {"DRAIN_TIMEOUT": "0"}, quiet=True)
+    frames = []
+    publisher = Peer("publisher", f"ws://127.0.0.1:{port}", mode)
+    viewer = Peer("viewer", f"ws://127.0.0.1:{port}", mode, frames)
+    try:
+        if not await flowing(frames, 0, 30):
+            return {"outage": float("nan"), "path": "no start"}
+        await asyncio.sleep(1)
+        builds = publisher.builds + viewer.builds
+        t0 = time.monotonic()
+        before = frames[-1]
+        if fault == "blip":
+            blackout_until = t0 + args.blip
+        else:
+            dead.update(p.transport.get_extra_info("sockname") for p in ice_transport(publisher.pc)._connection._protocols)
+            if publisher.recovery is not None and publisher.recovery.connection is not None:
+                dead.update(p.transport.get_extra_info("sockname") for p in publisher.recovery.connection._protocols)
+        recovered = await flowing(frames, t0, args.limit)
+        after = next((t for t in frames if t > t0), None)
+        rebuilds = publisher.builds + viewer.builds - builds
+        restarted = any(state == "restarting" for t, state in (publisher.recovery.events if publisher.recovery else [])
+                        if t > t0)
+        path = "rebuild" if rebuilds else "ice restart" if restarted else "rode it out"
+        if not recovered or after is None:
+            return {"outage": float("nan"), "path": "no recovery"}
+        return {"outage": (after - before) * 1000, "path": path}
+    finally:
+        blackout_until = 0.0
+        dead.clear()
+        await publisher.close()
+        await viewer.close()
+        proc.kill()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="media outage: ICE restart vs peer connection rebuild")
+    parser.add_argument("--trials", type=int, default=3)
+    parser.add_argument("--blip", type=float, default=1.0, help="blackout length for the blip fault (s)")
+    parser.add_argument("--limit", type=float, default=60, help="give up on a trial after this many seconds")
+    parser.add_argument("--modes", nargs="+", default=["graded", "no-restart", "legacy"])
+    parser.add_argument("--faults", nargs="+", default=["blip", "handover"])
+    parser.add_argument("--port", type=int, default=18970)
+    args = parser.parse_args()
+
+    print(f"grace={ICE_DISCONNECTED_GRACE}s check={ICE_CHECK_INTERVAL}s PC_RETRY_TIME={PC_RETRY_TIME}s "
+          f"blip={args.blip}s trials={args.trials}")
+    print(f"{'fault':>9} {'mode':>11} {'outage p50 ms':>14} {'max ms':>8}  path")
+    for fault in args.faults:
+        for mode in args.modes:
+            results = []
+            for _ in range(args.trials):
+                with contextlib.redirect_stdout(io.StringIO()):  # signaling_loop_pro is chatty
+                    results.append(asyncio.run(trial(args, mode, fault)))
+            outages = [r["outage"] for r in results]
+            paths = sorted({r["path"] for r in results})
+            print(f"{fault:>9} {mode:>11} {pct(outages, 0.5):>14.0f} "
+                  f"{max((o for o in outages if o == o), default=float('nan')):>8.0f}  {', '.join(paths)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# bench_pool.py
+"""
+Viewer join -> first frame with and without the publisher's pool of warm
+peer connections (utils.PeerConnectionPool).
+
+Both peers use a STUN + TURN server that answers after --ice-rtt ms (a small
+responder in this file: binding, allocate with the usual 401 round, refresh,
+permission and channel bind; relayed data is dropped, so media takes the
+host pair). Gathering therefore costs what it costs against a real server on
+the internet: one RTT for the srflx candidate, two for the TURN allocation.
+
+One server, one publisher in room "home" running signaling_loop_pro like
+publisher_U3 (test video track, "telemetry" channel, PeerSignaling), rebuilt
+after every viewer. Per trial a viewer joins (signaling_loop_pro, same ICE
+servers) and we time, from its start:
+
+  offer ms: publisher's offer arrives (remote description set)
+  frame ms: first decoded video frame
+
+  cold: the publisher creates the offer (and gathers) on peer-joined
+  pool: the publisher took a warm pc from the pool, the offer goes out at once
+
+The viewer's own gathering (for its answer) is on the path in both modes.
+
+    python bench_pool.py --ice-rtt 150 --trials 10
+"""
+import io
+import os
+import time
+import asyncio
+import argparse
+import contextlib
+
+from aioice import stun
+from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection, VideoStreamTrack
+
+from loadgen import pct, start_server
+from utils import PeerConnectionPool, PeerSignaling, signaling_loop_pro
+
+class SlowIceServer(asyncio.DatagramProtocol):
+    """STUN / TURN over UDP answering after `delay` seconds. Allocations are fake: relayed data is dropped."""
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.transport = None
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            request = stun.parse_message(data)
+        except ValueError:
+            return  # channel data
+        if request.message_class != stun.Class.REQUEST:
+            return  # send indication
+        self.requests += 1
+        response = stun.Message(message_method=request.message_method, message_class=stun.Class.RESPONSE,
+                                transaction_id=request.transaction_id)
+        if request.message_method == stun.Method.BINDING:
+            response.attributes["XOR-MAPPED-ADDRESS"] = addr
+        elif request.message_method == stun.Method.ALLOCATE and "MESSAGE-INTEGRITY" not in request.attributes:
+            response.message_class = stun.Class.ERROR
+            response.attributes["ERROR-CODE"] = (401, "Unauthorized")
+            response.attributes["REALM"] = "bench"
+            response.attributes["NONCE"] = b"nonce"
+        elif request.message_method == stun.Method.ALLOCATE:
+            response.attributes["XOR-RELAYED-ADDRESS"] = ("127.0.0.1", 9)
+            response.attributes["XOR-MAPPED-ADDRESS"] = addr
+            response.attributes["LIFETIME"] = 600
+        elif request.message_method == stun.Method.REFRESH:
+            response.attributes["LIFETIME"] = request.attributes.get("LIFETIME", 600)
+        asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, bytes(response), addr)
+
+def no_icecandidate(candidate):
+    pass  # aiortc puts its candidates in the SDP
+
+async def publisher(url: str, config: RTCConfiguration, pool: PeerConnectionPool, ready: asyncio.Event):
+    """publisher_U3's loop: one peer connection per viewer, rebuilt when it is lost."""
+    while True:
+        if pool is not None:
+            pc, signal = await pool.get()
+        else:
+            pc, signal = new_peer(config)
+        lost = asyncio.Event()
+
+        @pc.on("connectionstatechange")
+        async def on_state():
+            if pc.connectionState in ("failed", "closed"):
+                lost.set()
+
+        task = asyncio.create_task(signaling_loop_pro(pc, lost, no_icecandidate, "publisher", 3, url, signal))
+        ready.set()
+        await lost.wait()
+        ready.clear()
+        task.cancel()
+        await pc.close()
+        await asyncio.sleep(0.2)
+
+def new_peer(config: RTCConfiguration):
+    pc = RTCPeerConnection(config)
+    pc.addTrack(VideoStreamTrack())
+    pc.createDataChannel("telemetry")
+    return pc, PeerSignaling(pc, "publisher")
+
+async def viewer(url: str, config: RTCConfiguration) -> tuple:
+    pc = RTCPeerConnection(config)
+    lost = asyncio.Event()
+    pc.createDataChannel("gcs_command")
+    first_frame = asyncio.get_running_loop().create_future()
+
+    @pc.on("track")
+    def on_track(track):
+        async def read():
+            await track.recv()
+            if not first_frame.done():
+                first_frame.set_result(time.monotonic())
+        asyncio.ensure_future(read())
+
+    t0 = time.monotonic()
+    task = asyncio.create_task(signaling_loop_pro(pc, lost, no_icecandidate, "viewer", 3, url))
+    offered = None
+    try:
+        while offered is None and time.monotonic() - t0 < 15:
+            if pc.remoteDescription is not None:
+                offered = time.monotonic()
+            await asyncio.sleep(0.002)
+        frame = await asyncio.wait_for(first_frame, 15)
+        return (offered - t0) * 1000, (frame - t0) * 1000
+    except (asyncio.TimeoutError, TypeError):
+        return float("nan"), float("nan")
+    finally:
+        task.cancel()
+        await pc.close()
+
+async def run(args, mode: str) -> list:
+    loop = asyncio.get_running_loop()
+    ice, _ = await loop.create_datagram_endpoint(lambda: SlowIceServer(args.ice_rtt / 1000), ("127.0.0.1", args.port + 1))
+    config = RTCConfiguration(iceServers=[
+        RTCIceServer(urls=[f"stun:127.0.0.1:{args.port + 1}"]),
+        RTCIceServer(urls=[f"turn:127.0.0.1:{args.port + 1}"], username="bench", credential="bench"),
+    ])
+    proc = start_server(args.port, {"DRAIN_TIMEOUT": "0"}, quiet=True)
+    url = f"ws://127.0.0.1:{args.port}"
+    pool = PeerConnectionPool(lambda: new_peer(config), 1) if mode == "pool" else None
+    ready = asyncio.Event()
+    pub = asyncio.create_task(publisher(url, config, pool, ready))
+    results = []
+    try:
+        for _ in range(args.trials):
+            await ready.wait()
+            await asyncio.sleep(1.5)  # publisher seated, pool refilled
+            results.append(await viewer(url, config))
+            await asyncio.sleep(0.5)  # publisher sees the viewer leave
+    finally:
+        pub.cancel()
+        if pool is not None:
+            await pool.close()
+        ice.close()
+        proc.terminate()
+        proc.wait()
+    return results, pool.stats if pool is not None else None
+
+def main():
+    parser = argparse.ArgumentParser(description="viewer join -> first frame with and without a warm peer connection pool")
+    parser.add_argument("--ice-rtt", type=float, default=150, help="round trip to the STUN/TURN server (ms)")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--port", type=int, default=18980)
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("cold", "pool"):
+        with contextlib.redirect_stdout(io.StringIO()):  # signaling_loop_pro is chatty
+            results[mode] = asyncio.run(run(args, mode))
+    print(f"ice rtt={args.ice_rtt:.0f}ms trials={args.trials}")
+    print(f"{'mode':>5} {'ok':>5} {'offer p50':>10} {'offer p90':>10} {'frame p50':>10} {'frame p90':>10}  pool")
+    for mode, (res, stats) in results.items():
+        offers, frames = [o for o, _ in res], [f for _, f in res]
+        ok = sum(1 for f in frames if f == f)
+        print(f"{mode:>5} {ok:>2}/{len(res):<2} {pct(offers, 0.5):>10.0f} {pct(offers, 0.9):>10.0f} "
+              f"{pct(frames, 0.5):>10.0f} {pct(frames, 0.9):>10.0f}  {stats or ''}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# bench_presence.py
+"""
+Join/leave churn in one big room: how many presence messages the server
+pushes, and how much server CPU that costs.
+
+One publisher and --peers - 1 viewers join a room. Then --storm viewers drop
+and reconnect all at once (a reconnect storm), --rounds times. For each
+storm we count the messages every client receives, the server's CPU time
+(/proc, so Linux only) and how long until the publisher has seen every
+viewer come back.
+
+Compare the old behaviour (no roles, PRESENCE_WINDOW=0: every join/leave is
+sent to every member at once) with role-scoped, batched presence:
+
+    python bench_presence.py --peers 1000 --no-roles --window 0
+    python bench_presence.py --peers 5000 --window 0.05
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import websockets
+
+from loadgen import cpu_seconds, start_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class Room:
+    """The bench's side of the room: client connections and what they received."""
+
+    def __init__(self, url: str, roles: bool):
+        self.url = url
+        self.roles = roles
+        self.received = 0
+        self.back = set()  # viewers the publisher saw (re)join
+        self.readers = {}
+
+    async def connect(self, peer: str, role: str):
+        q = f"?room=big&peer={peer}" + (f"&role={role}" if self.roles else "")
+        ws = await websockets.connect(self.url + q, ping_interval=None, compression=None, max_queue=None)
+        await ws.recv()  # peers
+        self.readers[peer] = asyncio.create_task(self._read(ws, role == "publisher"))
+        return ws
+
+    async def _read(self, ws, publisher: bool):
+        try:
+            async for raw in ws:
+                self.received += 1
+                if publisher:
+                    msg = json.loads(raw)
+                    if msg["type"] == "peer-joined":
+                        self.back.add(msg["peer"])
+                    elif msg["type"] == "presence":
+                        self.back.update(msg["joined"])
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+async def run(args, pid: int):
+    room = Room(f"ws://127.0.0.1:{args.port}", not args.no_roles)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def join(peer: str, role: str):
+        async with sem:
+            return await room.connect(peer, role)
+
+    t0 = time.perf_counter()
+    await room.connect("pub", "publisher")
+    viewers = dict(zip((f"v{i}" for i in range(args.peers - 1)),
+                       await asyncio.gather(*(join(f"v{i}", "viewer") for i in range(args.peers - 1)))))
+    await asyncio.sleep(1)
+    print(f"  joined {args.peers} peers in {time.perf_counter() - t0:.1f}s")
+
+    results = []
+    for r in range(args.rounds):
+        stormers = [f"v{(r * args.storm + i) % (args.peers - 1)}" for i in range(args.storm)]
+        room.received = 0
+        room.back.clear()
+        c0 = cpu_seconds(pid)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(viewers[p].close() for p in stormers))
+        new = await asyncio.gather(*(join(p, "viewer") for p in stormers))
+        viewers.update(zip(stormers, new))
+        deadline = t0 + args.timeout
+        while not room.back.issuperset(stormers) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.005)
+        settle = time.perf_counter() - t0
+        await asyncio.sleep(0.5)  # let the fan-out finish before reading the counters
+        results.append((room.received, cpu_seconds(pid) - c0, settle))
+
+    for ws in viewers.values():
+        await ws.close()
+    for t in room.readers.values():
+        t.cancel()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="presence traffic under join/leave churn")
+    parser.add_argument("--server", default=os.path.join(HERE, "signaling_server_pro.py"))
+    parser.add_argument("--peers", type=int, default=5000)
+    parser.add_argument("--storm", type=int, default=200, help="viewers that reconnect at once")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--window", type=float, default=0.05, help="PRESENCE_WINDOW for the server")
+    parser.add_argument("--no-roles", action="store_true", help="connect without ?role= (everyone sees everyone)")
+    parser.add_argument("--concurrency", type=int, default=100, help="in-flight handshakes")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=18895)
+    args = parser.parse_args()
+
+    print(f"server={os.path.basename(args.server)} peers={args.peers} storm={args.storm} "
+          f"roles={'off' if args.no_roles else 'on'} window={args.window}s")
+    proc = start_server(args.port, {"ROOM_CAP": "1000000", "MAX_MSGS_PER_SEC": "1000000", "OUTBOX_SIZE": "1000000",
+                                     "PING_INTERVAL": "3600", "PRESENCE_WINDOW": str(args.window)}, args.server)
+    try:
+        results = asyncio.run(run(args, proc.pid))
+    finally:
+        proc.terminate()
+        proc.wait()
+    print(f"{'round':>6} {'msgs received':>14} {'msgs/stormer':>13} {'server cpu s':>13} {'settle s':>9}")
+    for r, (received, cpu, settle) in enumerate(results):
+        print(f"{r:>6} {received:>14} {received / args.storm:>13.1f} {cpu:>13.2f} {settle:>9.2f}")
+
+if __name__ == "__main__":
+    main()
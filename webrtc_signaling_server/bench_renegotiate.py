@@ -0,0 +1,144 @@
+# bench_renegotiate.py
+"""
+Renegotiation latency once a session is up: over the peers' "signaling" data
+channel (utils.PeerSignaling) vs through the signaling server.
+
+A publisher (test video track) and a viewer connect through the server with
+signaling_loop_pro. Both reach the server through a TCP proxy delaying every
+chunk by --rtt/2 each way (an internet-hosted server); media and the data
+channel stay on localhost. Then --renegotiations times, one after another:
+
+  publisher: PeerSignaling.renegotiate() on the publisher (new offer)
+  viewer:    PeerSignaling.renegotiate() on the viewer ("renegotiate" ->
+             publisher offers)
+
+timed until the publisher is back in "stable" with the viewer's answer.
+Last, the server is killed and the publisher renegotiates once more: over the
+data channel this still works and frames keep arriving; without it there is
+nothing to send through.
+
+Modes: p2p (channel, websocket as fallback) and websocket (PeerSignaling
+with p2p=False), one fresh server each.
+
+    python bench_renegotiate.py --rtt 200 --renegotiations 20
+"""
+import io
+import os
+import time
+import asyncio
+import argparse
+import contextlib
+
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from loadgen import pct, start_server
+from bench_tls import DelayProxy
+from utils import PeerSignaling, signaling_loop_pro
+
+def no_icecandidate(candidate):
+    pass  # aiortc puts its candidates in the SDP
+
+class Side:
+    def __init__(self, role: str, url: str, p2p: bool, frames: list = None):
+        self.pc = RTCPeerConnection()
+        self.lost = asyncio.Event()
+        self.stable = asyncio.Event()
+        self.signal = PeerSignaling(self.pc, role, p2p)
+        if role == "publisher":
+            self.pc.addTrack(VideoStreamTrack())
+        else:
+            @self.pc.on("track")
+            def on_track(track):
+                async def pump():
+                    try:
+                        while True:
+                            await track.recv()
+                            frames.append(time.monotonic())
+                    except Exception:
+                        pass
+                asyncio.ensure_future(pump())
+
+        @self.pc.on("signalingstatechange")
+        def on_signaling_state():
+            if self.pc.signalingState == "stable":
+                self.stable.set()
+
+        self.task = asyncio.create_task(signaling_loop_pro(self.pc, self.lost, no_icecandidate, role, 3, url, self.signal))
+
+    async def close(self):
+        self.task.cancel()
+        await self.pc.close()
+
+async def renegotiation(publisher: Side, initiator: Side, timeout: float = 10) -> float:
+    publisher.stable.clear()
+    t0 = time.monotonic()
+    try:
+        if not await initiator.signal.renegotiate():
+            return float("nan")
+        await asyncio.wait_for(publisher.stable.wait(), timeout)
+    except (ConnectionError, asyncio.TimeoutError):
+        return float("nan")
+    return (time.monotonic() - t0) * 1000
+
+async def run(args, p2p: bool) -> dict:
+    port = args.port
+    proc = start_server(port, {"DRAIN_TIMEOUT": "0"}, quiet=True)
+    proxy = DelayProxy(port, args.rtt / 1000)
+    await proxy.start(port + 1)
+    frames = []
+    publisher = Side("publisher", f"ws://127.0.0.1:{port + 1}", p2p)
+    viewer = Side("viewer", f"ws://127.0.0.1:{port + 1}", p2p, frames)
+    times = {"publisher": [], "viewer": []}
+    try:
+        for _ in range(200):
+            if publisher.signal.channel.readyState == "open" and frames:
+                break
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(0.5)
+        for i in range(args.renegotiations):
+            for name, initiator in (("publisher", publisher), ("viewer", viewer)):
+                times[name].append(await renegotiation(publisher, initiator))
+                await asyncio.sleep(0.05)
+        sent = dict(publisher.signal.sent)
+        proc.kill()
+        proc.wait()
+        await asyncio.sleep(0.5)
+        outage = await renegotiation(publisher, publisher, 5)
+        seen = len(frames)
+        await asyncio.sleep(1)
+        return {"times": times, "sent": sent, "outage": outage, "frames_after": len(frames) - seen,
+                "state": publisher.pc.connectionState}
+    finally:
+        await publisher.close()
+        await viewer.close()
+        proxy.server.close()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="renegotiation over the data channel vs the signaling server")
+    parser.add_argument("--rtt", type=float, default=200, help="emulated round trip peer <-> server (ms)")
+    parser.add_argument("--renegotiations", type=int, default=20)
+    parser.add_argument("--port", type=int, default=18960)
+    args = parser.parse_args()
+
+    results = {}
+    for mode, p2p in (("p2p", True), ("websocket", False)):
+        with contextlib.redirect_stdout(io.StringIO()):  # signaling_loop_pro is chatty
+            results[mode] = asyncio.run(run(args, p2p))
+    print(f"rtt={args.rtt:.0f}ms renegotiations={args.renegotiations} (start -> publisher stable again)")
+    print(f"{'mode':>10} {'initiator':>10} {'ok':>6} {'p50 ms':>7} {'p90 ms':>7} {'max ms':>7} {'sent p2p/ws':>12} "
+          f"{'server down: ms':>16} {'frames 1s':>10}")
+    for mode, r in results.items():
+        for name, times in r["times"].items():
+            ok = sum(1 for t in times if t == t)
+            extra = ""
+            if name == "viewer":
+                extra = f" {r['outage']:>16.1f} {r['frames_after']:>10}"
+            print(f"{mode:>10} {name:>10} {ok:>3}/{len(times):<2} {pct(times, 0.5):>7.1f} {pct(times, 0.9):>7.1f} "
+                  f"{max((t for t in times if t == t), default=float('nan')):>7.1f} "
+                  f"{str(r['sent']['p2p']) + '/' + str(r['sent']['ws']):>12}{extra}")
+
+if __name__ == "__main__":
+    main()
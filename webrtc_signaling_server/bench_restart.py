@@ -0,0 +1,226 @@
+# bench_restart.py
+"""
+Restart the signaling server under N connected peers and watch the
+reconnect storm.
+
+The server is sent SIGTERM and a new one is started on the same port right
+away (the old one stops listening as soon as it drains, or exits at once
+with DRAIN_TIMEOUT=0). Two set-ups:
+
+  legacy: DRAIN_TIMEOUT=0, clients wait a fixed `timeout` before
+          reconnecting (signaling_loop_pro before drain support): every
+          client comes back in the same instant.
+  drain:  the old server closes rooms over DRAIN_TIMEOUT s with a
+          reconnect-after hint; clients honor it and otherwise use
+          utils.reconnect_delay (jittered exponential backoff).
+
+Sampled every --sample s: server CPU (old + new process, /proc), listen
+socket accept-queue depth (/proc/net/tcp rx_queue of the LISTEN socket),
+TCP ListenOverflows (/proc/net/netstat), peers connected and joins. Prints
+a timeline with bars; --csv writes the raw samples for plotting. Linux only.
+
+    python bench_restart.py --peers 10000
+    python bench_restart.py --peers 10000 --mode drain --drain 10 --csv restart.csv
+"""
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+
+import websockets
+
+from loadgen import cpu_seconds, start_server
+from utils import reconnect_delay
+
+def accept_queue(port: int) -> int:
+    """Connections waiting in the accept queue of the listening socket(s) on port."""
+    depth = 0
+    for name in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(name) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        depth += int(fields[4].split(":")[1], 16)
+        except OSError:
+            pass
+    return depth
+
+def listen_overflows() -> int:
+    with open("/proc/net/netstat") as f:
+        lines = f.read().splitlines()
+    for names, values in zip(lines[::2], lines[1::2]):
+        if names.startswith("TcpExt:"):
+            return int(dict(zip(names.split()[1:], values.split()[1:])).get("ListenOverflows", 0))
+    return 0
+
+class Fleet:
+    def __init__(self, args):
+        self.args = args
+        self.url = f"ws://127.0.0.1:{args.port}"
+        self.connected = 0
+        self.joins = 0
+        self.failed = 0
+        self.stop = False
+
+    async def peer(self, i: int, sem: asyncio.Semaphore):
+        a = self.args
+        url = f"{self.url}?room=r{i // a.room_size}&peer=p{i}"
+        failures = 0
+        first = True
+        while not self.stop:
+            hint = None
+            joined = False
+            try:
+                if first:
+                    await sem.acquire()  # limit only the initial ramp
+                try:
+                    ws = await websockets.connect(url, ping_interval=None, compression=None, max_queue=None,
+                                                  open_timeout=60, close_timeout=2)
+                    await ws.recv()  # peers
+                finally:
+                    if first:
+                        sem.release()
+                        first = False
+                joined = True
+                failures = 0
+                self.connected += 1
+                self.joins += 1
+                async for raw in ws:
+                    msg = json.loads(raw)
+                    if msg.get("type") == "reconnect":
+                        hint = float(msg.get("after", 0))
+            except Exception:
+                if not joined:
+                    self.failed += 1  # refused, reset or timed out before the "peers" reply
+            if joined:
+                self.connected -= 1
+            if self.stop:
+                return
+            if a.mode == "legacy":
+                delay = a.timeout
+            elif hint is not None:
+                delay = hint
+            else:
+                failures += 1
+                delay = reconnect_delay(failures, a.timeout)
+            await asyncio.sleep(delay)
+
+async def run(args):
+    env = {"ROOM_CAP": "100000", "MAX_MSGS_PER_SEC": "1000", "DRAIN_TIMEOUT": str(args.drain if args.mode == "drain" else 0),
+           "RECONNECT_JITTER": str(args.jitter)}
+    old = start_server(args.port, env)
+    procs = [old]
+    fleet = Fleet(args)
+    sem = asyncio.Semaphore(args.concurrency)
+    tasks = [asyncio.create_task(fleet.peer(i, sem)) for i in range(args.peers)]
+    t0 = time.monotonic()
+    while fleet.connected < args.peers and time.monotonic() - t0 < args.timeout_total:
+        await asyncio.sleep(0.2)
+    print(f"  {fleet.connected} peers connected in {time.monotonic() - t0:.1f}s")
+    await asyncio.sleep(1)
+
+    samples = []
+    base_overflows = listen_overflows()
+    base_cpu = cpu_seconds(old.pid)
+    stop_sampling = asyncio.Event()
+
+    async def sample(t_restart: float):
+        while not stop_sampling.is_set():
+            samples.append({
+                "t": round(time.monotonic() - t_restart, 3),
+                "cpu_s": sum(cpu_seconds(p.pid) for p in procs) - base_cpu,
+                "accept_queue": accept_queue(args.port),
+                "overflows": listen_overflows() - base_overflows,
+                "connected": fleet.connected,
+                "joins": fleet.joins,
+            })
+            await asyncio.sleep(args.sample)
+
+    t_restart = time.monotonic()
+    fleet.joins = 0
+    fleet.failed = 0
+    sampler = asyncio.create_task(sample(t_restart))
+    old.terminate()
+    if args.mode == "legacy":
+        old.wait()  # a plain restart: the old process is gone before the new one binds
+    await asyncio.sleep(0.05)  # the draining server stops listening
+    new = await asyncio.get_running_loop().run_in_executor(None, start_server, args.port, env)
+    procs.append(new)
+    t_up = time.monotonic() - t_restart
+    # recovered: every peer has joined the new server once
+    while fleet.joins < args.peers and time.monotonic() - t_restart < args.timeout_total:
+        await asyncio.sleep(0.1)
+    recovered = time.monotonic() - t_restart
+    await asyncio.sleep(1)
+    stop_sampling.set()
+    await sampler
+    result = {"new_server_up_s": round(t_up, 2), "recovered_s": round(recovered, 2), "joins": fleet.joins,
+              "failed_attempts": fleet.failed, "new_server_cpu_s": round(cpu_seconds(new.pid), 2)}
+    fleet.stop = True
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for p in procs:
+        p.kill()
+        p.wait()
+    return samples, result
+
+def timeline(samples: list, bucket: float):
+    """Per bucket: joins/s, server CPU %, max accept queue, listen overflows."""
+    rows = []
+    prev = samples[0]
+    i = 0
+    while i < len(samples):
+        start = samples[i]["t"]
+        group = []
+        while i < len(samples) and samples[i]["t"] < start + bucket:
+            group.append(samples[i])
+            i += 1
+        last = group[-1]
+        span = max(last["t"] - prev["t"], 1e-9)
+        rows.append((start, (last["joins"] - prev["joins"]) / span, 100 * (last["cpu_s"] - prev["cpu_s"]) / span,
+                     max(s["accept_queue"] for s in group), last["overflows"], last["connected"]))
+        prev = last
+    peak_joins = max((r[1] for r in rows), default=1) or 1
+    print(f"{'t s':>6} {'joins/s':>8} {'cpu %':>6} {'acceptq':>8} {'overflow':>9} {'connected':>10}  joins/s")
+    for t, joins, cpu, aq, ovf, conn in rows:
+        print(f"{t:>6.1f} {joins:>8.0f} {cpu:>6.0f} {aq:>8} {ovf:>9} {conn:>10}  {'#' * round(40 * joins / peak_joins)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="server restart under load: drain + jittered reconnect vs lockstep")
+    parser.add_argument("--peers", type=int, default=10000)
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--mode", choices=("legacy", "drain", "both"), default="both")
+    parser.add_argument("--drain", type=float, default=10, help="DRAIN_TIMEOUT for the drain mode")
+    parser.add_argument("--jitter", type=float, default=2, help="RECONNECT_JITTER for the drain mode")
+    parser.add_argument("--timeout", type=float, default=3, help="client reconnect timeout (signaling_loop_pro)")
+    parser.add_argument("--concurrency", type=int, default=200, help="in-flight handshakes during the first ramp")
+    parser.add_argument("--sample", type=float, default=0.1)
+    parser.add_argument("--bucket", type=float, default=1.0, help="timeline row width (s)")
+    parser.add_argument("--timeout-total", type=float, default=120)
+    parser.add_argument("--port", type=int, default=18900)
+    parser.add_argument("--csv", help="write samples here (mode column added)")
+    args = parser.parse_args()
+
+    modes = ("legacy", "drain") if args.mode == "both" else (args.mode,)
+    rows = []
+    for mode in modes:
+        args.mode = mode
+        print(f"== {mode}: peers={args.peers} room_size={args.room_size}"
+              + (f" drain={args.drain}s jitter={args.jitter}s" if mode == "drain" else f" timeout={args.timeout}s"))
+        samples, result = asyncio.run(run(args))
+        timeline(samples, args.bucket)
+        print(f"  {json.dumps(result)}")
+        rows += [{"mode": mode, **s} for s in samples]
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0]))
+            w.writeheader()
+            w.writerows(rows)
+
+if __name__ == "__main__":
+    main()
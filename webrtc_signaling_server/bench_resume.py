@@ -0,0 +1,173 @@
+# bench_resume.py
+"""
+What a short signaling outage costs the video, with and without resume
+tokens (RESUME_GRACE).
+
+A publisher (aiortc's synthetic VideoStreamTrack) and a viewer run the same
+loop as publisher_U3.run / viewer_U3.run: signaling_loop_pro until
+lost_event fires, then close the RTCPeerConnection, wait PC_RETRY_TIME and
+build a new one. The viewer reaches the server through a small TCP proxy;
+once video flows the proxy drops the viewer's websocket and refuses
+connections for --blip ms.
+
+Reported per trial:
+  - video gap: longest pause between two decoded frames after the blip
+  - rebuilds: peer connections torn down and rebuilt (both sides)
+  - resume gap: the server's signaling_resume_gap_seconds (blip to recovery)
+
+    python bench_resume.py --trials 5 --blip 300
+"""
+import io
+import os
+import time
+import asyncio
+import argparse
+import statistics
+import contextlib
+import urllib.request
+
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from loadgen import start_server
+from utils import signaling_loop_pro
+
+class Proxy:
+    """TCP forwarder whose link can be cut for a while (a network blip)."""
+
+    def __init__(self, upstream: int):
+        self.upstream = upstream
+        self.down_until = 0.0
+        self.pipes = set()
+
+    async def start(self, port: int):
+        self.server = await asyncio.start_server(self._accept, "127.0.0.1", port)
+
+    async def _accept(self, reader, writer):
+        if time.monotonic() < self.down_until:
+            writer.transport.abort()
+            return
+        up_reader, up_writer = await asyncio.open_connection("127.0.0.1", self.upstream)
+        self.pipes.update((writer, up_writer))
+        await asyncio.gather(self._pipe(reader, up_writer), self._pipe(up_reader, writer))
+
+    async def _pipe(self, reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.pipes.discard(writer)
+            writer.transport.abort()
+
+    def cut(self, seconds: float):
+        self.down_until = time.monotonic() + seconds
+        for w in list(self.pipes):
+            w.transport.abort()
+
+async def side(role: str, url: str, timeout: int, retry: float, frames: list, rebuilds: dict, stop: asyncio.Event):
+    """publisher_U3.run / viewer_U3.run in a loop, without cameras and data channels."""
+    while not stop.is_set():
+        pc = RTCPeerConnection()
+        lost_event = asyncio.Event()
+
+        async def on_icecandidate(candidate):
+            pass
+
+        @pc.on("connectionstatechange")
+        async def on_state_change():
+            if pc.connectionState in ("failed", "disconnected", "closed"):
+                lost_event.set()
+
+        if role == "publisher":
+            pc.addTrack(VideoStreamTrack())
+        else:
+            @pc.on("track")
+            def on_track(track):
+                async def pump():
+                    try:
+                        while True:
+                            await track.recv()
+                            frames.append(time.monotonic())
+                    except Exception:
+                        pass
+                asyncio.ensure_future(pump())
+
+        task = asyncio.create_task(signaling_loop_pro(pc, lost_event, on_icecandidate, role, timeout, url))
+        done = asyncio.create_task(stop.wait())
+        await asyncio.wait((asyncio.create_task(lost_event.wait()), done), return_when=asyncio.FIRST_COMPLETED)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await pc.close()
+        if stop.is_set():
+            return
+        rebuilds[role] += 1
+        await asyncio.sleep(retry)
+
+async def trial(args, port: int, proxy_port: int):
+    proxy = Proxy(port)
+    await proxy.start(proxy_port)
+    frames, rebuilds, stop = [], {"publisher": 0, "viewer": 0}, asyncio.Event()
+    sides = [asyncio.create_task(side("publisher", f"ws://127.0.0.1:{port}", args.timeout, args.retry, frames, rebuilds, stop)),
+             asyncio.create_task(side("viewer", f"ws://127.0.0.1:{proxy_port}", args.timeout, args.retry, frames, rebuilds, stop))]
+    deadline = time.monotonic() + 20
+    while len(frames) < 30 and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    result = None
+    if len(frames) >= 30:
+        t_blip = time.monotonic()
+        proxy.cut(args.blip / 1000)
+        await asyncio.sleep(args.settle)
+        after = [t_blip] + [t for t in frames if t > t_blip]
+        gap = max(b - a for a, b in zip(after, after[1:] + [time.monotonic()]))
+        result = (gap, sum(rebuilds.values()))
+    stop.set()
+    await asyncio.gather(*sides, return_exceptions=True)
+    proxy.server.close()
+    await asyncio.sleep(0.5)
+    return result
+
+def resume_gap(port: int):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as r:
+        lines = r.read().decode().splitlines()
+    values = {l.split()[0]: float(l.split()[1]) for l in lines if l.startswith("signaling_resume_gap_seconds_")}
+    count = values.get("signaling_resume_gap_seconds_count", 0)
+    return values.get("signaling_resume_gap_seconds_sum", 0) / count if count else float("nan")
+
+async def run(args, port: int):
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):  # signaling_loop_pro is chatty
+        for i in range(args.trials):
+            results.append(await trial(args, port, port + 1))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="video outage after a signaling blip, resume on/off")
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--blip", type=float, default=300, help="ms the viewer's signaling link is down")
+    parser.add_argument("--grace", type=float, default=5, help="RESUME_GRACE for the resume run")
+    parser.add_argument("--timeout", type=int, default=3, help="signaling_loop_pro reconnect delay (U3 default)")
+    parser.add_argument("--retry", type=float, default=2, help="PC_RETRY_TIME")
+    parser.add_argument("--settle", type=float, default=10, help="s watched after the blip")
+    parser.add_argument("--port", type=int, default=18898)
+    args = parser.parse_args()
+
+    print(f"trials={args.trials} blip={args.blip:.0f}ms")
+    print(f"{'resume':>7} {'video gap p50 s':>16} {'video gap max s':>16} {'rebuilds':>9} {'resume gap s':>13} {'failed':>7}")
+    for grace in (0, args.grace):
+        proc = start_server(args.port, {"RESUME_GRACE": str(grace)})
+        try:
+            results = asyncio.run(run(args, args.port))
+            gap = resume_gap(args.port) if grace else float("nan")
+        finally:
+            proc.terminate()
+            proc.wait()
+        ok = [r for r in results if r]
+        gaps = [r[0] for r in ok]
+        print(f"{'on' if grace else 'off':>7} {statistics.median(gaps) if gaps else float('nan'):>16.2f} "
+              f"{max(gaps) if gaps else float('nan'):>16.2f} {sum(r[1] for r in ok):>9} {gap:>13.2f} "
+              f"{len(results) - len(ok):>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# bench_routing_cpu.py
+"""
+Server CPU per routed message: plain JSON clients vs the binary subprotocol.
+
+Pairs of peers bounce offer/answer messages with a multi-KB SDP through
+signaling_server_pro.py. The server's CPU time (utime+stime from /proc, so
+Linux only) is divided by the number of routed messages.
+
+    python bench_routing_cpu.py --pairs 20 --messages 20000 --sdp-size 4000
+"""
+import os
+import json
+import asyncio
+import argparse
+
+import websockets
+
+from loadgen import cpu_seconds, start_server
+from signaling_protocol import SUBPROTOCOL, frame_from_json
+
+async def run_mode(url: str, mode: str, pairs: int, per_pair: int, sdp_size: int) -> int:
+    """mode: "json", "binary" or "mixed" (JSON sender, binary receiver)."""
+    sdp = "a=x" * (sdp_size // 3)
+    a_binary = mode == "binary"
+    b_binary = mode in ("binary", "mixed")
+    routed = 0
+
+    def encode(msg: dict, binary: bool):
+        return frame_from_json(msg) if binary else json.dumps(msg)
+
+    async def pair(i: int):
+        nonlocal routed
+        room = f"{mode}-{i}"
+        a = await websockets.connect(f"{url}?room={room}&peer=a", ping_interval=None, compression=None,
+                                     subprotocols=[SUBPROTOCOL] if a_binary else None)
+        b = await websockets.connect(f"{url}?room={room}&peer=b", ping_interval=None, compression=None,
+                                     subprotocols=[SUBPROTOCOL] if b_binary else None)
+        offer = encode({"type": "offer", "to": "b", "sdp": sdp, "sdpType": "offer"}, a_binary)
+        answer = encode({"type": "answer", "to": "a", "sdp": sdp, "sdpType": "answer"}, b_binary)
+
+        async def side_b():
+            async for raw in b:
+                if isinstance(raw, bytes) or '"offer"' in raw[:20]:
+                    await b.send(answer)
+
+        b_task = asyncio.create_task(side_b())
+        await a.recv()  # peers
+        await a.recv()  # peer-joined b
+        got = 0
+        for _ in range(4):
+            await a.send(offer)
+        async for raw in a:
+            if isinstance(raw, bytes) or '"answer"' in raw[:20]:
+                got += 1
+                routed += 2
+                if got >= per_pair:
+                    break
+                if got <= per_pair - 4:
+                    await a.send(offer)
+        b_task.cancel()
+        await a.close()
+        await b.close()
+
+    await asyncio.gather(*(pair(i) for i in range(pairs)))
+    return routed
+
+def main():
+    parser = argparse.ArgumentParser(description="server CPU per routed message, JSON vs binary")
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=20000, help="round trips per mode")
+    parser.add_argument("--sdp-size", type=int, default=4000)
+    parser.add_argument("--modes", nargs="+", default=["json", "binary", "mixed"])
+    parser.add_argument("--port", type=int, default=18893)
+    args = parser.parse_args()
+
+    proc = start_server(args.port, {"MAX_MSGS_PER_SEC": "1000000"})
+    url = f"ws://127.0.0.1:{args.port}"
+    try:
+        print(f"pairs={args.pairs} sdp={args.sdp_size}B")
+        print(f"{'mode':>8} {'routed':>8} {'server cpu us/msg':>18}")
+        for mode in args.modes:
+            c0 = cpu_seconds(proc.pid)
+            routed = asyncio.run(run_mode(url, mode, args.pairs, args.messages // args.pairs, args.sdp_size))
+            c1 = cpu_seconds(proc.pid)
+            print(f"{mode:>8} {routed:>8} {(c1 - c0) / routed * 1e6:>18.1f}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+if __name__ == "__main__":
+    main()
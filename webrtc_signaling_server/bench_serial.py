@@ -0,0 +1,210 @@
+# bench_serial.py
+"""
+UART telemetry and commands over a pty pair: utils.SerialTransport vs the
+old uart_reader / ser.write.
+
+An "autopilot" subprocess owns the pty master and behaves like a flight
+controller on a --baud line (8N1, so baud / 10 bytes/s each way): it
+streams --frame-size byte telemetry frames at line rate for --duration s,
+each stamped with time.monotonic (shared by every process on the host), and
+drains what the publisher writes no faster than line rate. Half way through,
+a burst of --burst kB of GCS commands arrives, one --cmd-size byte data
+channel message per loop callback, as on_datachannel delivers them.
+
+The publisher side (this process) opens the pty slave with pyserial and
+hands the bytes to a fake "telemetry" channel. Modes:
+
+  legacy:    uart_reader as it was (byte-at-a-time ser.read() while
+             in_waiting, one channel.send per pass, then sleep 5 ms), with
+             the missing await added: as shipped it never yields at all.
+             Commands: ser.write(message), blocking
+  transport: SerialTransport + the new uart_reader; commands go through
+             transport.write (queued, written when the tty has room)
+
+Reported: telemetry delivered (kB/s), added latency per frame (stamp ->
+channel.send), channel.send calls/s, event loop lag (a 1 ms ticker's
+overshoot, p99 / max, the whole run and during the command burst), time
+for the burst to leave the process, and CPU.
+
+    python bench_serial.py --baud 921600 --duration 10
+"""
+import io
+import os
+import sys
+import time
+import struct
+import asyncio
+import argparse
+import threading
+import contextlib
+import subprocess
+
+import serial
+
+from loadgen import pct
+from utils import SerialTransport, uart_reader
+
+STAMP = struct.Struct("<dI")
+
+# ------------------ autopilot (subprocess, pty master) ------------------
+def autopilot(fd: int, baud: int, frame_size: int, duration: float):
+    rate = baud / 10  # bytes/s, 8N1
+    received = [0]
+
+    def drain():
+        # the flight controller's UART: takes at most line rate
+        started = time.monotonic()
+        while True:
+            room = int((time.monotonic() - started) * rate) - received[0]
+            if room > 0:
+                try:
+                    received[0] += len(os.read(fd, room))
+                except OSError:
+                    return
+            time.sleep(0.001)
+
+    threading.Thread(target=drain, daemon=True).start()
+    print("ready", flush=True)
+    pad = b"\x00" * (frame_size - STAMP.size)
+    started = time.monotonic()
+    sent = seq = 0
+    while time.monotonic() - started < duration:
+        due = int((time.monotonic() - started) * rate / frame_size) - seq
+        if due > 0:
+            frames = b"".join(STAMP.pack(time.monotonic(), seq + i) + pad for i in range(due))
+            os.write(fd, frames)
+            seq += due
+            sent += len(frames)
+        time.sleep(0.001)
+    time.sleep(1)  # let the command burst drain
+    print(f"{sent} {received[0]}", flush=True)
+
+# ------------------ publisher side ------------------
+class FakeChannel:
+    """The "telemetry" data channel: reassembles frames, notes each one's latency."""
+    readyState = "open"
+    bufferedAmount = 0  # never congested: utils.ChannelSender passes everything straight through
+    bufferedAmountLowThreshold = 0
+
+    def __init__(self, frame_size: int):
+        self.frame_size = frame_size
+        self.buffer = bytearray()
+        self.sends = 0
+        self.bytes = 0
+        self.latency = []
+
+    def on(self, event, handler):
+        pass
+
+    def send(self, data: bytes):
+        now = time.monotonic()
+        self.sends += 1
+        self.bytes += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            stamp, _ = STAMP.unpack_from(self.buffer)
+            self.latency.append(now - stamp)
+            del self.buffer[:self.frame_size]
+
+async def legacy_uart_reader(channel, ser: serial.Serial):
+    """utils.uart_reader before SerialTransport, with `await` added to its sleep."""
+    data = b''
+    while True:
+        while ser.in_waiting > 0:
+            byte = ser.read()
+            data = data + byte
+        if len(data) != 0:
+            channel.send(data)
+        data = b''
+        await asyncio.sleep(0.005)
+
+async def ticker(lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        t = loop.time()
+        await asyncio.sleep(0.001)
+        lags.append((t, loop.time() - t - 0.001))
+
+async def run(args, mode: str) -> dict:
+    master, slave = os.openpty()
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--autopilot", str(master),
+                             "--baud", str(args.baud), "--frame-size", str(args.frame_size),
+                             "--duration", str(args.duration)], pass_fds=(master,), stdout=subprocess.PIPE)
+    os.close(master)
+    ser = serial.Serial(os.ttyname(slave), baudrate=args.baud, timeout=1)
+    loop = asyncio.get_running_loop()
+    channel = FakeChannel(args.frame_size)
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    transport = SerialTransport(ser) if mode == "transport" else None
+    await loop.run_in_executor(None, proc.stdout.readline)  # "ready"
+    reader = asyncio.create_task(uart_reader(channel, transport) if transport else legacy_uart_reader(channel, ser))
+    cpu, started = time.process_time(), time.monotonic()
+
+    await asyncio.sleep(args.duration / 2)
+    burst_started = loop.time()
+    command = b"C" * args.cmd_size
+    for _ in range(args.burst * 1024 // args.cmd_size):
+        # one data channel message per callback, like on_datachannel
+        loop.call_soon(transport.write if transport else ser.write, command)
+    await asyncio.sleep(0)
+    while transport and (transport.tx or transport.writing):
+        await asyncio.sleep(0.001)
+    burst = loop.time() - burst_started
+    out, _ = await loop.run_in_executor(None, proc.communicate)  # autopilot done, commands drained
+
+    stop.set()
+    await tick
+    cpu = time.process_time() - cpu
+    elapsed = time.monotonic() - started
+    reader.cancel()
+    await asyncio.gather(reader, return_exceptions=True)
+    if transport:
+        transport.close()
+    else:
+        ser.close()
+    sent, commands = map(int, out.split())
+    os.close(slave)
+    # ticks whose sleep overlapped the burst
+    burst_lags = [lag for t, lag in lags if t + 0.001 + lag >= burst_started and t <= burst_started + burst]
+    return {
+        "kbps": channel.bytes / args.duration / 1024,
+        "delivered": channel.bytes / sent if sent else float("nan"),
+        "lat50": pct(channel.latency, 0.5) * 1000,
+        "lat99": pct(channel.latency, 0.99) * 1000,
+        "sends": channel.sends / args.duration,
+        "lag99": pct([lag for _, lag in lags], 0.99) * 1000,
+        "lagmax": max((lag for _, lag in lags), default=float("nan")) * 1000,
+        "burstlag": max(burst_lags, default=float("nan")) * 1000,
+        "burst": burst * 1000,
+        "commands": commands / (args.burst * 1024 // args.cmd_size * args.cmd_size),
+        "cpu": cpu / elapsed * 100,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="UART over a pty pair: SerialTransport vs the old reader/writer")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--frame-size", type=int, default=64, help="telemetry frame size (bytes)")
+    parser.add_argument("--burst", type=int, default=64, help="GCS command burst (kB)")
+    parser.add_argument("--cmd-size", type=int, default=256, help="bytes per command message")
+    parser.add_argument("--modes", nargs="+", default=["legacy", "transport"])
+    parser.add_argument("--autopilot", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.autopilot is not None:
+        autopilot(args.autopilot, args.baud, args.frame_size, args.duration)
+        return
+    print(f"baud={args.baud} ({args.baud // 10} B/s) frame={args.frame_size}B duration={args.duration:.0f}s "
+          f"burst={args.burst}kB in {args.cmd_size}B commands")
+    print(f"{'mode':>9} {'kB/s':>6} {'got':>6} {'lat p50':>8} {'lat p99':>8} {'sends/s':>8} {'lag p99':>8} "
+          f"{'lag max':>8} {'burst lag':>9} {'burst ms':>9} {'cmd got':>8} {'cpu %':>6}")
+    for mode in args.modes:
+        with contextlib.redirect_stdout(io.StringIO()):  # uart_reader is chatty
+            r = asyncio.run(run(args, mode))
+        print(f"{mode:>9} {r['kbps']:>6.1f} {r['delivered']:>6.1%} {r['lat50']:>8.2f} {r['lat99']:>8.2f} "
+              f"{r['sends']:>8.0f} {r['lag99']:>8.2f} {r['lagmax']:>8.1f} {r['burstlag']:>9.1f} {r['burst']:>9.1f} "
+              f"{r['commands']:>8.1%} {r['cpu']:>6.1f}")
+
+if __name__ == "__main__":
+    main()
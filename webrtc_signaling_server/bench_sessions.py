@@ -0,0 +1,131 @@
+# bench_sessions.py
+"""
+Memory per idle signaling session.
+
+in-process: N fake connections go through the server's own join_room and
+heartbeat wheel, then tracemalloc reports the Python memory they hold (the
+session records plus the room and wheel indexes; no sockets).
+
+real: N websocket clients connect to a server subprocess, join rooms and
+sit idle. The server's RSS growth per connection is read from /proc (so
+Linux only), and its /admin/sessions report is printed when it has one.
+Pass --server to compare another copy of the server (e.g. an older revision).
+
+    python bench_sessions.py --inproc 100000 --conns 10000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+import urllib.request
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("STATS_INTERVAL", "0")
+os.environ.setdefault("PING_INTERVAL", "3600")  # no pings while the fake sessions are set up
+
+import websockets
+
+from loadgen import rss_of, start_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ====== in-process ======
+class IdleWs:
+    subprotocol = None
+
+    async def send(self, data):
+        pass
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+async def _inproc(n: int, room_size: int):
+    import signaling_server_pro as srv
+
+    conns = [IdleWs() for _ in range(n)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sessions = []
+    for i, ws in enumerate(conns):
+        s = srv.Session(ws)
+        srv.wheel.add(s)
+        await srv.join_room(s, f"r{i // room_size}", f"p{i}")
+        sessions.append(s)
+        if i % 1000 == 999:
+            await asyncio.sleep(0)  # let the writers flush "peers" / "peer-joined"
+    await asyncio.sleep(0.1)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    held = sum(st.size_diff for st in after.compare_to(before, "filename"))
+    held -= sys.getsizeof(sessions)  # our own list
+    record = sum(map(srv.session_bytes, sessions)) / n
+    idle = sum(1 for s in sessions if s.queue is None)
+    for s in sessions:
+        srv.wheel.remove(s)
+    return held / n, record, idle
+
+# ====== real connections ======
+async def _connect_idle(port: int, n: int, room_size: int, concurrency: int):
+    url = f"ws://127.0.0.1:{port}"
+    sem = asyncio.Semaphore(concurrency)
+    conns = []
+
+    async def one(i: int):
+        async with sem:
+            ws = await websockets.connect(f"{url}?room=r{i // room_size}&peer=p{i}",
+                                          ping_interval=None, compression=None)
+            await ws.recv()  # peers
+            conns.append(ws)
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return conns
+
+async def _real(server: str, port: int, n: int, room_size: int, concurrency: int):
+    proc = start_server(port, {"ROOM_CAP": "100000"}, server)
+    try:
+        time.sleep(0.5)
+        base = rss_of(proc.pid)
+        t0 = time.perf_counter()
+        conns = await _connect_idle(port, n, room_size, concurrency)
+        elapsed = time.perf_counter() - t0
+        await asyncio.sleep(2)  # let joins and peer-joined fan-out settle
+        grown = rss_of(proc.pid) - base
+        report = None
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/admin/sessions", timeout=30) as r:
+                report = json.loads(r.read())
+        except Exception:
+            pass  # older server without the admin endpoint
+        await asyncio.gather(*(ws.close() for ws in conns), return_exceptions=True)
+        return grown / n, elapsed, report
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="memory per idle signaling session")
+    parser.add_argument("--inproc", type=int, default=100000, help="fake sessions (0 = skip)")
+    parser.add_argument("--conns", type=int, default=10000, help="real websocket clients (0 = skip)")
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=200, help="in-flight handshakes")
+    parser.add_argument("--server", default=os.path.join(HERE, "signaling_server_pro.py"))
+    parser.add_argument("--port", type=int, default=18894)
+    args = parser.parse_args()
+
+    if args.inproc:
+        held, record, idle = asyncio.run(_inproc(args.inproc, args.room_size))
+        print(f"in-process sessions={args.inproc} room_size={args.room_size} idle={idle}")
+        print(f"  python heap per session: {held:8.0f} B  (record {record:.0f} B + indexes)")
+    if args.conns:
+        per_conn, elapsed, report = asyncio.run(
+            _real(args.server, args.port, args.conns, args.room_size, args.concurrency))
+        print(f"real server={os.path.basename(args.server)} conns={args.conns} connect={elapsed:.1f}s")
+        print(f"  server RSS per connection: {per_conn:8.0f} B")
+        if report:
+            print(f"  /admin/sessions: {json.dumps(report['bytes_per_idle_session'])}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# bench_sharding.py
+"""
+Consistent-hash room sharding over several signaling nodes on localhost.
+
+ring: in-process, no sockets. Spreads --rooms room names over 1..--max-nodes
+nodes and reports the load spread (max / mean rooms per node) and, for
+each added node, the share of rooms that moved against the ideal 1/N.
+
+live: starts --nodes servers (NODES_FILE lists them all), connects --peers
+peers to random entry nodes; they follow {"type": "redirect"} to the owner.
+Reports connect time for direct vs redirected joins and checks that every
+room ended up whole on its owner. Then a node is added (file rewritten,
+new node started, SIGHUP to the others): rooms that moved, where they went,
+and how long until the moved peers had re-joined.
+
+    python bench_sharding.py --nodes 3 --peers 3000 --room-size 4
+"""
+import os
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import statistics
+import subprocess
+import tempfile
+from collections import Counter
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import websockets
+
+from loadgen import start_server
+from signaling_server_pro import HashRing
+
+# ====== ring only ======
+def ring_report(rooms: int, max_nodes: int, vnodes: int):
+    names = [f"room-{i}" for i in range(rooms)]
+    print(f"ring: rooms={rooms} vnodes={vnodes}")
+    print(f"{'nodes':>6} {'max/mean load':>14} {'moved on add':>13} {'ideal':>7} {'to new node':>12}")
+    prev = None
+    for n in range(1, max_nodes + 1):
+        nodes = [f"ws://127.0.0.1:{19000 + i}" for i in range(n)]
+        ring = HashRing(nodes, vnodes)
+        owners = {name: ring.owner(name) for name in names}
+        load = Counter(owners.values())
+        spread = max(load.values()) / (rooms / n)
+        if prev:
+            moved = [name for name in names if owners[name] != prev[name]]
+            to_new = sum(1 for name in moved if owners[name] == nodes[-1])
+            print(f"{n:>6} {spread:>14.2f} {len(moved) / rooms:>13.3f} {1 / n:>7.3f} {to_new / max(1, len(moved)):>12.0%}")
+        else:
+            print(f"{n:>6} {spread:>14.2f} {'-':>13} {'-':>7} {'-':>12}")
+        prev = owners
+
+# ====== live nodes ======
+def start_node(port: int, nodes_file: str) -> subprocess.Popen:
+    return start_server(port, {"NODE_URL": f"ws://127.0.0.1:{port}", "NODES_FILE": nodes_file, "ROOM_CAP": "100000",
+                               "REBALANCE_TIME": "1"})
+
+class Peer:
+    def __init__(self, room: str, peer_id: str, entry: str):
+        self.room = room
+        self.peer_id = peer_id
+        self.url = entry
+        self.node = None  # node it joined
+        self.joins = []  # (seconds, redirect hops)
+        self.moved_at = None
+        self.rejoined_at = None
+
+    async def run(self, sem: asyncio.Semaphore, stop: asyncio.Event):
+        while not stop.is_set():
+            hops = 0
+            async with sem:
+                t0 = time.monotonic()
+                while True:
+                    ws = await websockets.connect(f"{self.url}?room={self.room}&peer={self.peer_id}",
+                                                  ping_interval=None, compression=None, max_queue=None)
+                    msg = json.loads(await ws.recv())
+                    if msg["type"] != "redirect":
+                        break
+                    await ws.close()
+                    self.url = msg["url"]
+                    hops += 1
+            self.node = self.url
+            self.joins.append((time.monotonic() - t0, hops))
+            if self.moved_at is not None:
+                self.rejoined_at = time.monotonic()
+            try:
+                async for raw in ws:
+                    msg = json.loads(raw)
+                    if msg["type"] == "redirect":
+                        self.url = msg["url"]
+                        self.moved_at = time.monotonic()
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            finally:
+                await ws.close()
+
+def node_rooms(port: int) -> int:
+    import urllib.request
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/admin/sessions", timeout=10) as r:
+        return json.loads(r.read())["rooms"]
+
+async def live(args):
+    ports = [args.port + i for i in range(args.nodes + 1)]
+    urls = [f"ws://127.0.0.1:{p}" for p in ports]
+    fd, nodes_file = tempfile.mkstemp(prefix="nodes-", suffix=".txt")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(urls[:-1]) + "\n")
+    procs = [start_node(p, nodes_file) for p in ports[:-1]]
+    stop = asyncio.Event()
+    sem = asyncio.Semaphore(args.concurrency)
+    peers = [Peer(f"room-{i // args.room_size}", f"p{i}", random.choice(urls[:-1])) for i in range(args.peers)]
+    tasks = [asyncio.create_task(p.run(sem, stop)) for p in peers]
+    try:
+        while sum(1 for p in peers if p.joins) < len(peers):
+            await asyncio.sleep(0.2)
+        direct = [t for p in peers for t, hops in p.joins if hops == 0]
+        redirected = [t for p in peers for t, hops in p.joins if hops > 0]
+        ring = HashRing(urls[:-1])
+        placed = {}
+        for p in peers:
+            placed.setdefault(p.room, set()).add(p.node)
+        whole = sum(1 for room, nodes in placed.items() if nodes == {ring.owner(room)})
+        print(f"live: nodes={args.nodes} peers={args.peers} rooms={len(placed)}")
+        print(f"  join ms p50: direct {statistics.median(direct) * 1000:.1f} ({len(direct)}), "
+              f"redirected {statistics.median(redirected) * 1000:.1f} ({len(redirected)})")
+        print(f"  rooms whole on their owner: {whole}/{len(placed)}; per node: {[node_rooms(p) for p in ports[:-1]]}")
+
+        # add a node
+        procs.append(start_node(ports[-1], nodes_file))  # not in the file yet: would redirect everything
+        with open(nodes_file, "w") as f:
+            f.write("\n".join(urls) + "\n")
+        new_ring = HashRing(urls)
+        expect = {room for room in placed if new_ring.owner(room) != ring.owner(room)}
+        os.kill(procs[-1].pid, signal.SIGHUP)
+        t0 = time.monotonic()
+        for proc in procs[:-1]:
+            os.kill(proc.pid, signal.SIGHUP)
+        movers = [p for p in peers if p.room in expect]
+        while any(p.rejoined_at is None for p in movers) and time.monotonic() - t0 < 60:
+            await asyncio.sleep(0.05)
+        settle = max((p.rejoined_at for p in movers), default=t0) - t0
+        moved_rooms = {p.room for p in peers if p.moved_at is not None}
+        on_new = sum(1 for room in moved_rooms if all(p.node == urls[-1] for p in peers if p.room == room))
+        print(f"  add node {args.nodes + 1}: moved {len(moved_rooms)}/{len(placed)} rooms "
+              f"({len(moved_rooms) / len(placed):.3f}, ideal {1 / (args.nodes + 1):.3f}, expected {len(expect)}), "
+              f"{on_new} on the new node, {len(movers)} peers re-joined in {settle:.2f}s")
+        print(f"  per node: {[node_rooms(p) for p in ports]}")
+    finally:
+        stop.set()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+        os.unlink(nodes_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="consistent-hash room sharding")
+    parser.add_argument("--rooms", type=int, default=100000, help="room names for the ring report")
+    parser.add_argument("--max-nodes", type=int, default=8)
+    parser.add_argument("--vnodes", type=int, default=160)
+    parser.add_argument("--nodes", type=int, default=3, help="live nodes before one is added (0 = skip live)")
+    parser.add_argument("--peers", type=int, default=3000)
+    parser.add_argument("--room-size", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=18910)
+    args = parser.parse_args()
+
+    ring_report(args.rooms, args.max_nodes, args.vnodes)
+    if args.nodes:
+        asyncio.run(live(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench_slow_consumer.py
+"""
+Fan-out latency with one stalled viewer in the room.
+
+N viewers sit in a room and read everything. One extra peer ("slow") does the
+websocket handshake and then never reads again, like a viewer behind a dead
+Starlink link. Once the stall phase starts, a "blaster" peer keeps routing
+large offers to it until its TCP window is full. Meanwhile a "churn" peer
+joins and leaves over and over, and we time how long the viewers take to see
+each peer-joined.
+
+The first rounds run before the stall starts, so the two phases can be compared.
+Pass --server to benchmark another copy of the server (e.g. an older revision).
+
+    python bench_slow_consumer.py --viewers 50 --rounds 40
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+
+import websockets
+
+from loadgen import pct, start_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def stalled_peer(port: int, room: str, peer: str) -> socket.socket:
+    """Websocket handshake over a raw socket, then never read again."""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(("127.0.0.1", port))
+    sock.sendall((f"GET /?room={room}&peer={peer} HTTP/1.1\r\n"
+                  f"Host: 127.0.0.1:{port}\r\n"
+                  "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                  "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n"
+                  "Sec-WebSocket-Version: 13\r\n\r\n").encode())
+    buf = b""
+    while b"\r\n\r\n" not in buf:
+        buf += sock.recv(1)
+    return sock
+
+async def run(args):
+    url = f"ws://127.0.0.1:{args.port}"
+    room = "fanout"
+    seen = {}  # round -> list of arrival times
+
+    async def viewer(i: int):
+        ws = await websockets.connect(f"{url}?room={room}&peer=v{i}", ping_interval=None, max_size=None)
+        async for raw in ws:
+            msg = json.loads(raw)
+            if msg.get("type") == "peer-joined" and msg["peer"].startswith("churn-"):
+                seen.setdefault(int(msg["peer"][6:]), []).append(time.perf_counter())
+
+    # the slow peer joins first so it sits ahead of the viewers in the room
+    slow = stalled_peer(args.port, room, "slow")
+    viewers = [asyncio.create_task(viewer(i)) for i in range(args.viewers)]
+    await asyncio.sleep(0.5)
+
+    blaster_task = None
+
+    async def blaster():
+        ws = await websockets.connect(f"{url}?room={room}&peer=blaster", ping_interval=None, compression=None)
+        sdp = os.urandom(32 * 1024).hex()
+        while True:
+            await ws.send(json.dumps({"type": "offer", "to": "slow", "sdp": sdp, "sdpType": "offer"}))
+            await asyncio.sleep(0.01)
+
+    latencies = {"before-stall": [], "with-stall": []}
+    for r in range(args.rounds):
+        phase = "before-stall" if r < args.rounds // 4 else "with-stall"
+        if phase == "with-stall" and blaster_task is None:
+            blaster_task = asyncio.create_task(blaster())
+            await asyncio.sleep(1.0)  # let the slow peer's window fill up
+        t0 = time.perf_counter()
+        churn = await websockets.connect(f"{url}?room={room}&peer=churn-{r}", ping_interval=None)
+        deadline = t0 + args.round_timeout
+        while len(seen.get(r, [])) < args.viewers and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        arrivals = seen.get(r, [])
+        # viewers that never saw the join count as the full timeout
+        lat = [(t - t0) * 1000 for t in arrivals] + [args.round_timeout * 1000] * (args.viewers - len(arrivals))
+        latencies[phase].append(max(lat))
+        await churn.close()
+        await asyncio.sleep(args.interval)
+
+    if blaster_task:
+        blaster_task.cancel()
+    slow.close()
+    for t in viewers:
+        t.cancel()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description="fan-out latency with a stalled viewer")
+    parser.add_argument("--server", default=os.path.join(HERE, "signaling_server_pro.py"))
+    parser.add_argument("--policy", default="drop-oldest", help="OUTBOX_POLICY for the server")
+    parser.add_argument("--viewers", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=40)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--round-timeout", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=18892)
+    args = parser.parse_args()
+
+    proc = start_server(args.port, {"MAX_MSGS_PER_SEC": "100000", "ROOM_CAP": "100000", "PING_INTERVAL": "3600",
+                                     "OUTBOX_POLICY": args.policy}, args.server)
+    try:
+        latencies = asyncio.run(run(args))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print(f"server={os.path.basename(args.server)} policy={args.policy} viewers={args.viewers}")
+    print("fan-out latency = time until the last viewer sees peer-joined (ms)")
+    for phase, lat in latencies.items():
+        if lat:
+            print(f"  {phase:>13}: p50={statistics.median(lat):8.2f}  p99={pct(lat, 0.99):8.2f}  max={max(lat):8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# bench_startup.py
+"""
+Cost of building the publisher's peer connection, phase by phase, with and
+without utils.IceServerCache.
+
+Every reconnect in publisher_U3 builds a new RTCPeerConnection up to its
+local offer. Phases (wall ms and process CPU ms, mean over --builds):
+
+  pc:     RTCPeerConnection() (aiortc generates its DTLS certificate
+          here, EC key + X.509 signature, in both modes) + 2 video tracks,
+          "telemetry" and the P2P signaling channel
+  dns:    ICE server names. cold: nothing here, aioice resolves inside
+          gather; cached: IceServerCache.servers (names already IPs)
+  offer:  createOffer
+  gather: setLocalDescription (host, srflx, TURN allocation)
+
+The STUN/TURN server is bench_pool.SlowIceServer on localhost, answering
+after --ice-rtt, named "turn.bench.invalid". The sandbox has no resolver,
+so lookups of that name are emulated: they return 127.0.0.1 after --dns-ms,
+on the executor thread just like a real getaddrinfo.
+
+Once per process: the startup IceServerCache.refresh().
+
+    python bench_startup.py --builds 10 --ice-rtt 100 --dns-ms 30
+"""
+import time
+import socket
+import asyncio
+import argparse
+import contextlib
+
+from aiortc import RTCConfiguration, RTCIceServer, RTCPeerConnection, VideoStreamTrack
+
+from bench_pool import SlowIceServer
+from utils import IceServerCache, PeerSignaling
+
+HOST = "turn.bench.invalid"
+PHASES = ("pc", "dns", "offer", "gather")
+
+def emulate_dns(delay: float):
+    """HOST resolves to 127.0.0.1 after `delay` seconds, like a resolver one RTT away."""
+    gethostbyname, getaddrinfo = socket.gethostbyname, socket.getaddrinfo
+
+    def slow_gethostbyname(host):
+        if host == HOST:
+            time.sleep(delay)
+            return "127.0.0.1"
+        return gethostbyname(host)
+
+    def slow_getaddrinfo(host, *args, **kwargs):
+        if host == HOST:
+            time.sleep(delay)
+            host = "127.0.0.1"
+        return getaddrinfo(host, *args, **kwargs)
+
+    socket.gethostbyname, socket.getaddrinfo = slow_gethostbyname, slow_getaddrinfo
+
+@contextlib.contextmanager
+def phase(times: dict, name: str):
+    wall, cpu = time.perf_counter(), time.process_time()
+    yield
+    times[name] = ((time.perf_counter() - wall) * 1000, (time.process_time() - cpu) * 1000)
+
+async def build(ice_servers: list, ice_cache: IceServerCache) -> dict:
+    times = {}
+    with phase(times, "dns"):
+        servers = ice_cache.servers if ice_cache else ice_servers
+    with phase(times, "pc"):
+        config = RTCConfiguration(iceServers=servers)
+        pc = RTCPeerConnection(config)
+        pc.addTrack(VideoStreamTrack())
+        pc.addTrack(VideoStreamTrack())
+        pc.createDataChannel("telemetry")
+        PeerSignaling(pc, "publisher")
+    with phase(times, "offer"):
+        offer = await pc.createOffer()
+    with phase(times, "gather"):
+        await pc.setLocalDescription(offer)
+    if "relay" not in pc.localDescription.sdp:
+        raise RuntimeError("no relay candidate gathered")
+    await pc.close()
+    return times
+
+async def run(args) -> dict:
+    loop = asyncio.get_running_loop()
+    ice, _ = await loop.create_datagram_endpoint(lambda: SlowIceServer(args.ice_rtt / 1000), ("127.0.0.1", args.port))
+    ice_servers = [
+        RTCIceServer(urls=[f"stun:{HOST}:{args.port}"]),
+        RTCIceServer(urls=[f"turn:{HOST}:{args.port}"], username="bench", credential="bench"),
+    ]
+    results = {}
+    startup = {}
+    ice_cache = IceServerCache(ice_servers)
+    with phase(startup, "dns refresh (startup)"):
+        await ice_cache.refresh()
+    results["startup"] = startup
+    for mode, cache in (("cold", None), ("cached", ice_cache)):
+        await build(ice_servers, cache)  # warm up imports / codecs
+        results[mode] = [await build(ice_servers, cache) for _ in range(args.builds)]
+    ice.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="publisher peer connection build cost by phase, with and without caches")
+    parser.add_argument("--builds", type=int, default=10)
+    parser.add_argument("--ice-rtt", type=float, default=100, help="round trip to the STUN/TURN server (ms)")
+    parser.add_argument("--dns-ms", type=float, default=30, help="emulated DNS lookup time (ms)")
+    parser.add_argument("--port", type=int, default=18990)
+    args = parser.parse_args()
+
+    emulate_dns(args.dns_ms / 1000)
+    results = asyncio.run(run(args))
+    print(f"builds={args.builds} ice rtt={args.ice_rtt:.0f}ms dns={args.dns_ms:.0f}ms (mean wall ms / cpu ms)")
+    print(f"{'mode':>7} " + " ".join(f"{p:>13}" for p in PHASES) + f" {'total':>13}")
+    for mode in ("cold", "cached"):
+        runs = results[mode]
+        means = {p: (sum(r[p][0] for r in runs) / len(runs), sum(r[p][1] for r in runs) / len(runs)) for p in PHASES}
+        total = (sum(m[0] for m in means.values()), sum(m[1] for m in means.values()))
+        print(f"{mode:>7} " + " ".join(f"{w:>6.1f}/{c:<6.1f}" for w, c in (*means.values(), total)))
+    print("once per process:")
+    for name, (wall, cpu) in results["startup"].items():
+        print(f"  {name:<22} {wall:>6.1f} / {cpu:.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+# bench_telemetry.py
+"""
+"telemetry" data channel traffic with and without frame packing
+(telemetry_protocol.TelemetryPacker on the publisher, unpack() on the viewer).
+
+Two aiortc peers on loopback, connected in-process. The publisher is fed a
+synthetic MAVLink stream shaped like an ArduPilot vehicle's default streams
+(ATTITUDE 50 Hz, RAW_IMU / GLOBAL_POSITION_INT / VFR_HUD 10 Hz, ... about
+115 frames/s; --rate-scale multiplies every rate; --aligned puts the streams
+in phase), arriving as:
+
+  uart: the frames serialized on a --baud line, read every --read-ms ms
+        (what SerialTransport.read() returns: frames split across reads)
+  udp:  one frame per datagram (mavlink-router / a companion computer)
+
+  before: one channel.send per read / datagram, as uart_reader and
+          send_telemetry_from_udp did
+  packed: TelemetryPacker(max_size=TELEMETRY_PACK_SIZE, max_delay=--delay)
+
+Reported per second: data channel messages, and what went on the wire: UDP
+datagrams carrying DTLS application data (the SCTP packets) and their bytes
+plus 28 B of IPv4/UDP header each, publisher -> viewer and back (SACKs);
+frame latency (generated -> unpacked on the viewer) and frames delivered.
+
+    python bench_telemetry.py --duration 10 --baud 57600
+"""
+import time
+import random
+import asyncio
+import argparse
+import collections
+
+from aioice import ice
+from aiortc import RTCConfiguration, RTCPeerConnection
+
+from config import TELEMETRY_PACK_SIZE, TELEMETRY_PACK_DELAY
+from telemetry_protocol import MavlinkFramer, TelemetryPacker, unpack
+
+# (message id, payload bytes, Hz): ArduPilot's usual stream set
+STREAMS = [(0, 9, 1), (1, 31, 2), (24, 52, 5), (27, 29, 10), (29, 16, 10), (30, 28, 50), (33, 28, 10),
+           (65, 42, 5), (36, 37, 10), (74, 20, 10), (147, 54, 1), (111, 16, 1)]
+IP_UDP = 28
+
+# ------------------ wire accounting ------------------
+wire = collections.Counter()  # (protocol id, "packets" | "bytes") for DTLS application data
+_send_data = ice.StunProtocol.send_data
+
+async def send_data(self, data: bytes, addr) -> None:
+    if data and data[0] == 23:  # DTLS application_data record: SCTP
+        wire[(id(self), "packets")] += 1
+        wire[(id(self), "bytes")] += len(data) + IP_UDP
+    await _send_data(self, data, addr)
+
+ice.StunProtocol.send_data = send_data
+
+def protocols(pc: RTCPeerConnection) -> set:
+    return {id(p) for p in pc.sctp.transport.transport._connection._protocols}
+
+def traffic(ids: set) -> tuple:
+    return sum(wire[(i, "packets")] for i in ids), sum(wire[(i, "bytes")] for i in ids)
+
+# ------------------ MAVLink source ------------------
+def mavlink_v2(msgid: int, length: int, seq: int) -> bytes:
+    header = bytes((0xFD, length, 0, 0, seq & 0xFF, 1, 1)) + msgid.to_bytes(3, "little")
+    return header + random.randbytes(length + 2)
+
+async def source(args, on_chunk, sent: dict):
+    """Feed on_chunk() for --duration s; sent maps each frame to its generation time."""
+    loop = asyncio.get_running_loop()
+    due = [(0.0 if args.aligned else i / (len(STREAMS) * hz * args.rate_scale), msgid, length, hz * args.rate_scale)
+           for i, (msgid, length, hz) in enumerate(STREAMS)]
+    line = bytearray()
+    started = last = loop.time()
+    seq = 0
+    budget = 0.0
+    while loop.time() - started < args.duration:
+        now = loop.time() - started
+        elapsed, last = now + started - last, now + started
+        for k, (t, msgid, length, hz) in enumerate(due):
+            while t <= now:
+                frame = mavlink_v2(msgid, length, seq)
+                seq += 1
+                sent[frame] = time.monotonic()
+                if args.source == "udp":
+                    on_chunk(frame)
+                else:
+                    line += frame
+                t += 1 / hz
+            due[k] = (t, msgid, length, hz)
+        if line:
+            budget += args.baud / 10 * elapsed
+            n = min(len(line), int(budget))
+            if n:
+                on_chunk(bytes(line[:n]))
+                del line[:n]
+                budget -= n
+        else:
+            budget = 0.0
+        await asyncio.sleep(args.read_ms / 1000)
+
+# ------------------ one run ------------------
+async def run(args, mode: str) -> dict:
+    config = RTCConfiguration(iceServers=[])
+    publisher, viewer = RTCPeerConnection(config), RTCPeerConnection(config)
+    channel = publisher.createDataChannel("telemetry")
+    opened = asyncio.Event()
+    channel.on("open", opened.set)
+    sent, latency = {}, []
+    messages = [0]
+    gcs = MavlinkFramer()  # "before": frames span messages, reassemble like the GCS's parser would
+
+    @viewer.on("datachannel")
+    def on_datachannel(ch):
+        @ch.on("message")
+        def on_message(message):
+            now = time.monotonic()
+            frames = unpack(message) if mode == "packed" else [piece for _, piece in gcs.feed(message)]
+            for frame in frames:
+                t = sent.get(frame)
+                if t is not None:
+                    latency.append(now - t)
+
+    await publisher.setLocalDescription(await publisher.createOffer())
+    await viewer.setRemoteDescription(publisher.localDescription)
+    await viewer.setLocalDescription(await viewer.createAnswer())
+    await publisher.setRemoteDescription(viewer.localDescription)
+    await asyncio.wait_for(opened.wait(), 20)
+    await asyncio.sleep(1)
+
+    def send(message: bytes):
+        messages[0] += 1
+        channel.send(message)
+
+    packer = TelemetryPacker(send, TELEMETRY_PACK_SIZE, args.delay) if mode == "packed" else None
+    up_ids, down_ids = protocols(publisher), protocols(viewer)
+    up0, down0 = traffic(up_ids), traffic(down_ids)
+    await source(args, packer.feed if packer else send, sent)
+    await asyncio.sleep(0.5)
+    up1, down1 = traffic(up_ids), traffic(down_ids)
+    if packer:
+        packer.close()
+    await publisher.close()
+    await viewer.close()
+    d = args.duration
+    latency.sort()
+    return {
+        "frames": len(sent) / d, "delivered": len(latency) / len(sent),
+        "messages": messages[0] / d,
+        "up_pkts": (up1[0] - up0[0]) / d, "up_kB": (up1[1] - up0[1]) / d / 1024,
+        "down_pkts": (down1[0] - down0[0]) / d, "down_kB": (down1[1] - down0[1]) / d / 1024,
+        "lat50": latency[len(latency) // 2] * 1000, "lat99": latency[int(len(latency) * 0.99)] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="telemetry data channel: per-chunk sends vs packed MAVLink frames")
+    parser.add_argument("--source", choices=("uart", "udp"), default="uart")
+    parser.add_argument("--baud", type=int, default=57600, help="uart source line rate")
+    parser.add_argument("--read-ms", type=float, default=1.0, help="uart source read interval (ms)")
+    parser.add_argument("--rate-scale", type=float, default=1.0, help="multiply every stream rate")
+    parser.add_argument("--aligned", action="store_true",
+                        help="streams in phase, as a flight controller sends them from one scheduler tick "
+                             "(default: spread evenly, the worst case for packing)")
+    parser.add_argument("--delay", type=float, default=TELEMETRY_PACK_DELAY, help="packer max delay (s)")
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"source={args.source}" + (f" baud={args.baud} read every {args.read_ms:g}ms" if args.source == "uart" else "")
+          + f" rate x{args.rate_scale:g}{' aligned' if args.aligned else ''} pack delay={args.delay * 1000:g}ms duration={args.duration:g}s")
+    print(f"{'mode':>7} {'frames/s':>9} {'msgs/s':>7} {'pkts/s up':>10} {'kB/s up':>8} {'pkts/s down':>12} "
+          f"{'kB/s down':>10} {'lat p50':>8} {'lat p99':>8} {'got':>7}")
+    for mode in ("before", "packed"):
+        random.seed(1)
+        r = asyncio.run(run(args, mode))
+        print(f"{mode:>7} {r['frames']:>9.0f} {r['messages']:>7.0f} {r['up_pkts']:>10.0f} {r['up_kB']:>8.2f} "
+              f"{r['down_pkts']:>12.0f} {r['down_kB']:>10.2f} {r['lat50']:>8.2f} {r['lat99']:>8.2f} {r['delivered']:>7.1%}")
+
+if __name__ == "__main__":
+    main()
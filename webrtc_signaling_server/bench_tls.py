@@ -0,0 +1,200 @@
+# bench_tls.py
+"""
+Reconnect cost over wss:// with and without TLS session resumption.
+
+A throwaway self-signed certificate is made for localhost. Clients reach the
+server through a TCP proxy that delays every chunk by --rtt/2 each way (a
+satellite link). Each run reconnects --reconnects times in a row and times
+connect -> "peers" (TCP + TLS + websocket upgrade + join), like
+signaling_loop_pro after a drop:
+
+  cache off: new context each time, always a full handshake
+  cache on:  utils.TLSSessionCache offers the last session ticket
+
+for TLS 1.3 and 1.2 (client maximum_version). The proxy accepts locally, so
+the TCP handshake itself is not delayed: add one RTT for a real link. Server
+CPU per connection comes from /proc over --cpu-conns reconnects without the
+proxy. Then two checks, also without the proxy:
+
+  rotation: TLS_TICKET_ROTATE=--rotate, one reconnect every 0.2 s: a full
+            handshake right after each rotation, resumed otherwise
+  workers:  WORKERS=2, per-process ticket keys: a session resumes only
+            when the same worker accepts the reconnect
+
+    python bench_tls.py --rtt 600 --reconnects 20
+"""
+import os
+import ssl
+import time
+import asyncio
+import argparse
+import datetime
+import ipaddress
+import tempfile
+import urllib.request
+
+import websockets
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from loadgen import cpu_seconds, pct, start_server
+from utils import tls_client_context
+
+def make_cert(directory: str):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"),
+                                                        x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), False)
+            .sign(key, hashes.SHA256()))
+    cert_file, key_file = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_file, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_file, key_file
+
+def children(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(c) for c in f.read().split()]
+    except OSError:
+        return []
+
+def server_cpu(pid: int) -> float:
+    return sum(cpu_seconds(p) for p in [pid] + children(pid))
+
+def tls_counts(port: int, cafile: str) -> dict:
+    ctx = ssl.create_default_context(cafile=cafile)
+    with urllib.request.urlopen(f"https://localhost:{port}/metrics", context=ctx, timeout=10) as r:
+        lines = r.read().decode().splitlines()
+    return {l.split('"')[1]: int(l.split()[-1]) for l in lines if l.startswith("signaling_tls_handshakes_total{")}
+
+class DelayProxy:
+    """TCP forwarder adding rtt/2 to each direction."""
+
+    def __init__(self, upstream: int, rtt: float):
+        self.upstream = upstream
+        self.delay = rtt / 2
+
+    async def start(self, port: int):
+        self.server = await asyncio.start_server(self._accept, "127.0.0.1", port)
+
+    async def _accept(self, reader, writer):
+        up_reader, up_writer = await asyncio.open_connection("127.0.0.1", self.upstream)
+        try:
+            await asyncio.gather(self._pipe(reader, up_writer), self._pipe(up_reader, writer))
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def _pipe(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        async def sender():
+            while True:
+                due, data = await queue.get()
+                await asyncio.sleep(max(0.0, due - loop.time()))
+                if not data:
+                    break
+                writer.write(data)
+        task = asyncio.create_task(sender())
+        try:
+            while data := await reader.read(65536):
+                queue.put_nowait((loop.time() + self.delay, data))
+        except ConnectionError:
+            pass
+        queue.put_nowait((loop.time() + self.delay, b""))
+        await task
+        writer.close()
+
+async def reconnects(url: str, n: int, cafile: str, version, cache: bool, interval: float = 0.0):
+    """n connect -> "peers" -> close in a row; returns [(seconds, resumed)]."""
+    ctx = tls_client_context(cafile)
+    ctx.maximum_version = version
+    out = []
+    for i in range(n):
+        if not cache:
+            ctx = tls_client_context(cafile)
+            ctx.maximum_version = version
+        t0 = time.monotonic()
+        async with websockets.connect(f"{url}/?room=tls&peer=p", ssl=ctx, ping_interval=None,
+                                      server_hostname="localhost") as ws:
+            await ws.recv()
+            out.append((time.monotonic() - t0, ctx.remember(ws)))
+        await asyncio.sleep(interval)
+    return out
+
+async def rtt_runs(args, cert: str, key: str):
+    port = args.port
+    proc = start_server(port, {"DRAIN_TIMEOUT": "0", "TLS_CERT": cert, "TLS_KEY": key}, quiet=True, settle=0.5)
+    proxy = DelayProxy(port, args.rtt / 1000)
+    await proxy.start(port + 1)
+    print(f"rtt={args.rtt:.0f}ms reconnects={args.reconnects} (connect -> peers)")
+    print(f"{'tls':>5} {'cache':>6} {'resumed':>8} {'p50 ms':>8} {'p90 ms':>8} {'RTTs':>5} {'server cpu ms/conn':>19}")
+    try:
+        for name, version in (("1.3", ssl.TLSVersion.TLSv1_3), ("1.2", ssl.TLSVersion.TLSv1_2)):
+            for cache in (False, True):
+                res = await reconnects(f"wss://127.0.0.1:{port + 1}", args.reconnects, cert, version, cache)
+                times = [t * 1000 for t, _ in res[1:]]  # the first one is always full
+                resumed = sum(r for _, r in res[1:])
+                # CPU: the same without the proxy, enough connections for /proc's 10 ms ticks
+                cpu0 = server_cpu(proc.pid)
+                await reconnects(f"wss://127.0.0.1:{port}", args.cpu_conns, cert, version, cache)
+                cpu = server_cpu(proc.pid) - cpu0
+                print(f"{name:>5} {'on' if cache else 'off':>6} {resumed:>4}/{len(times):<3} {pct(times, 0.5):>8.0f} "
+                      f"{pct(times, 0.9):>8.0f} {pct(times, 0.5) / args.rtt:>5.1f} {cpu * 1000 / args.cpu_conns:>19.2f}")
+        print(f"  server counted: {tls_counts(port, cert)}")
+    finally:
+        proxy.server.close()
+        proc.terminate()
+        proc.wait()
+
+async def rotation_run(args, cert: str, key: str):
+    port = args.port + 2
+    proc = start_server(port, {"DRAIN_TIMEOUT": "0", "TLS_CERT": cert, "TLS_KEY": key, "TLS_TICKET_ROTATE": str(args.rotate)},
+                        quiet=True, settle=0.5)
+    try:
+        n = int(args.rotate * 3 / 0.2)
+        res = await reconnects(f"wss://127.0.0.1:{port}", n, cert, ssl.TLSVersion.TLSv1_3, True, 0.2)
+        full = sum(1 for _, r in res if not r)
+        print(f"rotation every {args.rotate}s: {n} reconnects over {n * 0.2:.1f}s, {full} full handshakes "
+              f"(first connection + about one per rotation), server counted {tls_counts(port, cert)}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+async def workers_run(args, cert: str, key: str):
+    port = args.port + 3
+    proc = start_server(port, {"DRAIN_TIMEOUT": "0", "TLS_CERT": cert, "TLS_KEY": key, "WORKERS": "2"}, quiet=True, settle=0.5)
+    try:
+        res = await reconnects(f"wss://127.0.0.1:{port}", args.reconnects, cert, ssl.TLSVersion.TLSv1_3, True)
+        print(f"WORKERS=2: {sum(r for _, r in res)}/{len(res)} resumed; "
+              f"two /metrics scrapes (one per worker, whichever answers): {tls_counts(port, cert)} {tls_counts(port, cert)}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="wss reconnect: full vs resumed TLS handshakes")
+    parser.add_argument("--rtt", type=float, default=600, help="emulated round trip (ms)")
+    parser.add_argument("--reconnects", type=int, default=20)
+    parser.add_argument("--cpu-conns", type=int, default=500, help="connections per server CPU measurement (no proxy)")
+    parser.add_argument("--rotate", type=float, default=2, help="TLS_TICKET_ROTATE for the rotation check")
+    parser.add_argument("--port", type=int, default=18930)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        cert, key = make_cert(d)
+        asyncio.run(rtt_runs(args, cert, key))
+        asyncio.run(rotation_run(args, cert, key))
+        asyncio.run(workers_run(args, cert, key))
+
+if __name__ == "__main__":
+    main()
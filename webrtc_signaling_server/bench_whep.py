@@ -0,0 +1,161 @@
+# bench_whep.py
+"""
+Viewer setup latency: WHEP (one HTTP POST) vs the websocket path.
+
+One server (WHIP_PORT on) and one aiortc publisher in room "home" on a direct
+connection, running signaling_loop_pro like publisher_U3 (a test video
+track, a "telemetry" data channel, PeerSignaling, --pool warm peer
+connections as PC_POOL_SIZE), rebuilt after every viewer. A WHEP viewer's
+offer reaches a publisher whose warm pc already holds an unanswered offer,
+so the publisher answers it on a fresh pc (the handoff). Viewers
+reach the server through a TCP proxy that delays every chunk by --rtt/2 each
+way (bench_tls.DelayProxy); media stays on localhost. Per trial, from the
+viewer's start:
+
+  answer ms: offer/answer done at the viewer (remote description set)
+  frame ms:  first decoded video frame
+
+  websocket: signaling_loop_pro as viewer_U3 (connect, join, presence ->
+             publisher offers -> viewer answers)
+  whep:      utils.whip_whep_loop (POST offer, answer in the response)
+
+The proxy accepts locally, so TCP handshakes are not delayed: a real link
+adds one RTT to both paths.
+
+    python bench_whep.py --rtt 300 --trials 10
+    python bench_whep.py --pool 0
+"""
+import io
+import os
+import time
+import asyncio
+import argparse
+import contextlib
+
+from aiortc import RTCPeerConnection, VideoStreamTrack
+
+from loadgen import pct, start_server
+from bench_tls import DelayProxy
+from config import PC_POOL_SIZE
+from utils import PeerConnectionPool, PeerSignaling, signaling_loop_pro, whip_whep_loop
+
+def no_icecandidate(candidate):
+    pass  # aiortc puts its candidates in the SDP
+
+def new_peer():
+    pc = RTCPeerConnection()
+    pc.addTrack(VideoStreamTrack())
+    pc.createDataChannel("telemetry")
+    return pc, PeerSignaling(pc, "publisher")
+
+async def publisher(url: str, pool: PeerConnectionPool, ready: asyncio.Event):
+    """publisher_U3's loop: one peer connection per viewer, rebuilt when it is lost."""
+    handoff = {}
+    while True:
+        if pool is not None:
+            pc, signal = await pool.get(warm=not handoff)
+        else:
+            pc, signal = new_peer()
+        lost = asyncio.Event()
+
+        @pc.on("connectionstatechange")
+        async def on_state():
+            if pc.connectionState in ("failed", "disconnected", "closed"):
+                lost.set()
+
+        task = asyncio.create_task(signaling_loop_pro(pc, lost, no_icecandidate, "publisher", 3, url, signal,
+                                                      handoff=handoff))
+        ready.set()
+        await lost.wait()
+        ready.clear()
+        task.cancel()
+        await pc.close()
+        if not handoff:
+            await asyncio.sleep(0.2)
+
+async def viewer(kind: str, url: str) -> tuple:
+    pc = RTCPeerConnection()
+    lost = asyncio.Event()
+    pc.createDataChannel("gcs_command")
+    first_frame = asyncio.get_running_loop().create_future()
+
+    @pc.on("track")
+    def on_track(track):
+        async def read():
+            await track.recv()
+            if not first_frame.done():
+                first_frame.set_result(time.monotonic())
+        asyncio.ensure_future(read())
+
+    t0 = time.monotonic()
+    if kind == "whep":
+        pc.addTransceiver("video", direction="recvonly")
+        task = asyncio.create_task(whip_whep_loop(pc, lost, url, "viewer"))
+    else:
+        task = asyncio.create_task(signaling_loop_pro(pc, lost, no_icecandidate, "viewer", 3, url))
+    answered = None
+    try:
+        while answered is None and time.monotonic() - t0 < 15:
+            if pc.remoteDescription is not None and pc.localDescription is not None and pc.signalingState == "stable":
+                answered = time.monotonic()
+            await asyncio.sleep(0.002)
+        frame = await asyncio.wait_for(first_frame, 15)
+        return (answered - t0) * 1000, (frame - t0) * 1000
+    except (asyncio.TimeoutError, TypeError):
+        return float("nan"), float("nan")
+    finally:
+        lost.set()
+        if kind == "whep":
+            await asyncio.wait_for(task, 10)  # DELETE
+        else:
+            task.cancel()
+        await pc.close()
+
+async def run(args):
+    port, whip_port = args.port, args.port + 1
+    proc = start_server(port, {"WHIP_PORT": str(whip_port), "DRAIN_TIMEOUT": "0"}, wait_port=whip_port, quiet=True)
+    ws_proxy, http_proxy = DelayProxy(port, args.rtt / 1000), DelayProxy(whip_port, args.rtt / 1000)
+    await ws_proxy.start(port + 2)
+    await http_proxy.start(port + 3)
+    ready = asyncio.Event()
+    pool = PeerConnectionPool(new_peer, args.pool) if args.pool > 0 else None
+    pub = asyncio.create_task(publisher(f"ws://127.0.0.1:{port}", pool, ready))
+    urls = {"websocket": f"ws://127.0.0.1:{port + 2}", "whep": f"http://127.0.0.1:{port + 3}/whep/home"}
+    results = {kind: [] for kind in urls}
+    try:
+        for _ in range(args.trials):
+            for kind, url in urls.items():
+                await ready.wait()
+                await asyncio.sleep(1)  # publisher seated
+                results[kind].append(await viewer(kind, url))
+                await asyncio.sleep(0.5)  # publisher sees the viewer leave
+    finally:
+        pub.cancel()
+        if pool is not None:
+            await pool.close()
+        ws_proxy.server.close()
+        http_proxy.server.close()
+        proc.terminate()
+        proc.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="viewer setup latency: WHEP vs websocket signaling")
+    parser.add_argument("--rtt", type=float, default=300, help="emulated round trip viewer <-> server (ms)")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--pool", type=int, default=PC_POOL_SIZE, help="publisher's warm peer connections (0 = off)")
+    parser.add_argument("--port", type=int, default=18940)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):  # signaling_loop_pro / whip_whep_loop are chatty
+        results = asyncio.run(run(args))
+    print(f"rtt={args.rtt:.0f}ms trials={args.trials} pool={args.pool}")
+    print(f"{'path':>10} {'ok':>5} {'answer p50':>11} {'answer p90':>11} {'RTTs':>5} {'frame p50':>10} {'frame p90':>10}")
+    for kind, res in results.items():
+        answers, frames = [a for a, _ in res], [f for _, f in res]
+        ok = sum(1 for f in frames if f == f)
+        print(f"{kind:>10} {ok:>2}/{len(res):<2} {pct(answers, 0.5):>11.0f} {pct(answers, 0.9):>11.0f} "
+              f"{pct(answers, 0.5) / args.rtt if args.rtt else 0:>5.1f} {pct(frames, 0.5):>10.0f} {pct(frames, 0.9):>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# bench_workers.py
+"""
+Benchmark signaling_server_pro.py with WORKERS=1,2,4,...
+
+For each worker count the server is started as a subprocess, then:
+  - connections/sec: clients connect, join a room and wait for the "peers" reply
+  - routing msgs/sec: pairs of peers in the same room bounce offer/answer back and forth
+    (with several workers the two ends of a pair often land on different processes,
+    so this also exercises the worker bus)
+
+The load runs in several client processes so the generator is not the bottleneck.
+
+    python bench_workers.py --workers 1 2 4 --clients 4 --conns 2000 --pairs 200 --duration 5
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+
+import websockets
+
+from loadgen import start_server
+
+def stop_server(proc: subprocess.Popen):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+# ====== connection rate ======
+async def _connect_many(url: str, client: int, count: int, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    conns = []
+
+    async def one(i: int):
+        async with sem:
+            ws = await websockets.connect(f"{url}?room=r{i % 50}&peer=c{client}-{i}", ping_interval=None)
+            while json.loads(await ws.recv()).get("type") != "peers":
+                pass
+            conns.append(ws)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - t0
+    await asyncio.gather(*(ws.close() for ws in conns), return_exceptions=True)
+    return elapsed
+
+def connect_worker(args):
+    return asyncio.run(_connect_many(*args))
+
+# ====== routing throughput ======
+async def _route_pairs(url: str, client: int, pairs: int, window: int, duration: float):
+    routed = 0
+    stop = asyncio.Event()
+
+    async def pair(i: int):
+        nonlocal routed
+        room = f"p{client}-{i}"
+        a = await websockets.connect(f"{url}?room={room}&peer=a", ping_interval=None)
+        b = await websockets.connect(f"{url}?room={room}&peer=b", ping_interval=None)
+        offer = json.dumps({"type": "offer", "to": "b", "sdp": "x" * 2000, "sdpType": "offer"})
+        answer = json.dumps({"type": "answer", "to": "a", "sdp": "y" * 2000, "sdpType": "answer"})
+
+        async def side_b():
+            async for raw in b:
+                if json.loads(raw).get("type") == "offer":
+                    await b.send(answer)
+
+        # wait until a's worker knows about b before routing to it
+        while True:
+            msg = json.loads(await a.recv())
+            if msg.get("type") == "peer-joined" or "b" in msg.get("peers", []):
+                break
+        b_task = asyncio.create_task(side_b())
+        for _ in range(window):
+            await a.send(offer)
+        async for raw in a:
+            if json.loads(raw).get("type") == "answer":
+                routed += 2
+                if stop.is_set():
+                    break
+                await a.send(offer)
+        b_task.cancel()
+        await a.close()
+        await b.close()
+
+    tasks = [asyncio.create_task(pair(i)) for i in range(pairs)]
+    await asyncio.sleep(duration)
+    stop.set()
+    t_end = time.perf_counter()
+    await asyncio.wait(tasks, timeout=5)
+    return routed, t_end
+
+def route_worker(args):
+    return asyncio.run(_route_pairs(*args))
+
+def run_bench(workers: int, args) -> dict:
+    port = args.port
+    url = f"ws://127.0.0.1:{port}"
+    proc = start_server(port, {"WORKERS": str(workers), "MAX_MSGS_PER_SEC": "1000000", "ROOM_CAP": "100000"},
+                        settle=0.5 if workers > 1 else 0)
+    try:
+        with multiprocessing.get_context("spawn").Pool(args.clients) as pool:
+            per = args.conns // args.clients
+            elapsed = pool.map(connect_worker, [(url, c, per, args.concurrency) for c in range(args.clients)])
+            conn_rate = per * args.clients / max(elapsed)
+
+            per = max(1, args.pairs // args.clients)
+            results = pool.map(route_worker, [(url, c, per, args.window, args.duration) for c in range(args.clients)])
+            routed = sum(r for r, _ in results)
+    finally:
+        stop_server(proc)
+    return {"workers": workers, "conn_per_s": conn_rate, "routed_per_s": routed / args.duration}
+
+def main():
+    parser = argparse.ArgumentParser(description="signaling_server_pro worker scaling benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--conns", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="in-flight handshakes per client process")
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--window", type=int, default=4, help="offers in flight per pair")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--port", type=int, default=18889)
+    args = parser.parse_args()
+
+    print(f"cpus={os.cpu_count()} clients={args.clients}")
+    print(f"{'workers':>8} {'conn/s':>10} {'routed msg/s':>14}")
+    for w in args.workers:
+        r = run_bench(w, args)
+        print(f"{r['workers']:>8} {r['conn_per_s']:>10.0f} {r['routed_per_s']:>14.0f}")
+
+if __name__ == "__main__":
+    main()
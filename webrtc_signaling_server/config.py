@@ -10,6 +10,8 @@ udp_multicast_telemetry_port = 40002
 # ====== SIGNALING SERVER ======
 # SIGNALING_SERVER = "ws://dev.bitsec.it:8889"
 SIGNALING_SERVER = "ws://171.224.83.50:8889"
+SIGNALING_ROOM   = "home"   # cả đội drone dùng chung một phòng được
+STREAM_ID        = ""       # publisher: luồng của drone này; viewer: luồng muốn xem ("" = publisher nào cũng được)
 
 # ====== TURN SERVER ======
 # TURN_HOST     = "dev.bitsec.it:3478"       # "198.51.100.22:3478"
@@ -23,6 +25,36 @@ TURN_PASS     = "1123581321"
 # thời gian thiết lập lại peer connection
 PC_RETRY_TIME = 2
 
+# khôi phục kết nối theo bậc (utils.IceRecovery)
+ICE_CHECK_INTERVAL     = 0.5   # giây giữa hai lần STUN check trên cặp candidate đang dùng
+ICE_DISCONNECTED_GRACE = 2     # mất kết nối ít hơn ngần này giây thì chỉ chờ, không làm gì
+ICE_RESTART_TIMEOUT    = 10    # mỗi lần ICE restart tối đa bao lâu
+ICE_RESTARTS           = 2     # số lần ICE restart trước khi dựng lại peer connection (0 = dựng lại luôn)
+
+# publisher giữ sẵn peer connection đã gather candidate / cấp phát TURN (utils.PeerConnectionPool)
+PC_POOL_SIZE    = 1    # số pc ấm, 0 = tắt
+PC_POOL_MAX_AGE = 60   # giây, pc ấm cũ hơn thì thay (NAT mapping có thể đã hết hạn)
+
+# dùng lại giữa các lần dựng peer connection (utils.IceServerCache)
+ICE_DNS_TTL      = 300               # giây, phân giải lại tên miền STUN/TURN trong nền
+
+# data channel nghẽn (utils.ChannelSender): aiortc giữ tối đa ngần này byte, phần còn lại xếp hàng có giới hạn
+CHANNEL_BUFFER_HIGH = 4 * 1024    # byte, bufferedAmount quá mức này thì ngừng giao cho aiortc
+CHANNEL_BUFFER_LOW  = 1024        # byte, bufferedAmount xuống tới đây thì gửi tiếp hàng đợi
+CHANNEL_QUEUE_MAX   = 64 * 1024   # byte mỗi kênh; trạng thái chỉ giữ bản mới nhất, lệnh đầy thì bỏ lệnh mới
+
+# mỗi loại message một data channel (utils.ChannelManager): nhãn -> (loại, ordered, maxRetransmits, maxPacketLifeTime ms)
+# "state": frame trạng thái (telemetry_protocol.STATE, CRC đúng), "reliable": còn lại; chỉ một kênh thì mọi thứ đi kênh đó
+# kênh đầu tiên là kênh cũ: peer chưa trả READY cho kênh khác thì mọi thứ đi kênh đầu tiên
+TELEMETRY_CHANNELS = {   # publisher -> viewer
+    "telemetry":       ("reliable", True,  None, None),   # ack, param, mission, statustext: phải tới, đúng thứ tự
+    "telemetry_state": ("state",    False, 0,    None),   # attitude, vị trí...: mất gói thì thôi, không chặn gói sau
+}
+COMMAND_CHANNELS = {     # viewer -> publisher
+    "gcs_command": ("reliable", True,  None, None),       # COMMAND_*, SET_MODE, MANUAL_CONTROL, RTCM, mission, param từ GCS
+    "gcs_control": ("state",    False, None, 200),        # HEARTBEAT của GCS: gửi lại trong 200 ms rồi bỏ
+}
+
 ice_servers = [
     #RTCIceServer(urls=["stun:stun.l.google.com:19302"])
     #RTCIceServer(urls=[f"stun:{TURN_HOST}"]),  # STUN free
@@ -31,6 +63,10 @@ ice_servers = [
 
 
 ##### CONFIG CHO PUBLISHER #####
+UART_RTSCTS = False   # bật nếu dây có RTS/CTS: publisher đọc không kịp thì autopilot tự dừng gửi
+# gộp frame MAVLink vào một message data channel (telemetry_protocol.TelemetryPacker)
+TELEMETRY_PACK_SIZE  = 1200    # byte, một gói SCTP của aiortc
+TELEMETRY_PACK_DELAY = 0.005   # giây chờ tối đa để gộp, 0 = gửi từng frame
 eth0_ip_address = "192.168.1.111"
 udp_unicast_video_port = 40005
 
@@ -0,0 +1,455 @@
+# loadgen.py
+"""
+Load generator for signaling_server_pro.py.
+
+Synthetic peers speak the real protocol: they connect with
+?room=&peer=[&role=], track the room from peers / peer-joined / peer-left /
+presence, and send a weighted mix of offer, answer, candidate and ping
+messages to peers they know about. Churn makes peers leave ("leave"
+message) and come back. Routed messages carry their send time
+(time.monotonic, shared by all processes on the host), so the receiving
+peer measures routing latency end to end.
+
+Reports connections/sec, routing latency p50/p99/p999, ping RTT, errors by
+reason and server RSS: the server process and every process under it
+(WORKERS > 1: the workers hold the sessions); from /admin/sessions only
+for a single worker, since each worker reports its own. --spawn starts the
+server itself; --json writes the summary and the --max-*/--min-* options
+turn it into a CI gate (exit code 1 when a threshold is missed).
+
+    python loadgen.py --spawn --peers 2000 --room-size 10 --rate 2 --churn 20 --duration 30
+    python loadgen.py --url ws://127.0.0.1:8889 --server-pid 1234 --mix offer=1,answer=1,candidate=4,ping=2
+    python loadgen.py --spawn --peers 500 --duration 10 --json out.json --max-p99-ms 50 --min-conn-rate 100
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+import urllib.request
+from collections import Counter, deque
+
+import websockets
+
+from signaling_protocol import SUBPROTOCOL, ROUTED_TYPES, frame_from_json, frame_to_json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PAGE = os.sysconf("SC_PAGE_SIZE")
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+# ------------------ shared with the bench_*.py scripts ------------------
+def start_server(port: int, env: dict = None, script: str = "signaling_server_pro.py", wait_port: int = None,
+                 settle: float = 0.0, quiet: bool = False) -> subprocess.Popen:
+    """
+    Run script (next to this file, or a path) with PORT=port, LOG_LEVEL=WARNING, STATS_INTERVAL=0 and env on
+    top of os.environ. Returns once wait_port (default port) accepts, plus settle s (WORKERS > 1: let the bus
+    links come up). quiet: drop the server's stderr.
+    """
+    env = {**os.environ, "PORT": str(port), "LOG_LEVEL": "WARNING", "STATS_INTERVAL": "0", **(env or {})}
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, script)], env=env,
+                            stderr=subprocess.DEVNULL if quiet else None)
+    for _ in range(100):
+        if proc.poll() is not None:
+            raise RuntimeError(f"{script} exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", wait_port or port), timeout=0.2).close()
+            time.sleep(settle)
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{script} did not start")
+
+def pct(values, q: float) -> float:
+    """q-quantile (0.5, 0.99, ...) of values, NaNs ignored; nan if there is nothing left."""
+    values = sorted(v for v in values if v == v)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+def cpu_seconds(pid: int) -> float:
+    """User + system CPU seconds pid has used, 0 once it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+def process_tree(pid: int) -> list:
+    """pid and every process below it (WORKERS > 1: the supervisor and its workers)."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [pid]
+    while todo:
+        tree.append(todo.pop())
+        todo.extend(children.get(tree[-1], ()))
+    return tree
+
+def rss_of(pid: int) -> int:
+    """Resident bytes of pid and its children: with WORKERS > 1 the sessions live in the workers, not in pid."""
+    total = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/statm") as f:
+                total += int(f.read().split()[1]) * PAGE
+        except OSError:
+            if p == pid:
+                raise
+    return total
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in (*ROUTED_TYPES, "ping"):
+            raise argparse.ArgumentTypeError(f"unknown message type in mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+# ====== one client process ======
+class Stats:
+    def __init__(self):
+        self.measuring = False
+        self.latency = []  # routed messages, s
+        self.ping_rtt = []
+        self.sent = Counter()
+        self.received = Counter()
+        self.errors = Counter()
+        self.connect_time = []  # handshake until the "peers" reply, s
+        self.connect_failures = 0
+        self.churned = 0
+
+class Peer:
+    def __init__(self, opts: dict, stats: Stats, room: str, peer_id: str, role: str):
+        self.opts = opts
+        self.stats = stats
+        self.room = room
+        self.peer_id = peer_id
+        self.role = role
+        self.ws = None
+        self.known = {}  # peer ids this peer may route to (ordered set)
+        self.pings = deque()  # send times of pings waiting for a pong
+        self.payload = {"sdp": "x" * opts["sdp_size"], "sdpType": "offer"}
+
+    async def connect(self):
+        o = self.opts
+        url = f"{o['url']}?room={self.room}&peer={self.peer_id}"
+        if self.role:
+            url += f"&role={self.role}"
+        if o["token"]:
+            url += f"&token={o['token']}"
+        t0 = time.monotonic()
+        try:
+            ws = await websockets.connect(url, ping_interval=None, compression=None, max_queue=None,
+                                          open_timeout=o["timeout"],
+                                          subprotocols=[SUBPROTOCOL] if o["binary"] else None)
+            hello = json.loads(await asyncio.wait_for(ws.recv(), o["timeout"]))
+        except Exception:
+            self.stats.connect_failures += 1
+            return False
+        self.stats.connect_time.append(time.monotonic() - t0)
+        self.known = dict.fromkeys(hello.get("peers", []))
+        self.pings.clear()
+        self.ws = ws
+        asyncio.create_task(self.read(ws))
+        return True
+
+    async def read(self, ws):
+        st = self.stats
+        try:
+            async for raw in ws:
+                msg = frame_to_json(raw) if isinstance(raw, bytes) else json.loads(raw)
+                t = msg.get("type")
+                if st.measuring:
+                    st.received[t] += 1
+                if t in ROUTED_TYPES:
+                    if st.measuring and "ts" in msg:
+                        st.latency.append(time.monotonic() - msg["ts"])
+                elif t == "pong":
+                    if self.pings:
+                        sent = self.pings.popleft()
+                        if st.measuring:
+                            st.ping_rtt.append(time.monotonic() - sent)
+                elif t == "peer-joined":
+                    self.known[msg["peer"]] = None
+                elif t == "peer-left":
+                    self.known.pop(msg["peer"], None)
+                elif t == "presence":
+                    for p in msg.get("left", []):
+                        self.known.pop(p, None)
+                    for p in msg.get("joined", []):
+                        self.known[p] = None
+                elif t == "error" and st.measuring:
+                    st.errors[msg.get("reason", "?")] += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def send_one(self, msg_type: str):
+        ws = self.ws
+        if ws is None:
+            return
+        if msg_type == "ping":
+            self.pings.append(time.monotonic())
+            data = json.dumps({"type": "ping"})
+        else:
+            if not self.known:
+                return
+            target = random.choice(list(self.known))
+            msg = {"type": msg_type, "to": target, "ts": time.monotonic()}
+            if msg_type in ("offer", "answer"):
+                msg.update(self.payload)
+            elif msg_type == "candidate":
+                msg["candidate"] = "candidate:1 1 UDP 2122260223 10.0.0.1 50000 typ host"
+            data = frame_from_json(msg) if self.opts["binary"] else json.dumps(msg)
+        try:
+            await ws.send(data)
+        except websockets.exceptions.ConnectionClosed:
+            return
+        if self.stats.measuring:
+            self.stats.sent[msg_type] += 1
+
+    async def leave(self):
+        ws, self.ws = self.ws, None
+        if ws is None:
+            return
+        try:
+            await ws.send(json.dumps({"type": "leave"}))
+            await asyncio.wait_for(ws.wait_closed(), self.opts["timeout"])
+        except Exception:
+            await ws.close()
+
+async def run_client(index: int, opts: dict) -> dict:
+    stats = Stats()
+    rng = random.Random(opts["seed"] + index)
+    random.seed(opts["seed"] + index)
+    mine = [i for i in range(opts["peers"]) if i % opts["procs"] == index]
+    peers = []
+    for i in mine:
+        room_no = i // opts["room_size"]
+        role = ""
+        if opts["roles"]:
+            role = "publisher" if i % opts["room_size"] == 0 else "viewer"
+        peers.append(Peer(opts, stats, f"load-{room_no}", f"p{i}", role))
+
+    # ramp: everyone connects, at most --concurrency handshakes at a time
+    sem = asyncio.Semaphore(opts["concurrency"])
+
+    async def connect(peer: Peer):
+        async with sem:
+            await peer.connect()
+
+    t0 = time.monotonic()
+    await asyncio.gather(*(connect(p) for p in peers))
+    ramp = time.monotonic() - t0
+    ramp_connects = len(stats.connect_time)
+    await asyncio.sleep(opts["warmup"])
+
+    stop = asyncio.Event()
+    names = list(opts["mix"])
+    weights = [opts["mix"][n] for n in names]
+    rate = opts["rate"]
+
+    async def talk(peer: Peer):
+        while not stop.is_set():
+            await asyncio.sleep(rng.expovariate(rate))
+            await peer.send_one(rng.choices(names, weights)[0])
+
+    async def churn():
+        per_proc = opts["churn"] / opts["procs"]
+        while not stop.is_set():
+            await asyncio.sleep(rng.expovariate(per_proc))
+            peer = rng.choice(peers)
+            if peer.ws is None:
+                continue
+            stats.churned += 1
+
+            async def cycle(p=peer):
+                await p.leave()
+                await asyncio.sleep(opts["churn_downtime"])
+                if not stop.is_set():
+                    async with sem:
+                        await p.connect()
+            asyncio.create_task(cycle())
+
+    stats.measuring = True
+    tasks = [asyncio.create_task(talk(p)) for p in peers if rate > 0]
+    if opts["churn"] > 0:
+        tasks.append(asyncio.create_task(churn()))
+    await asyncio.sleep(opts["duration"])
+    stop.set()
+    await asyncio.sleep(0.5)  # let in-flight messages land
+    stats.measuring = False
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await asyncio.gather(*(p.ws.close() for p in peers if p.ws), return_exceptions=True)
+    return {
+        "peers": len(peers),
+        "ramp_s": ramp,
+        "ramp_connects": ramp_connects,
+        "connect_time": stats.connect_time,
+        "connect_failures": stats.connect_failures,
+        "latency": stats.latency,
+        "ping_rtt": stats.ping_rtt,
+        "sent": dict(stats.sent),
+        "received": dict(stats.received),
+        "errors": dict(stats.errors),
+        "churned": stats.churned,
+    }
+
+def client_process(args):
+    return asyncio.run(run_client(*args))
+
+# ====== driver ======
+def server_rss(args, proc) -> int:
+    pid = proc.pid if proc else args.server_pid
+    if pid:
+        try:
+            return rss_of(pid)
+        except OSError:
+            return 0
+    http = args.url.replace("ws://", "http://", 1).replace("wss://", "https://", 1)
+    try:
+        q = f"?token={args.token}" if args.token else ""
+        with urllib.request.urlopen(f"{http}/admin/sessions{q}", timeout=5) as r:
+            report = json.loads(r.read())
+    except Exception:
+        return 0
+    if report.get("workers", 1) > 1:
+        return 0  # one worker's RSS, not the server's: no per-peer figure (run with --spawn or --server-pid)
+    return report.get("rss_bytes", 0)
+
+def summarize(args, results, rss) -> dict:
+    lat = [x for r in results for x in r["latency"]]
+    rtt = [x for r in results for x in r["ping_rtt"]]
+    connect_time = [x for r in results for x in r["connect_time"]]
+    sent, received, errors = Counter(), Counter(), Counter()
+    for r in results:
+        sent.update(r["sent"])
+        received.update(r["received"])
+        errors.update(r["errors"])
+    ramp = max(r["ramp_s"] for r in results)
+    ms = lambda v: round(v * 1000, 3)
+    routed_sent = sum(n for t, n in sent.items() if t in ROUTED_TYPES)
+    return {
+        "peers": args.peers,
+        "rooms": -(-args.peers // args.room_size),
+        "duration_s": args.duration,
+        "conn_per_s": round(sum(r["ramp_connects"] for r in results) / ramp, 1) if ramp else 0,
+        "connect_ms": {"p50": ms(pct(connect_time, 0.5)), "p99": ms(pct(connect_time, 0.99))},
+        "connect_failures": sum(r["connect_failures"] for r in results),
+        "churned": sum(r["churned"] for r in results),
+        "sent": dict(sent),
+        "received": dict(received),
+        "routed_per_s": round(len(lat) / args.duration, 1),
+        "routed_delivery": round(len(lat) / routed_sent, 4) if routed_sent else None,
+        "route_latency_ms": {"p50": ms(pct(lat, 0.5)), "p99": ms(pct(lat, 0.99)), "p999": ms(pct(lat, 0.999)),
+                             "max": ms(max(lat)) if lat else None},
+        "ping_rtt_ms": {"p50": ms(pct(rtt, 0.5)), "p99": ms(pct(rtt, 0.99))},
+        "errors": dict(errors),
+        "server_rss_mb": {k: round(v / 2**20, 1) for k, v in rss.items()},
+        "server_rss_per_peer_kb": round((rss["peak"] - rss["start"]) / args.peers / 1024, 1) if rss["start"] else None,
+    }
+
+def report(s: dict):
+    print(f"peers={s['peers']} rooms={s['rooms']} duration={s['duration_s']}s churned={s['churned']}")
+    print(f"connect: {s['conn_per_s']} conn/s during ramp, p50 {s['connect_ms']['p50']} ms, "
+          f"p99 {s['connect_ms']['p99']} ms, failed {s['connect_failures']}")
+    print(f"sent: {s['sent']}")
+    print(f"routed: {s['routed_per_s']} msg/s delivered ({s['routed_delivery']} of sent)")
+    l = s["route_latency_ms"]
+    print(f"route latency ms: p50 {l['p50']}  p99 {l['p99']}  p999 {l['p999']}  max {l['max']}")
+    print(f"ping rtt ms: p50 {s['ping_rtt_ms']['p50']}  p99 {s['ping_rtt_ms']['p99']}")
+    print(f"errors: {s['errors'] or 'none'}")
+    r = s["server_rss_mb"]
+    print(f"server rss MB: start {r['start']}  peak {r['peak']}  "
+          f"({s['server_rss_per_peer_kb']} KB/peer)")
+
+def check(args, s: dict) -> list:
+    failed = []
+    if args.max_p99_ms is not None and not s["route_latency_ms"]["p99"] <= args.max_p99_ms:
+        failed.append(f"route p99 {s['route_latency_ms']['p99']} ms > {args.max_p99_ms}")
+    if args.min_conn_rate is not None and s["conn_per_s"] < args.min_conn_rate:
+        failed.append(f"conn/s {s['conn_per_s']} < {args.min_conn_rate}")
+    if args.max_errors is not None and sum(s["errors"].values()) > args.max_errors:
+        failed.append(f"errors {sum(s['errors'].values())} > {args.max_errors}")
+    if args.max_connect_failures is not None and s["connect_failures"] > args.max_connect_failures:
+        failed.append(f"connect failures {s['connect_failures']} > {args.max_connect_failures}")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="signaling_server_pro load generator")
+    parser.add_argument("--url", default="ws://127.0.0.1:8889")
+    parser.add_argument("--spawn", action="store_true", help="start signaling_server_pro.py on --port")
+    parser.add_argument("--port", type=int, default=18897)
+    parser.add_argument("--server-env", default="", help="extra env for --spawn, e.g. WORKERS=2,PRESENCE_WINDOW=0")
+    parser.add_argument("--server-pid", type=int, help="read RSS of an already running server")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--peers", type=int, default=1000)
+    parser.add_argument("--room-size", type=int, default=10)
+    parser.add_argument("--roles", action="store_true", help="first peer of each room is the publisher, the rest viewers")
+    parser.add_argument("--rate", type=float, default=2.0, help="messages per peer per second")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("offer=1,answer=1,candidate=4,ping=2"))
+    parser.add_argument("--sdp-size", type=int, default=2000)
+    parser.add_argument("--binary", action="store_true", help="use the binary subprotocol")
+    parser.add_argument("--churn", type=float, default=0.0, help="leave+rejoin cycles per second, all peers")
+    parser.add_argument("--churn-downtime", type=float, default=0.5)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=100, help="in-flight handshakes per client process")
+    parser.add_argument("--procs", type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)), help="client processes")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the summary here")
+    parser.add_argument("--max-p99-ms", type=float)
+    parser.add_argument("--min-conn-rate", type=float)
+    parser.add_argument("--max-errors", type=int)
+    parser.add_argument("--max-connect-failures", type=int)
+    args = parser.parse_args()
+
+    proc = None
+    if args.spawn:
+        extra = dict(kv.split("=", 1) for kv in args.server_env.split(",") if kv)
+        proc = start_server(args.port, {"ROOM_CAP": "100000", "MAX_MSGS_PER_SEC": "1000", **extra})
+        args.url = f"ws://127.0.0.1:{args.port}"
+    opts = {k: getattr(args, k) for k in ("url", "token", "peers", "room_size", "roles", "rate", "mix", "sdp_size",
+                                          "binary", "churn", "churn_downtime", "duration", "warmup", "concurrency",
+                                          "procs", "timeout", "seed")}
+    try:
+        rss = {"start": server_rss(args, proc)}
+        with multiprocessing.get_context("spawn").Pool(args.procs) as pool:
+            pending = pool.map_async(client_process, [(i, opts) for i in range(args.procs)])
+            peak = rss["start"]
+            while not pending.ready():
+                pending.wait(0.5)
+                peak = max(peak, server_rss(args, proc))
+            results = pending.get()
+        rss["peak"] = peak
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    summary = summarize(args, results, rss)
+    report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    failed = check(args, summary)
+    for line in failed:
+        print(f"FAIL: {line}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# signaling_protocol.py
+"""
+Binary signaling subprotocol shared by signaling_server_pro.py and utils.py.
+
+Clients that offer the "signal.bin.v1" websocket subprotocol may send routed
+messages (offer/answer/candidate/renegotiate/ice-restart) as binary frames:
+
+    +------+----------+--------+------+----+----------------+
+    | type | from_len | to_len | from | to | body (opaque)  |
+    +------+----------+--------+------+----+----------------+
+      1 B      1 B       1 B
+
+The server routes on the header: it fills in "from" and forwards the body
+bytes untouched, after checking once that they decode (check_body). The body is the JSON object of the remaining fields
+(sdp, sdpType, candidate, ...). Control messages (peers, leave, ping, errors,
+presence) stay JSON text frames, and plain JSON clients keep working.
+"""
+import json
+from typing import Tuple
+
+SUBPROTOCOL = "signal.bin.v1"
+
+ROUTED_TYPES = ("offer", "answer", "candidate", "renegotiate", "ice-restart")
+TYPE_CODES = {t: i + 1 for i, t in enumerate(ROUTED_TYPES)}
+CODE_TYPES = {i: t for t, i in TYPE_CODES.items()}
+
+def encode_frame(msg_type: str, frm: str, to: str, body: bytes) -> bytes:
+    f = frm.encode()
+    t = to.encode()
+    if len(f) > 255 or len(t) > 255:
+        raise ValueError("peer id too long")
+    return b"".join((bytes((TYPE_CODES[msg_type], len(f), len(t))), f, t, body))
+
+def decode_header(frame: bytes) -> Tuple[str, str, str, int]:
+    """Return (type, from, to, body offset) without touching the body."""
+    if len(frame) < 3 or frame[0] not in CODE_TYPES:
+        raise ValueError("bad frame header")
+    body_at = 3 + frame[1] + frame[2]
+    if len(frame) < body_at:
+        raise ValueError("truncated frame header")
+    frm = frame[3:3 + frame[1]].decode()
+    to = frame[3 + frame[1]:body_at].decode()
+    return CODE_TYPES[frame[0]], frm, to, body_at
+
+def check_body(frame: bytes, body_at: int):
+    """Raise ValueError unless the body is empty or a JSON object, i.e. frame_to_json() can decode it."""
+    if body_at < len(frame) and not isinstance(json.loads(frame[body_at:]), dict):
+        raise ValueError("frame body is not a JSON object")
+
+def with_sender(frame: bytes, frm: str) -> bytes:
+    """Rewrite the "from" field, keeping type, target and body bytes as they are."""
+    msg_type, _, to, body_at = decode_header(frame)
+    return encode_frame(msg_type, frm, to, memoryview(frame)[body_at:])
+
+def frame_from_json(obj: dict) -> bytes:
+    body = {k: v for k, v in obj.items() if k not in ("type", "from", "to")}
+    return encode_frame(obj["type"], obj.get("from", ""), obj.get("to", ""), json.dumps(body).encode())
+
+def frame_to_json(frame: bytes) -> dict:
+    """Decode a frame into the dict a JSON client would have received."""
+    msg_type, frm, to, body_at = decode_header(frame)
+    obj = {"type": msg_type}
+    if frm:
+        obj["from"] = frm
+    if body_at < len(frame):
+        obj.update(json.loads(frame[body_at:]))
+    return obj
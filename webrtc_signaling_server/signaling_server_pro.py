@@ -1,66 +1,890 @@
 # signaling_server_pro.py
 import os
 import asyncio
+import hashlib
+import hmac
 import json
 import logging
-from typing import Dict, Set, Optional
-from urllib.parse import urlparse, parse_qs
+import multiprocessing
+import random
+import secrets
+import signal
+import ssl
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+from collections import deque
+from http import HTTPStatus
+from typing import Callable, Dict, Set, Optional, List, Tuple, Deque, Union
+from urllib.parse import urlparse, parse_qs, quote, unquote
 
 import websockets
 from websockets.server import WebSocketServerProtocol
 
+from signaling_protocol import (SUBPROTOCOL, ROUTED_TYPES, decode_header, check_body, with_sender,
+                                frame_from_json, frame_to_json)
+
 # ------------------ Config ------------------
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "8889"))
 ALLOWED_ORIGINS = {o.strip() for o in os.getenv("ALLOWED_ORIGINS", "").split(",") if o.strip()}  # e.g. "https://example.com,https://app.example.com"
 AUTH_TOKEN = os.getenv("AUTH_TOKEN")  # optional static token. Set e.g. to "supersecret" and pass ?token=supersecret
-MAX_MSGS_PER_SEC = float(os.getenv("MAX_MSGS_PER_SEC", "50"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", AUTH_TOKEN or "")  # ?token= for the /admin endpoints (default: AUTH_TOKEN)
+MAX_MSGS_PER_SEC = float(os.getenv("MAX_MSGS_PER_SEC", "50"))  # per peer (0 = no limit)
+IP_MSGS_PER_SEC = float(os.getenv("IP_MSGS_PER_SEC", "0"))  # all peers from one source IP together (0 = no limit)
+ROOM_MSGS_PER_SEC = float(os.getenv("ROOM_MSGS_PER_SEC", "0"))  # all peers of one room together (0 = no limit)
+GLOBAL_MSGS_PER_SEC = float(os.getenv("GLOBAL_MSGS_PER_SEC", "0"))  # whole process (0 = no limit)
+IP_CONNS_PER_SEC = float(os.getenv("IP_CONNS_PER_SEC", "0"))  # new connections per source IP, refused with 429 before the upgrade (0 = no limit)
+IP_MAX_CONNS = int(os.getenv("IP_MAX_CONNS", "0"))  # open connections per source IP (0 = no limit)
+GLOBAL_CONNS_PER_SEC = float(os.getenv("GLOBAL_CONNS_PER_SEC", "0"))  # websocket handshakes per second, all sources (0 = no limit)
 ROOM_CAP = int(os.getenv("ROOM_CAP", "64"))
+BOOTSTRAP_TTL = float(os.getenv("BOOTSTRAP_TTL", "0"))  # keep a publisher's unanswered offer for late viewers N s (0 = off)
+PRESENCE_WINDOW = float(os.getenv("PRESENCE_WINDOW", "0.05"))  # batch a room's join/leave notices over N s (0 = send at once)
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "0"))  # hold a dropped peer's seat N s for a reconnect with its resume token (0 = off)
+RESUME_SECRET = (os.getenv("RESUME_SECRET") or secrets.token_hex(16)).encode()  # signs resume tokens; shared by the workers
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "10"))  # on SIGTERM: stop accepting, close rooms one by one over N s (0 = exit at once)
+RECONNECT_JITTER = float(os.getenv("RECONNECT_JITTER", "2"))  # random extra wait (s) in the reconnect hint sent while draining
+NODES = os.getenv("NODES", "")  # signaling nodes sharing the rooms, e.g. "ws://10.0.0.1:8889,ws://10.0.0.2:8889" (empty = no sharding)
+NODES_FILE = os.getenv("NODES_FILE", "")  # or one node URL per line; re-read on SIGHUP
+TLS_CERT = os.getenv("TLS_CERT", "")  # PEM certificate chain: serve wss:// (empty = plain ws://, TLS terminated elsewhere)
+TLS_KEY = os.getenv("TLS_KEY", "")  # PEM private key (empty = in TLS_CERT)
+TLS_TICKET_ROTATE = float(os.getenv("TLS_TICKET_ROTATE", "3600"))  # new ticket key every N s (wall clock); older tickets get a full handshake
+TLS_TICKETS = int(os.getenv("TLS_TICKETS", "2"))  # TLS 1.3 session tickets sent per handshake
+WHIP_PORT = int(os.getenv("WHIP_PORT", "0"))  # HTTP(S) port for WHIP/WHEP: POST an SDP offer, get the answer back (0 = off)
+WHIP_TIMEOUT = float(os.getenv("WHIP_TIMEOUT", "10"))  # s a WHIP/WHEP POST waits for the room to answer
+NODE_URL = os.getenv("NODE_URL", f"{'wss' if TLS_CERT else 'ws'}://127.0.0.1:{PORT}")  # this node as written in NODES
+RING_VNODES = int(os.getenv("RING_VNODES", "160"))  # points per node on the hash ring
+REBALANCE_TIME = float(os.getenv("REBALANCE_TIME", "2"))  # spread the redirects of moved rooms over N s
 PING_INTERVAL = float(os.getenv("PING_INTERVAL", "10"))
 PING_TIMEOUT = float(os.getenv("PING_TIMEOUT", "5"))
+WHEEL_TICK = float(os.getenv("WHEEL_TICK", "0.5"))  # heartbeat timer-wheel resolution (s)
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "60"))  # log liveness/queue stats every N s (0 = off)
+WORKERS = int(os.getenv("WORKERS", "1"))  # >1: N processes share PORT via SO_REUSEPORT
+OUTBOX_SIZE = int(os.getenv("OUTBOX_SIZE", "256"))  # queued messages per connection
+OUTBOX_POLICY = os.getenv("OUTBOX_POLICY", "drop-oldest")  # on overflow: "drop-oldest" (non-SDP) or "close"
+OUTBOX_CLOSE_CODE = int(os.getenv("OUTBOX_CLOSE_CODE", "4429"))  # close code for the "close" policy
+BUS_DIR = os.getenv("BUS_DIR", os.path.join(tempfile.gettempdir(), f"signaling-bus-{PORT}"))  # unix sockets between workers
 
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s [%(levelname)s] %(message)s")
 log = logging.getLogger("signaling")
 
 # ------------------ Data model ------------------
 class Room:
+    __slots__ = ("name", "peers", "remote", "members", "streams", "quiet", "events", "flush", "bootstrap", "limiter",
+                 "received", "latency", "rate_limited")
+
     def __init__(self, name: str):
         self.name = name
-        self.peers: Dict[str, WebSocketServerProtocol] = {}  # peer_id -> ws
+        self.peers: Dict[str, "Session"] = {}  # peer_id -> session (connected to this worker)
+        self.remote: Dict[str, int] = {}  # peer_id -> worker id (connected to another worker)
+        self.members: Dict[str, Dict[str, None]] = {}  # role -> peer ids, local and remote (ordered set)
+        self.streams: Dict[str, str] = {}  # peer_id -> stream id (members that named one)
+        self.quiet: Set[str] = set()  # members seated without a join notice (WHEP viewers): left out of "peers"
+        self.events: List[Tuple[str, str, str, str]] = []  # presence changes not sent yet: (kind, peer_id, role, stream)
+        self.flush: Optional[asyncio.TimerHandle] = None
+        self.bootstrap: Optional[Dict[str, "Bootstrap"]] = None  # publisher id -> cached offer (BOOTSTRAP_TTL)
+        self.limiter = RateLimiter(ROOM_MSGS_PER_SEC) if ROOM_MSGS_PER_SEC > 0 else None
+        # metrics (see /metrics)
+        self.received: Dict[str, int] = {}  # msg type -> count
+        self.latency: Optional["Histogram"] = None  # routed messages delivered to this room's peers
+        self.rate_limited = 0
 
     def list_peers(self) -> Set[str]:
-        return set(self.peers.keys())
+        return set(self.peers.keys()) | set(self.remote.keys())
+
+    def size(self) -> int:
+        return len(self.peers) + len(self.remote)
+
+    def add_member(self, peer_id: str, role: str, stream: str = "", quiet: bool = False):
+        self.remove_member(peer_id)
+        self.members.setdefault(role, {})[peer_id] = None
+        if stream:
+            self.streams[peer_id] = stream
+        if quiet:
+            self.quiet.add(peer_id)
+
+    def remove_member(self, peer_id: str) -> Tuple[str, str]:
+        """Forget peer_id; returns the role and stream it had."""
+        self.quiet.discard(peer_id)
+        stream = self.streams.pop(peer_id, "")
+        for role, group in self.members.items():
+            if peer_id in group:
+                del group[peer_id]
+                return role, stream
+        return "", stream
 
 rooms: Dict[str, Room] = {}
-peer_room: Dict[WebSocketServerProtocol, str] = {}  # ws -> room_name
-peer_id_of: Dict[WebSocketServerProtocol, str] = {}  # ws -> peer_id
+open_sessions = 0  # connections being served, joined to a room or not
+draining = False  # SIGTERM received: see drain()
+moving: Set[str] = set()  # rooms being handed to another node: see rebalance()
 
 # ------------------ Rate limiter (leaky bucket) ------------------
 class RateLimiter:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
     def __init__(self, rate_per_sec: float, burst: Optional[int] = None):
         self.rate = rate_per_sec
         self.capacity = burst or max(10, int(rate_per_sec * 2))
         self.tokens = self.capacity
         self.updated = asyncio.get_event_loop().time()
 
-    def allow(self, cost: int = 1) -> bool:
-        now = asyncio.get_event_loop().time()
-        elapsed = now - self.updated
+    def refill(self, now: float) -> float:
+        """Add the tokens earned since the last call; returns the tokens available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
         self.updated = now
-        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
-        if self.tokens >= cost:
+        return self.tokens
+
+    def allow(self, cost: int = 1) -> bool:
+        if self.refill(asyncio.get_event_loop().time()) >= cost:
             self.tokens -= cost
             return True
         return False
 
-limiters: Dict[WebSocketServerProtocol, RateLimiter] = {}
+# ------------------ Admission control ------------------
+# Token buckets nested peer -> source IP -> room -> global. A message goes
+# through only if every level has a token, and then takes one from each, so
+# a level that refuses does not drain the others. Checked on the raw frame,
+# before any parsing; excess is dropped without a reply (an error per
+# dropped message would double the work of a flood) and counted by level.
+# After a drop the connection is not read until the refusing bucket has a
+# token again, so a flood backs up into the sender's own TCP window instead
+# of costing a frame parse per message.
+# New connections are checked per source IP and globally in process_request,
+# before the websocket upgrade, and refused with HTTP 429.
+
+class Source:
+    """One source IP: its message and handshake buckets and open connections."""
+    __slots__ = ("msgs", "conns", "open")
+
+    def __init__(self):
+        self.msgs = RateLimiter(IP_MSGS_PER_SEC) if IP_MSGS_PER_SEC > 0 else None
+        self.conns = RateLimiter(IP_CONNS_PER_SEC) if IP_CONNS_PER_SEC > 0 else None
+        self.open = 0
+
+    def idle(self, now: float) -> bool:
+        """No connections and full buckets: forgetting it changes nothing."""
+        return not self.open and all(b is None or b.refill(now) >= b.capacity for b in (self.msgs, self.conns))
+
+PER_SOURCE = IP_MSGS_PER_SEC > 0 or IP_CONNS_PER_SEC > 0 or IP_MAX_CONNS > 0
+SOURCE_SWEEP = 30.0  # s between sweeps of idle sources
+
+sources: Dict[str, Source] = {}  # source IP -> Source (only with per-IP limits)
+global_msgs: Optional[RateLimiter] = None  # set in main() (GLOBAL_MSGS_PER_SEC)
+global_conns: Optional[RateLimiter] = None  # set in main() (GLOBAL_CONNS_PER_SEC)
+last_sweep = 0.0
+
+def source_of(ip: str) -> Optional[Source]:
+    global last_sweep
+    if not PER_SOURCE:
+        return None
+    src = sources.get(ip)
+    if src is None:
+        now = asyncio.get_event_loop().time()
+        if now - last_sweep > SOURCE_SWEEP:
+            last_sweep = now
+            for key in [k for k, v in sources.items() if v.idle(now)]:
+                del sources[key]
+        src = sources[ip] = Source()
+    return src
+
+def admit_connection(ip: str) -> Optional[str]:
+    """None if a new connection from ip may go on to the handshake, else the level that refused it."""
+    src = source_of(ip)
+    if src is not None:
+        if IP_MAX_CONNS and src.open >= IP_MAX_CONNS:
+            return "ip-open"
+        if src.conns is not None and not src.conns.allow():
+            return "ip"
+    if global_conns is not None and not global_conns.allow():
+        return "global"
+    return None
+
+def admit_message(s: "Session", now: float) -> Optional[Tuple[RateLimiter, str]]:
+    """Take a token at every level for one message from s; the bucket and level that refused it otherwise."""
+    room = s.room
+    levels = ((s if MAX_MSGS_PER_SEC > 0 else None, "peer"), (s.source.msgs if s.source else None, "ip"),
+              (room.limiter if room else None, "room"), (global_msgs, "global"))
+    for bucket, level in levels:
+        if bucket is not None and bucket.refill(now) < 1:
+            return bucket, level
+    for bucket, _ in levels:
+        if bucket is not None:
+            bucket.tokens -= 1
+    return None
+
+def remote_ip(connection) -> str:
+    address = getattr(connection, "remote_address", None)
+    return address[0] if address else ""
+
+# ------------------ Metrics ------------------
+# Plain ints and lists touched only from the event loop: no locks, one dict
+# update per message and one bisect per delivered routed message.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+RESUME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNTED_TYPES = frozenset((*ROUTED_TYPES, "leave", "peers", "ping"))  # anything else counts as "other"
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Metrics:
+    __slots__ = ("received", "latency", "rate_limited", "refused", "errors", "outbox_dropped", "resumes",
+                 "resume_gap", "redirects", "tls", "tls_rotations", "http_sessions", "http_answer")
+
+    def __init__(self):
+        self.received: Dict[str, int] = {}  # msg type -> count
+        self.latency: Dict[str, Histogram] = {t: Histogram() for t in ROUTED_TYPES}  # receive -> written to target
+        self.rate_limited: Dict[str, int] = {}  # bucket level (peer, room, ip, global) -> messages dropped
+        self.refused: Dict[str, int] = {}  # bucket level (ip, ip-open, global) -> connections refused before the upgrade
+        self.errors: Dict[str, int] = {}  # error reason sent to clients -> count
+        self.outbox_dropped = 0
+        self.resumes: Dict[str, int] = {}  # resumed / stale / invalid / expired -> count
+        self.resume_gap = Histogram(RESUME_BUCKETS)  # connection lost -> seat resumed
+        self.redirects = 0  # peers sent to the node that owns their room
+        self.tls: Dict[str, int] = {}  # full / resumed -> TLS handshakes
+        self.tls_rotations = 0
+        self.http_sessions: Dict[Tuple[str, str], int] = {}  # (whip / whep, created / no-answer / no-publisher) -> POSTs
+        self.http_answer = Histogram(RESUME_BUCKETS)  # WHIP/WHEP POST received -> answer sent back
+
+metrics = Metrics()
+
+def count_received(room: Optional["Room"], msg_type: Optional[str]):
+    msg_type = msg_type if msg_type in COUNTED_TYPES else "other"
+    metrics.received[msg_type] = metrics.received.get(msg_type, 0) + 1
+    if room:
+        room.received[msg_type] = room.received.get(msg_type, 0) + 1
+
+def observe_route(room: Optional["Room"], msg_type: str, seconds: float):
+    metrics.latency[msg_type].observe(seconds)
+    if room:
+        if room.latency is None:
+            room.latency = Histogram()
+        room.latency.observe(seconds)
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _histogram_lines(name: str, labels: str, h: Histogram) -> List[str]:
+    lines = []
+    total = 0
+    for bound, count in zip((*h.bounds, "+Inf"), h.counts):
+        total += count
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {total}')
+    tail = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{name}_sum{tail} {h.sum}")
+    lines.append(f"{name}_count{tail} {total}")
+    return lines
+
+def render_metrics() -> str:
+    """Prometheus text exposition (format 0.0.4) of this process's counters."""
+    out = []
+
+    def family(name: str, kind: str, help_text: str):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+
+    family("signaling_messages_received_total", "counter", "Messages received from clients, by type.")
+    for t, n in sorted(metrics.received.items()):
+        out.append(f'signaling_messages_received_total{{type="{t}"}} {n}')
+    family("signaling_route_latency_seconds", "histogram",
+           "Routed message latency from receipt to written on the target's socket, by type.")
+    for t, h in metrics.latency.items():
+        out.extend(_histogram_lines("signaling_route_latency_seconds", f'type="{t}",', h))
+    family("signaling_rate_limited_total", "counter", "Messages dropped by the rate limiters, by the level that refused them.")
+    for level, n in sorted(metrics.rate_limited.items()):
+        out.append(f'signaling_rate_limited_total{{level="{level}"}} {n}')
+    family("signaling_connections_refused_total", "counter",
+           "Connections refused with 429 before the websocket upgrade, by the level that refused them.")
+    for level, n in sorted(metrics.refused.items()):
+        out.append(f'signaling_connections_refused_total{{level="{level}"}} {n}')
+    family("signaling_errors_sent_total", "counter", "Error messages sent to clients, by reason.")
+    for reason, n in sorted(metrics.errors.items()):
+        out.append(f'signaling_errors_sent_total{{reason="{_label(reason)}"}} {n}')
+    family("signaling_outbox_dropped_total", "counter", "Messages dropped by full outbound queues.")
+    out.append(f"signaling_outbox_dropped_total {metrics.outbox_dropped}")
+    family("signaling_resumes_total", "counter",
+           "Reconnects with a resume token (resumed, stale, invalid) and held seats released unclaimed (expired).")
+    for result, n in sorted(metrics.resumes.items()):
+        out.append(f'signaling_resumes_total{{result="{result}"}} {n}')
+    family("signaling_resume_gap_seconds", "histogram",
+           "Blip to recovery: time from losing the connection to the seat being resumed.")
+    out.extend(_histogram_lines("signaling_resume_gap_seconds", "", metrics.resume_gap))
+    family("signaling_redirects_total", "counter", "Peers redirected to the node that owns their room.")
+    out.append(f"signaling_redirects_total {metrics.redirects}")
+    family("signaling_tls_handshakes_total", "counter", "TLS handshakes of websocket connections: full or resumed from a session ticket.")
+    for result, n in sorted(metrics.tls.items()):
+        out.append(f'signaling_tls_handshakes_total{{result="{result}"}} {n}')
+    family("signaling_tls_ticket_rotations_total", "counter", "Session-ticket key rotations (TLS_TICKET_ROTATE).")
+    out.append(f"signaling_tls_ticket_rotations_total {metrics.tls_rotations}")
+    family("signaling_http_sessions_total", "counter", "WHIP/WHEP session POSTs, by protocol and result.")
+    for (kind, result), n in sorted(metrics.http_sessions.items()):
+        out.append(f'signaling_http_sessions_total{{protocol="{kind}",result="{result}"}} {n}')
+    family("signaling_http_answer_seconds", "histogram", "WHIP/WHEP setup: POST received to SDP answer returned.")
+    out.extend(_histogram_lines("signaling_http_answer_seconds", "", metrics.http_answer))
+    family("signaling_http_open_sessions", "gauge", "Open WHIP/WHEP sessions.")
+    out.append(f"signaling_http_open_sessions {len(http_sessions)}")
+    family("signaling_ring_nodes", "gauge", "Signaling nodes on the room hash ring (0 = not sharded).")
+    out.append(f"signaling_ring_nodes {len(ring.nodes)}")
+
+    hb = wheel.stats()
+    for key, help_text in (("pings", "Heartbeat pings sent."), ("pongs", "Heartbeat pongs received."),
+                           ("timeouts", "Connections closed for a missing pong."),
+                           ("skipped", "Pings skipped because the peer was active.")):
+        family(f"signaling_heartbeat_{key}_total", "counter", help_text)
+        out.append(f"signaling_heartbeat_{key}_total {hb[key]}")
+    family("signaling_sessions", "gauge", "Open websocket sessions.")
+    out.append(f"signaling_sessions {open_sessions}")
+    family("signaling_parked_sessions", "gauge", "Seats held for a resume after their connection dropped.")
+    out.append(f"signaling_parked_sessions {sum(1 for s in local_sessions() if s.parked)}")
+    family("signaling_rooms", "gauge", "Rooms with at least one peer.")
+    out.append(f"signaling_rooms {len(rooms)}")
+
+    family("signaling_room_peers", "gauge", "Peers in the room, local and on other workers.")
+    for room in rooms.values():
+        out.append(f'signaling_room_peers{{room="{_label(room.name)}"}} {room.size()}')
+    family("signaling_room_messages_received_total", "counter", "Messages received from the room's peers, by type.")
+    for room in rooms.values():
+        for t, n in room.received.items():
+            out.append(f'signaling_room_messages_received_total{{room="{_label(room.name)}",type="{t}"}} {n}')
+    family("signaling_room_rate_limited_total", "counter", "Rate-limited messages from the room's peers.")
+    for room in rooms.values():
+        out.append(f'signaling_room_rate_limited_total{{room="{_label(room.name)}"}} {room.rate_limited}')
+    family("signaling_room_route_latency_seconds", "histogram", "Routed message latency to the room's peers.")
+    for room in rooms.values():
+        if room.latency:
+            out.extend(_histogram_lines("signaling_room_route_latency_seconds", f'room="{_label(room.name)}",', room.latency))
+    out.append("")
+    return "\n".join(out)
+
+# ------------------ Sessions ------------------
+# Negotiation messages are never dropped by the drop-oldest policy
+PROTECTED_TYPES = ROUTED_TYPES
+
+class Session(RateLimiter):
+    """Everything the server keeps for one connection, in one slotted record.
+
+    The session is its own rate limiter, holds its room and peer id, the
+    bounded send queue and the heartbeat wheel's bookkeeping. Rooms index
+    sessions by peer id; nothing else is keyed by connection.
+
+    Senders only enqueue; a writer task (started on demand, exits when the
+    queue is empty) does the awaiting, so a peer with a stalled TCP window
+    cannot hold up room fan-out or anyone's read loop. The queue only exists
+    while something is waiting to go out.
+
+    With RESUME_GRACE a session whose connection drops is parked: it keeps
+    its seat in the room and queues what is sent to it until the peer comes
+    back with its resume token (or the grace period runs out).
+    """
+    __slots__ = ("ws", "room", "peer_id", "role", "stream", "binary", "source",
+                 # outbound queue
+                 "queue", "writer", "closing", "sent", "dropped", "max_depth",
+                 # resume (see park)
+                 "parked", "parked_at",
+                 # heartbeat (see HeartbeatWheel)
+                 "deadline", "slot", "awaiting", "waiter", "ping_sent", "last_seen",
+                 # counters
+                 "received")
+
+    def __init__(self, ws: WebSocketServerProtocol):
+        super().__init__(MAX_MSGS_PER_SEC)
+        self.ws = ws
+        self.room: Optional[Room] = None
+        self.peer_id: Optional[str] = None
+        self.role = ""  # "publisher", "viewer" or "" (sees and is seen by everyone)
+        self.stream = ""  # stream id a publisher sends / a viewer watches ("" = none named)
+        self.binary = getattr(ws, "subprotocol", None) == SUBPROTOCOL  # peer negotiated the binary subprotocol
+        self.source: Optional[Source] = None  # source IP's buckets (per-IP limits only)
+        self.queue: Optional[Deque[Tuple[Optional[str], Union[str, bytes], float]]] = None  # (msg type, text or binary frame, received at)
+        self.writer: Optional[asyncio.Task] = None
+        self.closing: Optional[Tuple[int, str]] = None
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.parked: Optional[asyncio.TimerHandle] = None  # grace timer while the connection is gone
+        self.parked_at = 0.0
+        self.deadline = 0.0
+        self.slot = -1  # wheel slot, -1 when not scheduled
+        self.awaiting = False  # ping sent, pong not checked yet
+        self.waiter = None  # pong future returned by ws.ping()
+        self.ping_sent = 0.0
+        self.last_seen = 0.0
+        self.received = 0
+
+    def put(self, msg_type: Optional[str], data: Union[str, bytes], received: float = 0.0):
+        """Queue data; received (loop time) marks a routed message for the latency histograms."""
+        if self.closing:
+            return
+        queue = self.queue
+        if queue is None:
+            queue = self.queue = deque()
+        elif len(queue) >= OUTBOX_SIZE and not self._make_room(msg_type):
+            return
+        queue.append((msg_type, data, received))
+        if len(queue) > self.max_depth:
+            self.max_depth = len(queue)
+        if self.parked is None:
+            self._kick()
+
+    def _make_room(self, msg_type: Optional[str]) -> bool:
+        if OUTBOX_POLICY == "drop-oldest":
+            for i, (t, _, _) in enumerate(self.queue):
+                if t not in PROTECTED_TYPES:
+                    del self.queue[i]
+                    self.dropped += 1
+                    metrics.outbox_dropped += 1
+                    return True
+            if msg_type not in PROTECTED_TYPES:
+                self.dropped += 1  # queue is all negotiation traffic: drop the new message
+                metrics.outbox_dropped += 1
+                return False
+        log.warning(f"slow consumer {self.peer_id}: outbox full ({len(self.queue)}), closing")
+        self.queue.clear()
+        if self.writer:
+            self.writer.cancel()
+            self.writer = None
+        self.close(OUTBOX_CLOSE_CODE, "slow-consumer")
+        return False
+
+    def close(self, code: int, reason: str) -> asyncio.Task:
+        """Send what is queued, then close. Await the result to wait for it."""
+        if not self.closing:
+            self.closing = (code, reason)
+        return self._kick()
+
+    def _kick(self) -> asyncio.Task:
+        if self.writer is None:
+            self.writer = asyncio.create_task(self._write())
+        return self.writer
+
+    async def _write(self):
+        queue = self.queue
+        try:
+            while queue:
+                msg_type, data, received = queue[0]
+                await self.ws.send(data)
+                queue.popleft()
+                self.sent += 1
+                if received:
+                    observe_route(self.room, msg_type, asyncio.get_running_loop().time() - received)
+            if self.closing:
+                await self.ws.close(code=self.closing[0], reason=self.closing[1])
+        except Exception as e:
+            log.debug(f"send failed: {e}")
+            if queue:
+                queue.clear()
+        finally:
+            if self.writer is asyncio.current_task():
+                self.writer = None
+                if not self.queue:
+                    self.queue = None
+
+    def stop(self):
+        self.queue = None
+        if self.writer:
+            self.writer.cancel()
+
+    def stats(self) -> dict:
+        return {"depth": len(self.queue) if self.queue else 0, "max_depth": self.max_depth, "sent": self.sent,
+                "dropped": self.dropped, "received": self.received, "bytes": session_bytes(self)}
+
+def session_bytes(s: Session) -> int:
+    """Memory owned by one session record (the websocket connection itself excluded)."""
+    size = sys.getsizeof(s) + sum(sys.getsizeof(v) for v in (s.tokens, s.updated, s.parked_at, s.deadline, s.ping_sent, s.last_seen)
+                                  if type(v) is float)
+    if s.peer_id:
+        size += sys.getsizeof(s.peer_id)  # role strings are interned constants
+    if s.queue is not None:
+        size += sys.getsizeof(s.queue)  # queued payloads are shared with the other recipients
+    return size
+
+def local_sessions() -> List[Session]:
+    return [s for room in rooms.values() for s in room.peers.values()]
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+base_rss = 0  # RSS before the first connection, set in main()
+
+def session_report(peers: int = 0) -> dict:
+    """Memory per session for /admin/sessions.
+
+    record: the session object and what it owns; index: room dicts and wheel
+    slots divided over the sessions; rss: process growth since startup per
+    open connection, which also covers the websocket and transport objects.
+    """
+    sessions = local_sessions()
+    idle = [s for s in sessions if s.queue is None]
+    index = sys.getsizeof(rooms) + sum(sys.getsizeof(slot) for slot in wheel.slots)
+    for room in rooms.values():
+        index += sys.getsizeof(room) + sys.getsizeof(room.name) + sys.getsizeof(room.peers) + sys.getsizeof(room.remote)
+    rss = rss_bytes()
+    report = {
+        "sessions": len(sessions),
+        "connections": open_sessions,
+        "idle": len(idle),
+        "parked": sum(1 for s in sessions if s.parked),
+        "rooms": len(rooms),
+        "bytes_per_idle_session": {
+            "record": round(sum(map(session_bytes, idle)) / len(idle)) if idle else 0,
+            "index": round(index / len(sessions)) if sessions else 0,
+            "rss": round((rss - base_rss) / open_sessions) if open_sessions else 0,
+        },
+        "rss_bytes": rss,  # this worker only
+        "workers": WORKERS,
+        "queued": sum(len(s.queue) for s in sessions if s.queue),
+        "dropped": sum(s.dropped for s in sessions),
+        "heartbeat": wheel.stats(),
+    }
+    if peers:
+        # the busiest queues first
+        top = sorted(sessions, key=lambda s: s.max_depth, reverse=True)[:peers]
+        report["peers"] = {f"{s.room.name}/{s.peer_id}": s.stats() for s in top}
+    return report
+
+# ------------------ Worker bus (multi-process mode) ------------------
+class WorkerBus:
+    """Unix-socket mesh between the worker processes sharing PORT.
+
+    Every worker listens on BUS_DIR/worker-<id>.sock and keeps one outbound
+    link to each other worker. Each frame is two 4-byte big-endian lengths,
+    a JSON header with an "op" field (sync, join, leave, route) and an
+    optional binary payload (a routed message in signaling_protocol format).
+    """
+
+    def __init__(self, worker_id: int, workers: int, bus_dir: str):
+        self.worker_id = worker_id
+        self.workers = workers
+        self.bus_dir = bus_dir
+        self.links: Dict[int, asyncio.StreamWriter] = {}  # worker id -> outbound link
+        self.inbound: Set[asyncio.StreamWriter] = set()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.closed = False
+
+    def path_of(self, worker_id: int) -> str:
+        return os.path.join(self.bus_dir, f"worker-{worker_id}.sock")
+
+    async def start(self):
+        os.makedirs(self.bus_dir, exist_ok=True)
+        path = self.path_of(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self._serve_link, path=path)
+        for wid in range(self.workers):
+            if wid != self.worker_id:
+                asyncio.create_task(self._connect(wid))
+
+    async def _connect(self, wid: int):
+        while not self.closed:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path_of(wid))
+                break
+            except OSError:
+                await asyncio.sleep(0.2)
+        else:
+            return
+        self.links[wid] = writer
+        # Tell the other worker which peers live here
+        self._write(writer, {"op": "sync", "w": self.worker_id, "members": local_members()})
+        log.info(f"bus: worker {self.worker_id} linked to worker {wid}")
+
+    async def _serve_link(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        src = None
+        self.inbound.add(writer)
+        try:
+            while True:
+                sizes = await reader.readexactly(8)
+                msg = json.loads(await reader.readexactly(int.from_bytes(sizes[:4], "big")))
+                payload = await reader.readexactly(int.from_bytes(sizes[4:], "big"))
+                if msg.get("op") == "sync":
+                    src = msg["w"]
+                try:
+                    on_bus_message(msg, payload)
+                except Exception as e:
+                    # one bad message must not take the link (and every peer behind it) down
+                    log.exception(f"bus: dropped {msg.get('op')} message: {e}")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            log.exception(f"bus link error: {e}")
+        finally:
+            self.inbound.discard(writer)
+            writer.close()
+            if src is not None and not self.closed:
+                # Worker went away: forget its peers and relink once it is back
+                log.warning(f"bus: lost worker {src}")
+                self.links.pop(src, None)
+                purge_worker(src)
+                asyncio.create_task(self._connect(src))
+
+    @staticmethod
+    def _write(writer: asyncio.StreamWriter, msg: dict, payload: bytes = b""):
+        data = json.dumps(msg).encode()
+        writer.writelines((len(data).to_bytes(4, "big"), len(payload).to_bytes(4, "big"), data, payload))
+
+    def send(self, wid: int, msg: dict, payload: bytes = b"") -> bool:
+        writer = self.links.get(wid)
+        if writer is None or writer.is_closing():
+            return False
+        self._write(writer, msg, payload)
+        return True
+
+    def publish(self, msg: dict):
+        for wid in list(self.links):
+            self.send(wid, msg)
+
+    def close(self):
+        """Worker shutting down: close every link and stop relinking."""
+        self.closed = True
+        if self.server:
+            self.server.close()
+        for writer in (*self.links.values(), *self.inbound):
+            writer.close()
+        self.links.clear()
+
+bus: Optional[WorkerBus] = None
+
+# ------------------ Heartbeat (shared timer wheel) ------------------
+class HeartbeatWheel:
+    """Hashed timer wheel that pings every connection from a single task.
+
+    Sessions sit in the slot of their next deadline. Each tick the wheel
+    empties the due slot: idle connections get a ping, connections with an
+    overdue pong are closed, and connections that sent us something during
+    the last interval are rescheduled without a ping.
+    """
+
+    def __init__(self, interval: float, timeout: float, tick: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self.nslots = int(max(interval, timeout) / tick) + 3
+        self.slots: List[Set[Session]] = [set() for _ in range(self.nslots)]
+        self.count = 0  # scheduled sessions
+        self.cursor = 0  # next tick number to process
+        self.task: Optional[asyncio.Task] = None
+        # liveness stats
+        self.pings = 0
+        self.pongs = 0
+        self.timeouts = 0
+        self.skipped = 0  # pings saved because the peer was active
+        self.ticks = 0
+        self.max_lag = 0.0
+
+    def add(self, s: Session):
+        now = asyncio.get_running_loop().time()
+        if self.task is None:
+            self.cursor = int(now / self.tick) + 1
+            self.task = asyncio.create_task(self._run())
+        if s.slot < 0:
+            self.count += 1
+        else:
+            self.slots[s.slot].discard(s)
+        s.awaiting = False
+        s.last_seen = now
+        self._schedule(s, now + self.interval)
+
+    def remove(self, s: Session):
+        if s.slot >= 0:
+            self.slots[s.slot].discard(s)
+            s.slot = -1
+            self.count -= 1
+
+    @staticmethod
+    def touch(s: Session):
+        s.last_seen = asyncio.get_running_loop().time()
+
+    def _schedule(self, s: Session, deadline: float):
+        tick_no = max(self.cursor, -int(-deadline // self.tick))  # ceil, never in the past
+        s.deadline = deadline
+        s.slot = tick_no % self.nslots
+        self.slots[s.slot].add(s)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.count:
+                await asyncio.sleep(max(0.0, self.cursor * self.tick - loop.time()))
+                now = loop.time()
+                self.max_lag = max(self.max_lag, now - self.cursor * self.tick)
+                while self.cursor * self.tick <= now:
+                    slot = self.slots[self.cursor % self.nslots]
+                    self.cursor += 1
+                    self.ticks += 1
+                    if slot:
+                        due = list(slot)
+                        slot.clear()
+                        for s in due:
+                            self._expire(s, now)
+        finally:
+            self.task = None
+
+    def _expire(self, s: Session, now: float):
+        if s.awaiting:
+            if s.waiter is not None and s.waiter.done():
+                s.awaiting = False
+                s.waiter = None
+                self.pongs += 1
+                self._schedule(s, s.ping_sent + self.interval)
+            else:
+                self.timeouts += 1
+                s.slot = -1
+                self.count -= 1
+                log.warning(f"Ping timeout: {s.peer_id}")
+                asyncio.create_task(s.ws.close(code=1011, reason="ping-timeout"))
+        elif now - s.last_seen < self.interval:
+            self.skipped += 1
+            self._schedule(s, s.last_seen + self.interval)
+        else:
+            s.awaiting = True
+            s.waiter = None
+            s.ping_sent = now
+            self.pings += 1
+            # short-lived: finishes as soon as the ping frame is written
+            asyncio.create_task(self._ping(s))
+            self._schedule(s, now + self.timeout)
+
+    @staticmethod
+    async def _ping(s: Session):
+        try:
+            s.waiter = await s.ws.ping()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {"connections": self.count, "pings": self.pings, "pongs": self.pongs,
+                "timeouts": self.timeouts, "skipped": self.skipped, "ticks": self.ticks,
+                "max_lag_ms": round(self.max_lag * 1000, 1)}
+
+wheel = HeartbeatWheel(PING_INTERVAL, PING_TIMEOUT, WHEEL_TICK)
+
+def local_members() -> List[Tuple[str, str, str, bool, bool, str]]:
+    return [(room.name, pid, s.role, False, pid in room.quiet, s.stream)
+            for room in rooms.values() for pid, s in room.peers.items()]
+
+def on_bus_message(msg: dict, payload: bytes = b""):
+    op = msg.get("op")
+    if op == "sync":
+        for member in msg.get("members", []):
+            remote_join(msg["w"], *member)
+    elif op == "join":
+        remote_join(msg["w"], msg["room"], msg["peer"], msg.get("role", ""), msg.get("resume", False),
+                    msg.get("quiet", False), msg.get("stream", ""))
+    elif op == "leave":
+        remote_leave(msg["w"], msg["room"], msg["peer"])
+    elif op == "route":
+        room = rooms.get(msg["room"])
+        target = room.peers.get(msg["to"]) if room else None
+        if target:
+            if msg["type"] == "answer" and room.bootstrap:
+                room.bootstrap.pop(target.peer_id, None)
+            deliver(target, msg["type"], frame=payload, received=msg.get("t", 0.0))
+    else:
+        log.debug(f"bus: unknown op {op}")
+
+def remote_join(wid: int, room_name: str, peer_id: str, role: str = "", resume: bool = False, quiet: bool = False,
+                stream: str = ""):
+    room = rooms.get(room_name)
+    if room is None:
+        room = rooms[room_name] = Room(room_name)
+    if room.remote.get(peer_id) == wid:
+        return
+    # Same peer_id reconnected on another worker: drop the local session
+    old = room.peers.pop(peer_id, None)
+    if old:
+        old.room = None
+        if old.parked:
+            unpark(old)
+        elif resume:
+            old.close(4002, "resumed")
+        else:
+            send_json(old, {"type": "error", "reason": "replaced-by-new-connection"})
+            old.close(4001, "duplicate-peer")
+    room.remote[peer_id] = wid
+    room.add_member(peer_id, role, stream, quiet)
+    if resume or quiet:
+        return  # the room already knows this peer (or it announces itself): no presence, no bootstrap
+    queue_presence(room, "joined", peer_id, role, stream)
+    serve_bootstrap(room, peer_id, role, stream)
+
+def remote_leave(wid: int, room_name: str, peer_id: str):
+    room = rooms.get(room_name)
+    if not room or room.remote.get(peer_id) != wid:
+        return
+    del room.remote[peer_id]
+    queue_presence(room, "left", peer_id, *room.remove_member(peer_id))
+    if not room.size():
+        drop_room(room)
+
+def purge_worker(wid: int):
+    for room in list(rooms.values()):
+        for peer_id in [p for p, w in room.remote.items() if w == wid]:
+            remote_leave(wid, room.name, peer_id)
 
 # ------------------ Utils ------------------
-async def send_json(ws: WebSocketServerProtocol, obj: dict):
+def send_json(s: Session, obj: dict):
+    """Queue obj for s; never blocks on the network."""
+    msg_type = obj.get("type")
+    if msg_type == "error":
+        reason = obj.get("reason", "")
+        metrics.errors[reason] = metrics.errors.get(reason, 0) + 1
+    s.put(msg_type, json.dumps(obj))
+
+def deliver(s: Session, msg_type: str, frame: Optional[bytes] = None, out: Optional[dict] = None, received: float = 0.0):
+    """Queue a routed message for s in the encoding it negotiated.
+
+    The message comes either as a binary frame (sender already filled in) or
+    as the JSON dict; it is only converted when the two ends differ.
+    """
+    if s.binary:
+        s.put(msg_type, frame if frame is not None else frame_from_json(out), received)
+    else:
+        s.put(msg_type, json.dumps(out if out is not None else frame_to_json(frame)), received)
+
+def route(s: Session, target: str, msg_type: str, frame: Optional[bytes] = None, out: Optional[dict] = None):
+    room = s.room
+    if BOOTSTRAP_TTL > 0 and cache_bootstrap(s, target, msg_type, frame, out):
+        return
+    target_session = room.peers.get(target)
+    if target_session:
+        deliver(target_session, msg_type, frame, out, s.last_seen)
+        return
+    target_worker = room.remote.get(target) if bus else None
+    if target_worker is None or not bus.send(
+            target_worker, {"op": "route", "room": room.name, "to": target, "type": msg_type, "t": s.last_seen},
+            frame if frame is not None else frame_from_json(out)):
+        send_json(s, {"type": "error", "reason": "target-offline"})
+
+def route_frame(s: Session, frame: bytes):
+    """Binary subprotocol: route on the header, forward the body untouched."""
     try:
-        await ws.send(json.dumps(obj))
-    except Exception as e:
-        log.debug(f"send failed: {e}")
+        msg_type, _, target, body_at = decode_header(frame)
+        check_body(frame, body_at)  # a JSON peer (maybe on another worker) must be able to decode it
+    except ValueError:
+        count_received(s.room, None)
+        send_json(s, {"type": "error", "reason": "bad-frame"})
+        return
+    count_received(s.room, msg_type)
+    if not s.room:
+        send_json(s, {"type": "error", "reason": "not-in-room"})
+        return
+    if not target or target == s.peer_id:
+        send_json(s, {"type": "error", "reason": "invalid-target"})
+        return
+    route(s, target, msg_type, frame=with_sender(frame, s.peer_id))
 
 def parse_query(path: str):
     u = urlparse(path)
@@ -68,7 +892,14 @@ def parse_query(path: str):
     room = (q.get("room", [None])[0] or "").strip()
     peer = (q.get("peer", [None])[0] or "").strip()
     token = (q.get("token", [None])[0] or "").strip()
-    return room, peer, token
+    role = (q.get("role", [None])[0] or "").strip()
+    stream = (q.get("stream", [None])[0] or "").strip()
+    resume = (q.get("resume", [None])[0] or "").strip()
+    try:
+        gap = min(max(float(q.get("gap", ["0"])[0]), 0.0), 3600.0)  # client-reported time offline (s)
+    except ValueError:
+        gap = 0.0
+    return room, peer, token, role, stream, resume, gap
 
 def origin_allowed(ws: WebSocketServerProtocol) -> bool:
     if not ALLOWED_ORIGINS:
@@ -76,150 +907,462 @@ def origin_allowed(ws: WebSocketServerProtocol) -> bool:
     origin = ws.request_headers.get("Origin")
     return origin in ALLOWED_ORIGINS
 
-async def join_room(ws: WebSocketServerProtocol, room_name: str, peer_id: str):
+def send_to(room: Room, peer_id: str, msg_type: str, obj: dict):
+    """Deliver a routed message (JSON form, "from" set) to peer_id, local or on another worker."""
+    target = room.peers.get(peer_id)
+    if target:
+        deliver(target, msg_type, out=obj)
+    elif bus and peer_id in room.remote:
+        bus.send(room.remote[peer_id], {"op": "route", "room": room.name, "to": peer_id, "type": msg_type},
+                 frame_from_json({**obj, "to": peer_id}))
+
+# ------------------ Bootstrap cache ------------------
+BOOTSTRAP_ANY = "*"  # offer target meaning "whichever viewer joins next"
+BOOTSTRAP_MAX_CANDIDATES = 32
+
+class Bootstrap:
+    """A publisher's latest offer that nobody has answered yet, plus its candidates.
+
+    A viewer that joins while the offer's target is gone (or is the target
+    reconnecting) gets it right away instead of waiting for peer-joined to
+    reach the publisher and a new createOffer to come back.
+    """
+    __slots__ = ("target", "offer", "candidates", "expires")
+
+    def __init__(self, target: str, offer: dict, expires: float):
+        self.target = target
+        self.offer = offer
+        self.candidates: List[dict] = []
+        self.expires = expires
+
+def cache_bootstrap(s: Session, target: str, msg_type: str, frame: Optional[bytes], out: Optional[dict]) -> bool:
+    """Track offers/answers passing through; True if the message was for the cache only."""
+    room = s.room
+    if msg_type == "answer":
+        if room.bootstrap:
+            room.bootstrap.pop(target, None)  # offer taken
+        return False
+    if s.role != "publisher":
+        return False
+    if msg_type == "offer":
+        if room.bootstrap is None:
+            room.bootstrap = {}
+        room.bootstrap[s.peer_id] = Bootstrap(target, out if out is not None else frame_to_json(frame),
+                                              asyncio.get_running_loop().time() + BOOTSTRAP_TTL)
+    elif msg_type == "candidate":
+        entry = room.bootstrap.get(s.peer_id) if room.bootstrap else None
+        if entry and target in (entry.target, BOOTSTRAP_ANY):
+            if len(entry.candidates) < BOOTSTRAP_MAX_CANDIDATES:
+                entry.candidates.append(out if out is not None else frame_to_json(frame))
+            if target == BOOTSTRAP_ANY and entry.target != BOOTSTRAP_ANY:
+                # the offer was already handed to a viewer: its candidates follow it
+                send_to(room, entry.target, msg_type, entry.candidates[-1])
+    elif room.bootstrap:
+        room.bootstrap.pop(s.peer_id, None)  # renegotiate / ice-restart: the cached offer is stale
+    return target == BOOTSTRAP_ANY
+
+def serve_bootstrap(room: Room, peer_id: str, role: str, stream: str = ""):
+    """Hand a joining viewer any cached offer it can take (from a publisher it sees)."""
+    if not room.bootstrap or role == "publisher":
+        return
+    now = asyncio.get_running_loop().time()
+    for pub, entry in list(room.bootstrap.items()):
+        if entry.expires < now or pub not in room.peers:
+            del room.bootstrap[pub]
+            continue
+        if not sees(role, "publisher", stream, room.streams.get(pub, "")):
+            continue
+        if entry.target != peer_id and (entry.target in room.peers or entry.target in room.remote):
+            continue  # its viewer is still around and may answer
+        entry.target = peer_id
+        send_to(room, peer_id, "offer", entry.offer)
+        for cand in entry.candidates:
+            send_to(room, peer_id, "candidate", cand)
+        log.info(f"bootstrap: sent cached offer from {pub} to {peer_id}")
+        break  # one peer connection, one offer
+
+# ------------------ Resume ------------------
+# A dropped connection's seat is held for RESUME_GRACE s. The peer gets a
+# token with every "peers" reply and reconnects with ?resume=<token>; the
+# token is an HMAC over room and peer id, so any worker can check it.
+
+def resume_token(room_name: str, peer_id: str) -> str:
+    nonce = secrets.token_urlsafe(6)
+    return f"{nonce}.{_resume_mac(room_name, peer_id, nonce)}"
+
+def _resume_mac(room_name: str, peer_id: str, nonce: str) -> str:
+    return hmac.new(RESUME_SECRET, f"{room_name}\n{peer_id}\n{nonce}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def check_resume(token: str, room_name: str, peer_id: str) -> bool:
+    nonce, _, mac = token.partition(".")
+    return bool(mac) and hmac.compare_digest(mac, _resume_mac(room_name, peer_id, nonce))
+
+def park(s: Session):
+    """Hold s's seat after its connection dropped; what is sent to it stays queued."""
+    if s.writer:
+        s.writer.cancel()  # the head of the queue is sent again on resume
+        s.writer = None
+    loop = asyncio.get_running_loop()
+    s.parked_at = loop.time()
+    s.parked = loop.call_later(RESUME_GRACE, expire_parked, s)
+    log.info(f"{s.peer_id} dropped, holding seat in '{s.room.name}' for {RESUME_GRACE}s")
+
+def unpark(s: Session):
+    s.parked.cancel()
+    s.parked = None
+    s.queue = None
+
+def expire_parked(s: Session):
+    s.parked = None
+    metrics.resumes["expired"] = metrics.resumes.get("expired", 0) + 1
+    s.stop()
+    asyncio.ensure_future(leave_room(s))
+
+def take_over(s: Session, old: Session, gap: float):
+    """s resumes old's seat: old's queued messages move to s."""
+    loop = asyncio.get_running_loop()
+    queue = old.queue
+    old.queue = None
+    old.room = None
+    if old.parked:
+        held = loop.time() - old.parked_at
+        old.parked.cancel()
+        old.parked = None
+    else:
+        # the old connection has not been noticed dead yet: close it quietly
+        held = 0.0
+        if old.writer:
+            old.writer.cancel()
+            old.writer = None
+        old.close(4002, "resumed")
+    metrics.resumes["resumed"] = metrics.resumes.get("resumed", 0) + 1
+    # the client knows when its connection went; fall back to how long the seat was held
+    metrics.resume_gap.observe(gap if gap > 0 else held)
+    if queue:
+        for msg_type, data, received in queue:
+            s.put(msg_type, data, received)
+        log.info(f"{s.peer_id} resumed, replaying {len(queue)} queued messages")
+
+async def disconnect(s: Session):
+    """Connection gone: park the seat when a resume is possible, else leave."""
+    room = s.room
+    if RESUME_GRACE > 0 and room and room.peers.get(s.peer_id) is s and not s.closing:
+        park(s)
+    else:
+        await leave_room(s)
+
+# ------------------ Presence ------------------
+# role -> roles whose joins/leaves it is told about. Any other role (or none)
+# sees everyone and is seen by everyone, like before roles existed.
+PRESENCE_SCOPES = {"publisher": ("viewer",), "viewer": ("publisher",)}
+# Within those scopes peers also have to name the same stream (?stream=), so a
+# room can hold a fleet of publishers and their viewers. A viewer that names
+# no stream browses every publisher; a publisher without one sees the viewers
+# without one (a single-publisher room, as before streams existed).
+STREAM_BROWSERS = ("viewer",)
+
+def sees(observer: str, subject: str, observer_stream: str = "", subject_stream: str = "") -> bool:
+    scope = PRESENCE_SCOPES.get(observer)
+    if scope is None or subject not in PRESENCE_SCOPES:
+        return True
+    return subject in scope and (observer_stream == subject_stream or
+                                 (not observer_stream and observer in STREAM_BROWSERS))
+
+def visible_peers(room: Room, role: str, me: str, stream: str = "") -> List[str]:
+    streams = room.streams
+    return [p for r, group in room.members.items() if sees(role, r)
+            for p in group if p != me and p not in room.quiet and sees(role, r, stream, streams.get(p, ""))]
+
+def peers_message(room: Room, s: Session, me: str) -> dict:
+    """The "peers" reply: who s can see, plus the stream ids of those that named one."""
+    peers = visible_peers(room, s.role, me, s.stream)
+    msg = {"type": "peers", "room": room.name, "you": me, "peers": peers}
+    streams = {p: room.streams[p] for p in peers if p in room.streams}
+    if streams:
+        msg["streams"] = streams
+    return msg
+
+def queue_presence(room: Room, kind: str, peer_id: str, role: str, stream: str = ""):
+    """Record a join ("joined") or leave ("left"); members hear about it when the room flushes."""
+    if draining or room.name in moving:
+        return  # rooms are moving to another server, nobody really left
+    if kind == "left":
+        for i in range(len(room.events) - 1, -1, -1):
+            k, p = room.events[i][:2]
+            if p == peer_id:
+                if k == "joined":
+                    del room.events[i]  # came and went within one window: nobody needs to know
+                    return
+                break
+    room.events.append((kind, peer_id, role, stream))
+    if PRESENCE_WINDOW <= 0:
+        flush_presence(room)
+    elif room.flush is None:
+        room.flush = asyncio.get_running_loop().call_later(PRESENCE_WINDOW, flush_presence, room)
+
+def presence_message(events: List[Tuple[str, str, str, str]], role: str, me: Optional[str] = None,
+                     stream: str = "") -> Optional[str]:
+    left = [p for k, p, r, st in events if k == "left" and p != me and sees(role, r, stream, st)]
+    joined = [(p, st) for k, p, r, st in events if k == "joined" and p != me and sees(role, r, stream, st)]
+    if len(left) + len(joined) == 1:
+        # a lone change keeps the classic message
+        if left:
+            return json.dumps({"type": "peer-left", "peer": left[0]})
+        msg = {"type": "peer-joined", "peer": joined[0][0]}
+        if joined[0][1]:
+            msg["stream"] = joined[0][1]
+        return json.dumps(msg)
+    if left or joined:
+        # apply "left" before "joined": a peer in both reconnected within the window
+        msg = {"type": "presence", "left": left, "joined": [p for p, _ in joined]}
+        streams = {p: st for p, st in joined if st}
+        if streams:
+            msg["streams"] = streams
+        return json.dumps(msg)
+    return None
+
+def flush_presence(room: Room):
+    """Send every local member the changes in its scope, serialized once per (role, stream)."""
+    events, room.events, room.flush = room.events, [], None
+    if not events:
+        return
+    # members that joined during the window already got the peer list as of their join
+    since = {e[1]: i + 1 for i, e in enumerate(events) if e[0] == "joined"}
+    views: Dict[Tuple[str, str], Optional[str]] = {}
+    for s in list(room.peers.values()):
+        start = since.get(s.peer_id)
+        if start is not None:
+            text = presence_message(events[start:], s.role, s.peer_id, s.stream)
+        else:
+            view = (s.role, s.stream)
+            if view not in views:
+                views[view] = presence_message(events, s.role, None, s.stream)
+            text = views[view]
+        if text:
+            s.put("presence", text)
+
+def drop_room(room: Room):
+    moving.discard(room.name)
+    if room.flush:
+        room.flush.cancel()
+    if rooms.get(room.name) is room:
+        del rooms[room.name]
+
+async def join_room(s: Session, room_name: str, peer_id: str, resume: str = "", gap: float = 0.0,
+                    announce: bool = True):
+    """Seat s in the room as peer_id; announce=False skips presence and bootstrap (a WHEP viewer introduces itself with its offer)."""
     room = rooms.get(room_name)
     if room is None:
         room = rooms[room_name] = Room(room_name)
-    if len(room.peers) >= ROOM_CAP and peer_id not in room.peers:
-        await send_json(ws, {"type": "error", "reason": "room-full"})
-        await ws.close(code=4000, reason="room-full")
+    if room.size() >= ROOM_CAP and peer_id not in room.peers and peer_id not in room.remote:
+        send_json(s, {"type": "error", "reason": "room-full"})
+        await s.close(4000, "room-full")
         return False
 
+    # A valid resume token takes the seat over without telling the room
+    resumed = False
+    if resume and RESUME_GRACE > 0:
+        if not check_resume(resume, room_name, peer_id):
+            result = "invalid"
+        elif peer_id in room.peers or peer_id in room.remote:
+            result, resumed = "resumed", True
+        else:
+            result = "stale"  # grace period over: join as a new peer
+        if not resumed:
+            metrics.resumes[result] = metrics.resumes.get(result, 0) + 1
+
     # Replace old session if same peer_id exists
     old = room.peers.get(peer_id)
-    if old and old is not ws:
-        try:
-            await send_json(old, {"type": "error", "reason": "replaced-by-new-connection"})
-            await old.close(code=4001, reason="duplicate-peer")
-        except:
-            pass
+    if old and old is not s and not resumed:
+        if old.parked:
+            unpark(old)
+            old.room = None
+        else:
+            send_json(old, {"type": "error", "reason": "replaced-by-new-connection"})
+            old.close(4001, "duplicate-peer")
 
-    room.peers[peer_id] = ws
-    peer_room[ws] = room_name
-    peer_id_of[ws] = peer_id
+    room.peers[peer_id] = s
+    if resumed and peer_id in room.remote:
+        del room.remote[peer_id]
+        metrics.resumes["resumed"] = metrics.resumes.get("resumed", 0) + 1
+        metrics.resume_gap.observe(gap)  # seat was held by another worker, which drops its queue
+    room.remote.pop(peer_id, None)
+    room.add_member(peer_id, s.role, s.stream, quiet=not announce)
+    s.room = room
+    s.peer_id = peer_id
+    if bus:
+        bus.publish({"op": "join", "w": bus.worker_id, "room": room_name, "peer": peer_id, "role": s.role,
+                     "resume": resumed, "quiet": not announce, "stream": s.stream})
 
-    # Notify this peer about existing peers
-    other_peers = [p for p in room.peers.keys() if p != peer_id]
-    await send_json(ws, {"type": "peers", "room": room_name, "you": peer_id, "peers": other_peers})
+    # Notify this peer about existing peers (the ones its role and stream care about)
+    peers_msg = peers_message(room, s, peer_id)
+    if BOOTSTRAP_TTL > 0 and s.role == "publisher":
+        peers_msg["bootstrap"] = True  # may offer to BOOTSTRAP_ANY before any viewer shows up
+    if RESUME_GRACE > 0:
+        peers_msg["resume"] = resume_token(room_name, peer_id)
+        peers_msg["resume_grace"] = RESUME_GRACE
+    if resumed:
+        peers_msg["resumed"] = True
+    send_json(s, peers_msg)
+    if resumed:
+        if old and old is not s:
+            take_over(s, old, gap)
+        log.info(f"{peer_id} resumed in room '{room_name}'")
+        return True
+    if not announce:
+        log.info(f"{peer_id} joined room '{room_name}' quietly (size={room.size()})")
+        return True
+    serve_bootstrap(room, peer_id, s.role, s.stream)
 
     # Notify others
-    for pid, other_ws in list(room.peers.items()):
-        if pid != peer_id:
-            await send_json(other_ws, {"type": "peer-joined", "peer": peer_id})
-    log.info(f"{peer_id} joined room '{room_name}' (size={len(room.peers)})")
+    queue_presence(room, "joined", peer_id, s.role, s.stream)
+    log.info(f"{peer_id} joined room '{room_name}' (size={room.size()})")
     return True
 
-async def leave_room(ws: WebSocketServerProtocol):
-    room_name = peer_room.pop(ws, None)
-    peer_id = peer_id_of.pop(ws, None)
-    limiters.pop(ws, None)
-    if not room_name or not peer_id:
-        return
-    room = rooms.get(room_name)
+async def leave_room(s: Session):
+    room, peer_id = s.room, s.peer_id
+    s.room = None
     if not room:
         return
-    # Remove
-    if room.peers.get(peer_id) is ws:
-        room.peers.pop(peer_id, None)
+    # Remove (a session replaced by a newer connection leaves silently)
+    if room.peers.get(peer_id) is not s:
+        return
+    del room.peers[peer_id]
+    room.remove_member(peer_id)
+    if room.bootstrap:
+        room.bootstrap.pop(peer_id, None)
+    if bus:
+        bus.publish({"op": "leave", "w": bus.worker_id, "room": room.name, "peer": peer_id})
     # Notify others
-    for pid, other_ws in list(room.peers.items()):
-        await send_json(other_ws, {"type": "peer-left", "peer": peer_id})
+    queue_presence(room, "left", peer_id, s.role, s.stream)
     # Cleanup room if empty
-    if not room.peers:
-        rooms.pop(room_name, None)
-    log.info(f"{peer_id} left room '{room_name}' (size={len(room.peers) if room_name in rooms else 0})")
+    if not room.size():
+        drop_room(room)
+    log.info(f"{peer_id} left room '{room.name}' (size={room.size()})")
 
 # ------------------ Core handler ------------------
 async def handler(ws: WebSocketServerProtocol):
+    global open_sessions
     # Basic origin check
     if not origin_allowed(ws):
         await ws.close(code=4003, reason="origin-not-allowed")
         return
 
+    ip = remote_ip(ws)
+    if isinstance(ws, WebSocketServerProtocol):  # legacy server: process_request could not see the address
+        level = admit_connection(ip)
+        if level:
+            metrics.refused[level] = metrics.refused.get(level, 0) + 1
+            await ws.close(code=4429, reason="too-many-connections")
+            return
+
+    if TLS_CERT:
+        count_tls(ws)
+    session = Session(ws)
+    session.source = source_of(ip)
+    if session.source:
+        session.source.open += 1
+    open_sessions += 1
+    try:
+        await serve_peer(session)
+    finally:
+        open_sessions -= 1
+        if session.source:
+            session.source.open -= 1
+        log.debug(f"session closed {session.stats()}")
+        if not session.parked:
+            session.stop()
+
+async def serve_peer(s: Session):
+    ws = s.ws
     path = getattr(ws, "path", None) or getattr(getattr(ws, "request", None), "path", "")
-    room_name, peer_id, token = parse_query(path or "")
+    room_name, peer_id, token, role, stream, resume, gap = parse_query(path or "")
     if not room_name or not peer_id:
-        await send_json(ws, {"type": "error", "reason": "missing-room-or-peer"})
-        await ws.close(code=4400, reason="bad-query")
+        send_json(s, {"type": "error", "reason": "missing-room-or-peer"})
+        await s.close(4400, "bad-query")
         return
 
     if AUTH_TOKEN and token != AUTH_TOKEN:
-        await send_json(ws, {"type": "error", "reason": "auth-failed"})
-        await ws.close(code=4401, reason="unauthorized")
+        send_json(s, {"type": "error", "reason": "auth-failed"})
+        await s.close(4401, "unauthorized")
         return
 
-    limiters[ws] = RateLimiter(rate_per_sec=MAX_MSGS_PER_SEC)
+    s.role = role if role in PRESENCE_SCOPES else ""
+    s.stream = stream
 
-    # Heartbeat task using WebSocket ping/pong
-    async def heartbeat():
-        try:
-            while True:
-                await asyncio.sleep(PING_INTERVAL)
-                pong_waiter = await ws.ping()
-                await asyncio.wait_for(pong_waiter, timeout=PING_TIMEOUT)
-        except asyncio.TimeoutError:
-            log.warning(f"Ping timeout: {peer_id}")
-            await ws.close(code=1011, reason="ping-timeout")
-        except Exception:
-            pass
+    # Sharded: the room lives on another node
+    owner = redirect_target(room_name)
+    if owner:
+        metrics.redirects += 1
+        send_json(s, {"type": "redirect", "url": owner, "room": room_name})
+        await s.close(4307, "redirect")
+        return
 
-    hb_task = asyncio.create_task(heartbeat())
+    # Heartbeat: WebSocket ping/pong driven by the shared timer wheel
+    wheel.add(s)
 
     # Join room
-    if not await join_room(ws, room_name, peer_id):
-        hb_task.cancel()
+    if not await join_room(s, room_name, peer_id, resume, gap):
+        wheel.remove(s)
         return
 
     try:
         async for raw in ws:
-            if not limiters[ws].allow():
-                await send_json(ws, {"type": "error", "reason": "rate-limit"})
-                # Optional: close on persistent flooding
-                # await ws.close(code=4408, reason="rate-limit")
+            s.received += 1
+            wheel.touch(s)  # s.last_seen doubles as the receive time for route latency
+            refused = admit_message(s, s.last_seen)
+            if refused:
+                bucket, level = refused
+                metrics.rate_limited[level] = metrics.rate_limited.get(level, 0) + 1
+                if s.room:
+                    s.room.rate_limited += 1
+                await asyncio.sleep((1 - bucket.tokens) / bucket.rate)  # read again once there is a token
+                continue
+
+            if isinstance(raw, bytes):
+                route_frame(s, raw)
                 continue
 
             # Parse JSON
             try:
                 data = json.loads(raw)
             except Exception:
-                await send_json(ws, {"type": "error", "reason": "bad-json"})
+                count_received(s.room, None)
+                send_json(s, {"type": "error", "reason": "bad-json"})
                 continue
 
             msg_type = data.get("type")
-            room = rooms.get(peer_room.get(ws, ""))
-            me = peer_id_of.get(ws)
+            room = s.room
+            me = s.peer_id
+            count_received(room, msg_type)
 
-            if not room or not me:
-                await send_json(ws, {"type": "error", "reason": "not-in-room"})
+            if not room:
+                send_json(s, {"type": "error", "reason": "not-in-room"})
                 continue
 
             # Route signaling messages
-            if msg_type in ("offer", "answer", "candidate", "renegotiate", "ice-restart"):
+            if msg_type in ROUTED_TYPES:
                 target = data.get("to")
                 if not target or target == me:
-                    await send_json(ws, {"type": "error", "reason": "invalid-target"})
-                    continue
-                target_ws = room.peers.get(target)
-                if not target_ws:
-                    await send_json(ws, {"type": "error", "reason": "target-offline"})
+                    send_json(s, {"type": "error", "reason": "invalid-target"})
                     continue
                 # pass-through payload + from
                 payload = {k: v for k, v in data.items() if k not in ("type", "to")}
-                await send_json(target_ws, {"type": msg_type, "from": me, **payload})
+                route(s, target, msg_type, out={"type": msg_type, "from": me, **payload})
 
             elif msg_type == "leave":
-                await leave_room(ws)
-                await ws.close(code=1000, reason="bye")
+                await leave_room(s)
+                await s.close(1000, "bye")
 
             elif msg_type == "peers":
-                await send_json(ws, {"type": "peers", "room": room.name, "you": me, "peers": [p for p in room.peers if p != me]})
+                send_json(s, peers_message(room, s, me))
 
             elif msg_type == "ping":
-                await send_json(ws, {"type": "pong"})
+                send_json(s, {"type": "pong"})
 
             else:
                 # Unknown message
-                await send_json(ws, {"type": "error", "reason": "unknown-type", "got": msg_type})
+                send_json(s, {"type": "error", "reason": "unknown-type", "got": msg_type})
 
     except websockets.exceptions.ConnectionClosedOK:
         pass
@@ -228,26 +1371,553 @@ async def handler(ws: WebSocketServerProtocol):
     except Exception as e:
         log.exception(f"Handler error: {e}")
     finally:
-        hb_task.cancel()
-        await leave_room(ws)
+        wheel.remove(s)
+        await disconnect(s)
+
+HTTP_PATHS = ("/admin/sessions", "/metrics")
+
+async def process_request(*args):
+    """Answer GET /admin/sessions and /metrics over plain HTTP; anything else goes on to the websocket handshake.
+
+    websockets >= 14 calls this with (connection, request); the legacy server
+    with (path, headers).
+    """
+    if isinstance(args[0], str):
+        connection, path = None, args[0]
+    else:
+        connection, path = args[0], args[1].path
+    u = urlparse(path)
+    if u.path not in HTTP_PATHS:
+        level = admit_connection(remote_ip(connection)) if connection is not None else None
+        if not level:
+            return None
+        metrics.refused[level] = metrics.refused.get(level, 0) + 1
+        return connection.respond(HTTPStatus.TOO_MANY_REQUESTS, "too many connections\n")
+    q = parse_qs(u.query)
+    content_type = "application/json"
+    if ADMIN_TOKEN and q.get("token", [""])[0] != ADMIN_TOKEN:
+        status, text = HTTPStatus.UNAUTHORIZED, json.dumps({"error": "unauthorized"})
+    elif u.path == "/metrics":
+        status, text = HTTPStatus.OK, render_metrics()
+        content_type = "text/plain; version=0.0.4"
+    else:
+        status, text = HTTPStatus.OK, json.dumps(session_report(int(q.get("peers", ["0"])[0] or 0)))
+    if connection is None:
+        return status, [("Content-Type", content_type)], text.encode()
+    response = connection.respond(status, text)
+    del response.headers["Content-Type"]
+    response.headers["Content-Type"] = content_type
+    return response
+
+def select_subprotocol(*args):
+    """Pick the binary subprotocol if offered, else plain JSON (no subprotocol).
+
+    websockets >= 14 calls this with (connection, offered); the legacy server
+    with (offered, available).
+    """
+    offered = args[0] if isinstance(args[0], (list, tuple)) else args[1]
+    return SUBPROTOCOL if SUBPROTOCOL in offered else None
+
+async def log_stats():
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        sessions = local_sessions()
+        queued = sum(len(s.queue) for s in sessions if s.queue)
+        dropped = sum(s.dropped for s in sessions)
+        log.info(f"stats: rooms={len(rooms)} sessions={len(sessions)} heartbeat={wheel.stats()} "
+                 f"outbox_queued={queued} outbox_dropped={dropped}")
+
+# ------------------ Drain ------------------
+async def close_rooms(targets: List[Room], over: float, notice: Callable[[Room], dict], code: int, reason: str):
+    """Close the local sessions of targets room by room, spread over `over` s.
+
+    A room closes as a whole so its members reach their next server
+    together; each peer gets notice(room) just before its close.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    step = over / len(targets) if targets else 0.0
+    closing = []
+    for i, room in enumerate(targets):
+        await asyncio.sleep(max(0.0, start + i * step - loop.time()))
+        for s in list(room.peers.values()):
+            if s.closing or s.parked or s.room is not room:
+                continue
+            send_json(s, notice(room))
+            closing.append(s.close(code, reason))
+    await asyncio.gather(*closing, return_exceptions=True)
+
+def reconnect_notice(room: Room) -> dict:
+    return {"type": "reconnect", "after": round(random.uniform(0, RECONNECT_JITTER), 3)}
+
+async def drain(server, done: asyncio.Future):
+    """Stop accepting, then close the local rooms one by one over DRAIN_TIMEOUT s.
+
+    Every peer is told {"type": "reconnect", "after": s} before its
+    connection closes with 1012 (service restart): clients come back spread
+    over the drain instead of in one wave when the process exits. Parked
+    seats are released at once: their peers will not find them here.
+    """
+    global draining
+    if draining:
+        return
+    draining = True
+    targets = [room for room in rooms.values() if any(not s.parked for s in room.peers.values())]
+    for s in local_sessions():
+        if s.parked:
+            s.parked.cancel()
+            expire_parked(s)
+    log.warning(f"draining: {len(targets)} rooms, {open_sessions} connections over {DRAIN_TIMEOUT}s")
+    server.close(close_connections=False)  # stop listening, keep the open connections
+    start = asyncio.get_running_loop().time()
+    await close_rooms(targets, DRAIN_TIMEOUT, reconnect_notice, 1012, "service-restart")
+    # handshakes that were in flight when listening stopped
+    await close_rooms(list(rooms.values()), 0, reconnect_notice, 1012, "service-restart")
+    log.warning(f"drained in {asyncio.get_running_loop().time() - start:.1f}s")
+    if not done.done():
+        done.set_result(None)
+
+# ------------------ Sharding ------------------
+# Rooms are spread over the nodes in NODES / NODES_FILE by consistent hashing
+# of the room name. Every node reads the same list, so they agree on owners
+# without talking to each other. A peer that reaches the wrong node gets
+# {"type": "redirect", "url": owner}. Each node has RING_VNODES points on the
+# ring: adding a node moves about 1/N of the rooms, all of them to the new one.
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    __slots__ = ("nodes", "points", "owners")
+
+    def __init__(self, nodes: List[str], vnodes: int = RING_VNODES):
+        self.nodes = sorted(set(nodes))
+        ring = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.points = [h for h, _ in ring]
+        self.owners = [node for _, node in ring]
+
+    def owner(self, room_name: str) -> Optional[str]:
+        if not self.points:
+            return None
+        i = bisect_left(self.points, ring_hash(room_name))
+        return self.owners[i % len(self.owners)]
+
+def load_nodes() -> List[str]:
+    if NODES_FILE:
+        try:
+            with open(NODES_FILE) as f:
+                return [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+        except OSError as e:
+            log.error(f"cannot read NODES_FILE: {e}")
+            return ring.nodes
+    return [n.strip() for n in NODES.split(",") if n.strip()]
+
+ring = HashRing([])
+
+def redirect_target(room_name: str) -> Optional[str]:
+    """The node that owns room_name when it is not this one."""
+    owner = ring.owner(room_name)
+    return owner if owner and owner != NODE_URL else None
+
+async def rebalance():
+    """Re-read the node list; hand the rooms this node no longer owns to their new owner."""
+    global ring
+    new = HashRing(load_nodes())
+    if new.nodes == ring.nodes:
+        return
+    ring = new
+    if ring.nodes and NODE_URL not in ring.nodes:
+        log.warning(f"NODE_URL {NODE_URL} is not in the node list: every room will be redirected")
+    targets = [room for room in rooms.values() if redirect_target(room.name)]
+    moving.update(room.name for room in targets)
+    log.warning(f"ring: {len(ring.nodes)} nodes, moving {len(targets)}/{len(rooms)} rooms over {REBALANCE_TIME}s")
+    await close_rooms(targets, REBALANCE_TIME,
+                      lambda room: {"type": "redirect", "url": redirect_target(room.name), "room": room.name},
+                      4307, "redirect")
+
+# ------------------ TLS ------------------
+# wss:// served directly (TLS_CERT). A reconnecting client offers the session
+# ticket from its last connection and gets a resumed handshake: no
+# certificate, no signature, and on TLS 1.2 one round trip less. OpenSSL
+# encrypts tickets with a random key kept in the SSL_CTX, made fresh with
+# each context (every TLS_TICKET_ROTATE s), so a ticket resumes only on the
+# worker that issued it. The ssl module has no way to set ticket keys; for
+# tickets every worker and node accepts, terminate TLS in a fronting proxy
+# (nginx ssl_session_ticket_key, haproxy tls-ticket-keys) and serve ws://.
+
+def ticket_epoch(now: float) -> int:
+    return int(now // TLS_TICKET_ROTATE) if TLS_TICKET_ROTATE > 0 else 0
+
+class ServerTLS(ssl.SSLContext):
+    """Listening context for wss://: every handshake runs on the context of the current ticket epoch.
+
+    asyncio wraps each accepted connection with wrap_bio, so swapping
+    `current` rotates the ticket key (and re-reads a renewed certificate)
+    without touching the listening socket.
+    """
+    current: Optional[ssl.SSLContext] = None
+    epoch = -1
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return self.current.wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+    def rotate(self, now: float) -> bool:
+        """Move to the context of now's epoch; False if already there or the certificate cannot be loaded."""
+        epoch = ticket_epoch(now)
+        if epoch == self.epoch:
+            return False
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        try:
+            ctx.load_cert_chain(TLS_CERT, TLS_KEY or None)
+        except (OSError, ssl.SSLError) as e:
+            if self.current is None:
+                raise
+            log.warning(f"TLS: cannot reload {TLS_CERT}: {e}; keeping the current context")
+            return False
+        ctx.num_tickets = TLS_TICKETS
+        self.current, self.epoch = ctx, epoch
+        return True
+
+async def rotate_tickets(tls: ServerTLS):
+    while True:
+        await asyncio.sleep(TLS_TICKET_ROTATE - time.time() % TLS_TICKET_ROTATE + 0.01)
+        if tls.rotate(time.time()):
+            metrics.tls_rotations += 1
+            log.info(f"TLS ticket key rotated (epoch {tls.epoch})")
+
+def count_tls(ws: WebSocketServerProtocol):
+    ssl_object = ws.transport.get_extra_info("ssl_object")
+    if ssl_object is not None:
+        result = "resumed" if ssl_object.session_reused else "full"
+        metrics.tls[result] = metrics.tls.get(result, 0) + 1
+
+# ------------------ WHIP / WHEP ------------------
+# Single-round-trip setup over plain HTTP (WHIP_PORT), for clients that would
+# rather not hold a websocket:
+#
+#   POST   /whep/<room>[?publisher=<id>]  viewer's SDP offer -> the publisher's answer
+#   POST   /whip/<room>                   publisher's SDP offer -> the answer of the first viewer in the room
+#   PATCH  /whip|whep/<room>/<id>         trickle ICE (sdpfrag); the reply carries the other side's new candidates
+#   DELETE /whip|whep/<room>/<id>         end the session
+#
+# An HTTP session is an ordinary Session seated in the room whose websocket is
+# an HttpLink: routing, presence, the worker bus and metrics need nothing
+# special. Media still flows peer to peer, so a WHIP POST is answered by a
+# viewer, not by a media server.
+SDP_TYPE = "application/sdp"
+SDPFRAG_TYPE = "application/trickle-ice-sdpfrag"
+MAX_HTTP_BODY = 64 * 1024
+HTTP_KINDS = {"whip": "publisher", "whep": "viewer"}  # URL prefix -> role the session joins as
+
+class HttpLink:
+    """Stands in for the websocket of a WHIP/WHEP session: what the room sends it arrives in send()."""
+    __slots__ = ("kind", "remote_address", "subprotocol", "offer", "wanted", "counterpart", "answer",
+                 "candidates", "session")
+
+    def __init__(self, kind: str, ip: str, offer: str, wanted: Optional[str]):
+        self.kind = kind  # "whip" or "whep"
+        self.remote_address = (ip, 0)
+        self.subprotocol = None  # JSON
+        self.offer = offer
+        self.wanted = wanted  # WHEP ?publisher=: only this peer may answer
+        self.counterpart: Optional[str] = None  # peer the offer went to
+        self.answer: asyncio.Future = asyncio.get_running_loop().create_future()  # its SDP answer
+        self.candidates: List[dict] = []  # its trickled candidates not yet returned by a PATCH
+        self.session: Optional[Session] = None
+
+    async def send(self, data: Union[str, bytes]):
+        on_link_message(self, json.loads(data) if isinstance(data, str) else frame_to_json(data))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.session:
+            await end_http_session(self.session, reason or str(code))
+
+http_sessions: Dict[str, Session] = {}  # peer id -> open WHIP/WHEP session
+
+def send_offer(s: Session):
+    link = s.ws
+    s.last_seen = asyncio.get_running_loop().time()
+    route(s, link.counterpart, "offer", out={"type": "offer", "from": s.peer_id, "sdp": link.offer, "sdpType": "offer"})
+
+def on_link_message(link: HttpLink, msg: dict):
+    """Room traffic for an HTTP session: pick whom to offer to, collect the answer and candidates."""
+    s, t = link.session, msg.get("type")
+    if t == "answer" and msg.get("from") == link.counterpart:
+        if not link.answer.done():
+            link.answer.set_result(msg.get("sdp", ""))
+        return
+    if t == "candidate" and msg.get("from") == link.counterpart:
+        link.candidates.append(msg)
+        return
+    joined: List[str] = []
+    left: List[str] = []
+    if t == "peers":
+        joined = msg.get("peers", [])
+    elif t == "peer-joined":
+        joined = [msg["peer"]]
+    elif t == "peer-left":
+        left = [msg["peer"]]
+    elif t == "presence":
+        joined, left = msg.get("joined", []), msg.get("left", [])
+    elif t == "error" and msg.get("reason") == "target-offline":
+        left = [link.counterpart]
+    if link.counterpart is not None and link.counterpart in left:
+        if link.answer.done():
+            if link.counterpart in joined:
+                return  # back within the window: it answered from its new connection (a publisher handoff)
+            asyncio.ensure_future(end_http_session(s, f"{link.counterpart} left"))
+            return
+        link.counterpart = None  # gone before answering: offer to the next one (or to it again when it rejoins)
+    if link.counterpart is None and not link.answer.done():
+        for peer in joined:
+            if link.wanted is None or peer == link.wanted:
+                link.counterpart = peer
+                send_offer(s)
+                break
+
+async def end_http_session(s: Session, reason: str):
+    link = s.ws
+    if http_sessions.get(s.peer_id) is s:
+        del http_sessions[s.peer_id]
+    if not link.answer.done():
+        link.answer.cancel()
+    link.session = None
+    s.closing = s.closing or (1000, reason)
+    await leave_room(s)
+    log.info(f"{link.kind} session {s.peer_id} ended ({reason})")
+
+async def open_http_session(kind: str, room_name: str, offer: str, ip: str, wanted: Optional[str]):
+    """POST: seat an HTTP peer in the room, route its offer, wait for the answer."""
+    if kind == "whep":
+        room = rooms.get(room_name)
+        publishers = [p for p in visible_peers(room, "viewer", "") if wanted is None or p == wanted] if room else []
+        if not publishers:
+            metrics.http_sessions[(kind, "no-publisher")] = metrics.http_sessions.get((kind, "no-publisher"), 0) + 1
+            return HTTPStatus.NOT_FOUND, {}, "no publisher in this room\n"
+    started = asyncio.get_running_loop().time()
+    link = HttpLink(kind, ip, offer, wanted)
+    s = link.session = Session(link)
+    s.role = HTTP_KINDS[kind]
+    peer_id = f"{kind}-{secrets.token_hex(6)}"
+    # WHEP joins quietly: the publisher meets the viewer through its offer. WHIP is announced so viewers see a publisher.
+    if not await join_room(s, room_name, peer_id, announce=kind == "whip"):
+        return HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": "5"}, "room full\n"
+    http_sessions[peer_id] = s
+    try:
+        answer = await asyncio.wait_for(asyncio.shield(link.answer), WHIP_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        if link.session:
+            await end_http_session(s, "no answer")
+        metrics.http_sessions[(kind, "no-answer")] = metrics.http_sessions.get((kind, "no-answer"), 0) + 1
+        return HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": "2"}, "no answer from the room\n"
+    metrics.http_sessions[(kind, "created")] = metrics.http_sessions.get((kind, "created"), 0) + 1
+    metrics.http_answer.observe(asyncio.get_running_loop().time() - started)
+    location = f"/{kind}/{quote(room_name, safe='')}/{peer_id}"
+    return HTTPStatus.CREATED, {"Content-Type": SDP_TYPE, "Location": location, "ETag": f'"{peer_id}"'}, answer
+
+def trickle(s: Session, body: str):
+    """PATCH: route the client's candidates to the counterpart, hand back the counterpart's."""
+    link = s.ws
+    s.last_seen = asyncio.get_running_loop().time()
+    mid = None
+    for line in body.splitlines():
+        line = line.strip()
+        if line.startswith("a=mid:"):
+            mid = line[len("a=mid:"):]
+        elif line.startswith("a=candidate:") and link.counterpart:
+            route(s, link.counterpart, "candidate", out={"type": "candidate", "from": s.peer_id,
+                                                         "candidate": line[len("a=candidate:"):], "sdpMid": mid})
+        # a=ice-ufrag / a=ice-pwd / a=end-of-candidates: nothing to do (no ICE restart over HTTP)
+    pending, link.candidates = link.candidates, []
+    if not pending:
+        return HTTPStatus.NO_CONTENT, {}, ""
+    frag = []
+    for c in pending:
+        if c.get("sdpMid") is not None:
+            frag.append(f"a=mid:{c['sdpMid']}")
+        candidate = c.get("candidate", "")
+        candidate = candidate.get("candidate", "") if isinstance(candidate, dict) else candidate
+        frag.append(f"a={candidate}" if candidate.startswith("candidate:") else f"a=candidate:{candidate}")
+    return HTTPStatus.OK, {"Content-Type": SDPFRAG_TYPE}, "\r\n".join(frag) + "\r\n"
+
+async def whip_request(method: str, target: str, headers: Dict[str, str], body: str, ip: str):
+    """One WHIP/WHEP request -> (status, extra headers, body)."""
+    u = urlparse(target)
+    parts = u.path.strip("/").split("/")
+    if len(parts) not in (2, 3) or parts[0] not in HTTP_KINDS or not parts[1]:
+        return HTTPStatus.NOT_FOUND, {}, "not found\n"
+    kind, room_name = parts[0], unquote(parts[1])
+    if method == "OPTIONS":
+        return HTTPStatus.NO_CONTENT, {"Accept-Post": SDP_TYPE, "Accept-Patch": SDPFRAG_TYPE}, ""
+    if AUTH_TOKEN and headers.get("authorization") != f"Bearer {AUTH_TOKEN}":
+        return HTTPStatus.UNAUTHORIZED, {"WWW-Authenticate": "Bearer"}, "unauthorized\n"
+    if len(parts) == 2:
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"Allow": "POST, OPTIONS"}, ""
+        if not headers.get("content-type", "").startswith(SDP_TYPE):
+            return HTTPStatus.UNSUPPORTED_MEDIA_TYPE, {}, f"expected {SDP_TYPE}\n"
+        if draining:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": str(int(RECONNECT_JITTER) + 1)}, "restarting\n"
+        owner = redirect_target(room_name)
+        if owner:
+            metrics.redirects += 1
+            node = urlparse(owner)
+            scheme = "https" if node.scheme == "wss" else "http"
+            return HTTPStatus.TEMPORARY_REDIRECT, {"Location": f"{scheme}://{node.hostname}:{WHIP_PORT}{target}"}, ""
+        level = admit_connection(ip)
+        if level:
+            metrics.refused[level] = metrics.refused.get(level, 0) + 1
+            return HTTPStatus.TOO_MANY_REQUESTS, {}, "too many connections\n"
+        return await open_http_session(kind, room_name, body, ip, parse_qs(u.query).get("publisher", [None])[0])
+    s = http_sessions.get(parts[2])
+    if s is None or s.ws.kind != kind or s.room is None or s.room.name != room_name:
+        return HTTPStatus.NOT_FOUND, {}, "no such session\n"
+    if method == "PATCH":
+        if not headers.get("content-type", "").startswith(SDPFRAG_TYPE):
+            return HTTPStatus.UNSUPPORTED_MEDIA_TYPE, {}, f"expected {SDPFRAG_TYPE}\n"
+        return trickle(s, body)
+    if method == "DELETE":
+        await end_http_session(s, "deleted")
+        return HTTPStatus.OK, {}, ""
+    return HTTPStatus.METHOD_NOT_ALLOWED, {"Allow": "PATCH, DELETE, OPTIONS"}, ""
+
+def http_response(status: HTTPStatus, extra: Dict[str, str], text: str, origin: Optional[str], keep: bool) -> bytes:
+    body = text.encode()
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep else 'close'}",
+             f"Access-Control-Allow-Origin: {origin if origin and ALLOWED_ORIGINS else '*'}",
+             "Access-Control-Allow-Methods: POST, PATCH, DELETE, OPTIONS",
+             "Access-Control-Allow-Headers: Authorization, Content-Type, If-Match",
+             "Access-Control-Expose-Headers: Location, ETag"]
+    lines.extend(f"{k}: {v}" for k, v in extra.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+async def http_front(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """HTTP/1.1 with keep-alive, just enough for WHIP/WHEP (no chunked bodies)."""
+    ip = (writer.get_extra_info("peername") or ("",))[0]
+    try:
+        while True:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+            method, target, _ = head[0].split(" ", 2)
+            headers = {}
+            for line in head[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            origin = headers.get("origin")
+            keep = headers.get("connection", "").lower() != "close"
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_HTTP_BODY:
+                writer.write(http_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {}, "", origin, False))
+                break
+            body = (await reader.readexactly(length)).decode() if length else ""
+            if ALLOWED_ORIGINS and origin and origin not in ALLOWED_ORIGINS:
+                status, extra, text = HTTPStatus.FORBIDDEN, {}, "origin not allowed\n"
+            else:
+                status, extra, text = await whip_request(method, target, headers, body, ip)
+            writer.write(http_response(status, extra, text, origin, keep))
+            await writer.drain()
+            if not keep:
+                break
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError, ssl.SSLError):
+        pass
+    except Exception as e:
+        log.exception(f"WHIP/WHEP error: {e}")
+    finally:
+        writer.close()
 
 # ------------------ Server bootstrap ------------------
-async def main():
-    log.info(f"Signaling server starting on ws://{HOST}:{PORT}")
-    # If you terminate TLS at Python: provide ssl=ssl_context here.
+async def main(worker_id: int = 0):
+    global bus, base_rss, global_msgs, global_conns
+    base_rss = rss_bytes()
+    share = max(1, WORKERS)  # the global budgets are split over the workers; per-IP ones apply in each worker
+    if GLOBAL_MSGS_PER_SEC > 0:
+        global_msgs = RateLimiter(GLOBAL_MSGS_PER_SEC / share)
+    if GLOBAL_CONNS_PER_SEC > 0:
+        global_conns = RateLimiter(GLOBAL_CONNS_PER_SEC / share)
+    await rebalance()  # load the node list
+    if WORKERS > 1:
+        bus = WorkerBus(worker_id, WORKERS, BUS_DIR)
+        await bus.start()
+        log.info(f"Worker {worker_id}/{WORKERS} starting on {'wss' if TLS_CERT else 'ws'}://{HOST}:{PORT}")
+    else:
+        log.info(f"Signaling server starting on {'wss' if TLS_CERT else 'ws'}://{HOST}:{PORT}")
+    if STATS_INTERVAL > 0:
+        asyncio.create_task(log_stats())
+    tls = None
+    if TLS_CERT:  # else terminate TLS in front (nginx, haproxy)
+        tls = ServerTLS(ssl.PROTOCOL_TLS_SERVER)
+        tls.rotate(time.time())
+        if TLS_TICKET_ROTATE > 0:
+            asyncio.create_task(rotate_tickets(tls))
+    if WHIP_PORT > 0:
+        await asyncio.start_server(http_front, HOST, WHIP_PORT, ssl=tls, reuse_port=WORKERS > 1)
+        log.info(f"WHIP/WHEP on {'https' if TLS_CERT else 'http'}://{HOST}:{WHIP_PORT}/whip|whep/<room>")
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
     async with websockets.serve(
         handler,
         HOST,
         PORT,
         # origins enforces Origin header (basic CSRF-ish protection for WS)
         origins=ALLOWED_ORIGINS if ALLOWED_ORIGINS else None,
+        subprotocols=[SUBPROTOCOL],
+        select_subprotocol=select_subprotocol,
+        process_request=process_request,  # GET /admin/sessions, /metrics
         max_size=2 * 1024 * 1024,  # 2MB frames (tùy chỉnh)
-        ping_interval=None,  # we run our own heartbeat task
-    ):
-        await asyncio.Future()
+        ping_interval=None,  # heartbeats come from the shared timer wheel
+        reuse_port=WORKERS > 1,  # kernel spreads accepts over the workers
+        ssl=tls,
+    ) as server:
+        if DRAIN_TIMEOUT > 0:
+            loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(drain(server, done)))
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(rebalance()))  # node list changed
+        await done
+    if bus:
+        bus.close()
+        await asyncio.sleep(0.1)  # let the link readers see EOF
+
+def run_worker(worker_id: int):
+    try:
+        asyncio.run(main(worker_id))
+    except KeyboardInterrupt:
+        pass
+
+def run_workers():
+    """Spawn WORKERS processes on the same port and restart any that die."""
+    ctx = multiprocessing.get_context("spawn")
+    procs: Dict[int, multiprocessing.Process] = {}
+
+    def spawn(wid: int):
+        p = ctx.Process(target=run_worker, args=(wid,), name=f"signaling-worker-{wid}", daemon=True)
+        p.start()
+        procs[wid] = p
+
+    os.environ.setdefault("RESUME_SECRET", RESUME_SECRET.decode())  # any worker can check any token
+    # SIGTERM -> SystemExit so the workers get stopped below
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    # SIGHUP (node list changed) -> every worker rebalances
+    signal.signal(signal.SIGHUP, lambda *_: [os.kill(p.pid, signal.SIGHUP) for p in procs.values() if p.pid])
+    for wid in range(WORKERS):
+        spawn(wid)
+    try:
+        while True:
+            for wid, p in list(procs.items()):
+                p.join(timeout=0.5)
+                if p.exitcode is not None:
+                    log.warning(f"Worker {wid} exited with code {p.exitcode}, restarting")
+                    spawn(wid)
+    finally:
+        for p in procs.values():
+            p.terminate()
+        for p in procs.values():
+            p.join(timeout=DRAIN_TIMEOUT + 5)  # terminate() is SIGTERM: each worker drains
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if WORKERS > 1:
+            run_workers()
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         log.info("Shutting down...")
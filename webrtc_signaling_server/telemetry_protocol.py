@@ -0,0 +1,261 @@
+# telemetry_protocol.py
+"""
+MAVLink framing for the "telemetry" data channel, shared by publisher and viewer.
+
+The publisher gets telemetry as arbitrary byte chunks (a UART read, a UDP
+datagram). MavlinkFramer cuts the stream back into whole MAVLink frames:
+
+    v1: | 0xFE | len | seq | sys | comp | msgid |   payload   | crc (2) |
+    v2: | 0xFD | len | incompat | compat | seq | sys | comp | msgid (3) |
+        payload | crc (2) | signature (13, if incompat & 0x01) |
+
+TelemetryPacker puts as many whole frames as fit in one data channel
+message (max_size, one SCTP packet: aiortc does not bundle chunks) and sends
+when the next frame would not fit or max_delay after the first one. A
+message is just frames back to back, so it is still a valid MAVLink byte
+stream: a viewer without the unpacker forwards it as it always did.
+unpack() splits a message into the frames again, one UDP datagram each,
+like the autopilot / mavlink-router sent them.
+
+A start byte is only taken as a frame when the v2 incompat flags are ones
+MAVLink defines and the checksum is one some CRC_EXTRA could give (the exact
+check needs the dialect's table; a stray start byte passes 1 time in 256).
+Otherwise the framer resyncs at the next start byte. Bytes that are not
+MAVLink pass through untouched as "raw" chunks, each in a message of its own
+and split where one feed() ended, so non-MAVLink datagrams keep their
+boundaries. The bytes out are always the bytes in, in order.
+
+classify() tells the sender which frames are state (a newer one of the same
+message from the same component supersedes it, so under congestion only the
+latest is kept) and which must all be delivered. Only the periodic messages
+in STATE count as state, and only when their CRC checks out (a misframed run
+of bytes cannot pose as one); everything else, including any message id the
+table does not know (dialects, one-shot events, commands) and raw chunks, is
+must-deliver.
+"""
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+MAVLINK_V1 = 0xFE
+MAVLINK_V2 = 0xFD
+STX = (MAVLINK_V1, MAVLINK_V2)
+V1_OVERHEAD = 8  # header 6 + crc 2
+V2_OVERHEAD = 12  # header 10 + crc 2
+V2_SIGNATURE = 13
+V2_SIGNED = 0x01
+MAX_FRAME = V2_OVERHEAD + 255 + V2_SIGNATURE
+
+# periodic state messages a newer copy fully replaces: message id -> CRC_EXTRA
+# (common.xml, plus ArduPilot's ardupilotmega.xml streams). Not listed = must-deliver.
+STATE = {
+    0: 50,     # HEARTBEAT
+    1: 124,    # SYS_STATUS
+    2: 137,    # SYSTEM_TIME
+    24: 24,    # GPS_RAW_INT
+    26: 170,   # SCALED_IMU
+    27: 144,   # RAW_IMU
+    29: 115,   # SCALED_PRESSURE
+    30: 39,    # ATTITUDE
+    31: 246,   # ATTITUDE_QUATERNION
+    32: 185,   # LOCAL_POSITION_NED
+    33: 104,   # GLOBAL_POSITION_INT
+    35: 244,   # RC_CHANNELS_RAW
+    36: 222,   # SERVO_OUTPUT_RAW
+    62: 183,   # NAV_CONTROLLER_OUTPUT
+    65: 118,   # RC_CHANNELS
+    74: 20,    # VFR_HUD
+    116: 76,   # SCALED_IMU2
+    125: 203,  # POWER_STATUS
+    136: 1,    # TERRAIN_REPORT
+    147: 154,  # BATTERY_STATUS
+    152: 208,  # MEMINFO
+    163: 127,  # AHRS
+    165: 21,   # HWSTATUS
+    178: 47,   # AHRS2
+    193: 71,   # EKF_STATUS_REPORT
+    241: 90,   # VIBRATION
+}
+
+def _crc_step(tmp: int) -> int:
+    tmp = (tmp ^ (tmp << 4)) & 0xFF
+    return ((tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xFFFF
+
+CRC_TABLE = tuple(_crc_step(tmp) for tmp in range(256))
+
+def crc_x25(data, crc: int = 0xFFFF) -> int:
+    """MAVLink's checksum (CRC-16/MCRF4XX), a table lookup per byte."""
+    table = CRC_TABLE
+    for b in data:
+        crc = (crc >> 8) ^ table[(b ^ crc) & 0xFF]
+    return crc
+
+def frame_length(buf, i: int) -> int:
+    """Length of the frame starting at buf[i] (a start byte), 0 if the header is not complete yet."""
+    if buf[i] == MAVLINK_V1:
+        return buf[i + 1] + V1_OVERHEAD if len(buf) > i + 1 else 0
+    if len(buf) <= i + 2:
+        return 0
+    return buf[i + 1] + V2_OVERHEAD + (V2_SIGNATURE if buf[i + 2] & V2_SIGNED else 0)
+
+# folding CRC_EXTRA into crc c gives (c >> 8) ^ one of these, whichever byte it is
+CRC_STEPS = frozenset(CRC_TABLE)
+
+def frame_ok(frame) -> bool:
+    """A whole candidate frame's checksum is possible for its header and payload, whatever its CRC_EXTRA."""
+    header = 6 if frame[0] == MAVLINK_V1 else 10
+    end = header + frame[1]
+    crc = crc_x25(frame[1:end])
+    return (int.from_bytes(frame[end:end + 2], "little") ^ (crc >> 8)) in CRC_STEPS
+
+class MavlinkFramer:
+    """Streaming cutter: feed() byte chunks, get back (is_frame, bytes) pieces in stream order."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.marks: List[int] = []  # buffer offsets where a feed() ended
+        self.frames = 0
+        self.raw = 0  # bytes passed through as non-MAVLink
+
+    def feed(self, data: bytes) -> List[Tuple[bool, bytes]]:
+        self.buffer += data
+        self.marks.append(len(self.buffer))
+        return self._cut(final=False)
+
+    def flush(self) -> List[Tuple[bool, bytes]]:
+        """Everything still held, a partial frame included (as raw): the stream went quiet."""
+        return self._cut(final=True)
+
+    def _cut(self, final: bool) -> List[Tuple[bool, bytes]]:
+        buf = self.buffer
+        out = []
+        start = i = 0  # buf[start:i]: raw bytes not handed out yet
+        while i < len(buf):
+            if buf[i] not in STX or buf[i] == MAVLINK_V2 and len(buf) > i + 2 and buf[i + 2] & ~V2_SIGNED:
+                i += 1
+                continue
+            n = frame_length(buf, i)
+            if n and i + n <= len(buf):
+                if frame_ok(buf[i:i + n]):
+                    self._raw(out, start, i)
+                    out.append((True, bytes(buf[i:i + n])))
+                    self.frames += 1
+                    i += n
+                    start = i
+                    continue
+            elif not final:
+                break  # wait for the rest of the frame
+            i += 1  # not a frame: resync at the next start byte
+        self._raw(out, start, i)
+        del buf[:i]
+        self.marks = [mark - i for mark in self.marks if mark > i]
+        return out
+
+    def _raw(self, out: list, start: int, end: int):
+        """buffer[start:end] as raw pieces, cut where one feed() ended and the next began."""
+        self.raw += end - start
+        for mark in self.marks:
+            if start < mark < end:
+                out.append((False, bytes(self.buffer[start:mark])))
+                start = mark
+        if start < end:
+            out.append((False, bytes(self.buffer[start:end])))
+
+def message_key(frame: bytes) -> Optional[Tuple[int, int, int]]:
+    """(system id, component id, message id) of a STATE frame with a valid CRC, None if it must be delivered."""
+    if frame[0] == MAVLINK_V1:
+        sysid, compid, msgid, header = frame[3], frame[4], frame[5], 6
+    else:
+        sysid, compid, msgid, header = frame[5], frame[6], int.from_bytes(frame[7:10], "little"), 10
+    extra = STATE.get(msgid)
+    if extra is None:
+        return None
+    end = header + frame[1]
+    if crc_x25(bytes((extra,)), crc_x25(frame[1:end])) != int.from_bytes(frame[end:end + 2], "little"):
+        return None  # misframed or a different dialect's message with the same id
+    return sysid, compid, msgid
+
+def classify(message: bytes) -> List[Tuple[Optional[tuple], bytes]]:
+    """A telemetry message -> (key, piece) for each frame / raw chunk: key from message_key(), None for raw."""
+    framer = MavlinkFramer()
+    return [(message_key(piece) if is_frame else None, piece) for is_frame, piece in framer.feed(message) + framer.flush()]
+
+def unpack(message: bytes) -> List[bytes]:
+    """Viewer side: a telemetry message -> the frames (and raw chunks) in it, in order."""
+    framer = MavlinkFramer()
+    return [piece for _, piece in framer.feed(message) + framer.flush()]
+
+class TelemetryPacker:
+    """
+    Publisher side: feed() telemetry chunks, send(message) gets whole frames packed up
+    to max_size bytes, at most max_delay s after the first frame of a message was read.
+    A partial frame is held until the rest arrives (a 280 byte frame takes 50 ms at
+    57600 baud); after `hold` s without new bytes it goes out as raw.
+    """
+
+    def __init__(self, send: Callable[[bytes], None], max_size: int = 1200, max_delay: float = 0.005,
+                 hold: float = 0.25):
+        self.send = send
+        self.max_size = max(max_size, MAX_FRAME)
+        self.max_delay = max_delay
+        self.hold = hold
+        self.loop = asyncio.get_running_loop()
+        self.framer = MavlinkFramer()
+        self.pending = bytearray()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.fed = 0.0  # loop time of the last feed()
+        self.messages = 0
+        self.bytes = 0
+
+    def feed(self, data: bytes):
+        self.fed = self.loop.time()
+        for is_frame, piece in self.framer.feed(data):
+            self._add(is_frame, piece)
+        self._arm()
+
+    def _add(self, is_frame: bool, piece: bytes):
+        if not is_frame:
+            self.flush()
+            self._send(piece)  # raw keeps its own boundaries
+            return
+        if len(self.pending) + len(piece) > self.max_size:
+            self.flush()
+        self.pending += piece
+        if self.max_delay <= 0:
+            self.flush()
+
+    def _arm(self):
+        if self.pending:
+            when = self.loop.time() + self.max_delay
+        elif self.framer.buffer:
+            when = self.fed + self.hold
+        else:
+            return
+        if self.timer is not None:
+            if self.timer.when() <= when:
+                return
+            self.timer.cancel()  # a partial frame's hold timer: frames are waiting now
+        self.timer = self.loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self.timer = None
+        self.flush()
+        if self.framer.buffer and self.loop.time() - self.fed >= self.hold:
+            for is_frame, piece in self.framer.flush():
+                self._add(is_frame, piece)
+            self.flush()
+        self._arm()
+
+    def flush(self):
+        if self.pending:
+            self._send(bytes(self.pending))
+            self.pending.clear()
+
+    def _send(self, message: bytes):
+        self.messages += 1
+        self.bytes += len(message)
+        self.send(message)
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
@@ -1,9 +1,23 @@
-import select
+import os
+import re
+import collections
+import ssl
 import time
+import random
+import ipaddress
+import urllib.error
+import urllib.parse
+import urllib.request
 import websockets, json, asyncio, serial, cv2, socket, subprocess, av, struct
 from aiortc.sdp import candidate_from_sdp
 from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack, MediaStreamTrack
+from aiortc import RTCIceGatherer, RTCIceServer
 from aiortc.contrib.media import MediaPlayer
+import aioice, aiortc
+from aioice import Candidate, Connection
+from aioice.stun import TransactionError
+from signaling_protocol import SUBPROTOCOL, ROUTED_TYPES, frame_from_json, frame_to_json
+from telemetry_protocol import TelemetryPacker, classify
 
 ###### CÁC HÀM DÙNG CHUNG #####
 
@@ -62,99 +76,858 @@ async def signaling_loop(pc: RTCPeerConnection,
         # đợi vài giây rồi thử reconnect lại signaling server
         await asyncio.sleep(timeout)
 
+# ===== gửi / nhận message signaling (JSON hoặc binary subprotocol) =====
+async def send_signal(ws, msg: dict):
+    """
+    Gửi message signaling. Nếu server đã chọn binary subprotocol thì
+    offer/answer/candidate được gửi dạng frame binary (server chỉ đọc header).
+    """
+    if ws.subprotocol == SUBPROTOCOL and msg.get("type") in ROUTED_TYPES and msg.get("to"):
+        await ws.send(frame_from_json(msg))
+    else:
+        await ws.send(json.dumps(msg))
+
+def parse_signal(raw) -> dict:
+    if isinstance(raw, bytes):
+        return frame_to_json(raw)
+    return json.loads(raw)
+
+# ===== thời gian chờ trước khi nối lại =====
+RECONNECT_BACKOFF_MAX = 60  # giây
+MAX_REDIRECTS = 5  # số lần redirect liên tiếp tối đa (tránh vòng lặp khi các node chưa cùng danh sách)
+
+def reconnect_delay(failures: int, timeout: float) -> float:
+    """
+    Exponential backoff có jitter (full jitter): lần thứ n chờ ngẫu nhiên trong
+    [0, timeout * 2^(n-1)], tối đa RECONNECT_BACKOFF_MAX. Khi server restart,
+    các client không quay lại cùng lúc theo từng đợt.
+    """
+    return random.uniform(0, min(RECONNECT_BACKOFF_MAX, timeout * 2 ** max(0, failures - 1)))
+
+# ====== TLS (wss://) ======
+# file CA để kiểm tra cert của signaling server (rỗng = CA hệ thống); cert tự ký thì trỏ thẳng tới file cert
+SIGNALING_CA_FILE = os.getenv("SIGNALING_CA_FILE", "")
+
+class TLSSessionCache(ssl.SSLContext):
+    """
+    SSLContext phía client nhớ TLS session (ticket) cuối cùng của từng server.
+    Lần nối lại đưa session đó ra: server nhận thì bắt tay rút gọn (resumed),
+    không gửi certificate / ký lại, TLS 1.2 bớt được 1 RTT. Đường vệ tinh RTT cao
+    thì mỗi lần reconnect nhanh hơn rõ.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.sessions = {}  # server_hostname -> ssl.SSLSession
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname,
+                                session=session or self.sessions.get(server_hostname))
+
+    def remember(self, ws) -> bool:
+        """Lưu session của kết nối ws (gọi sau khi đã nhận message đầu tiên: TLS 1.3 gửi ticket sau handshake). Trả về True nếu lần bắt tay này là resumed."""
+        ssl_object = ws.transport.get_extra_info("ssl_object")
+        if ssl_object is None:
+            return False
+        if ssl_object.session is not None:
+            self.sessions[ssl_object.server_hostname] = ssl_object.session
+        return ssl_object.session_reused
+
+def tls_client_context(cafile: str = "") -> TLSSessionCache:
+    ctx = TLSSessionCache(ssl.PROTOCOL_TLS_CLIENT)
+    if cafile:
+        ctx.load_verify_locations(cafile)
+    else:
+        ctx.load_default_certs()
+    return ctx
+
+_tls_context = None  # dùng chung cho mọi lần nối wss (giữ cache session)
+
+def signaling_tls() -> TLSSessionCache:
+    global _tls_context
+    if _tls_context is None:
+        _tls_context = tls_client_context(SIGNALING_CA_FILE)
+    return _tls_context
+
+# ===== kênh signaling P2P: data channel dành riêng =====
+SIGNALING_CHANNEL = "signaling"
+SIGNALING_CHANNEL_ID = 1000  # negotiated: hai phía tự tạo cùng id trước offer đầu tiên, không cần DCEP
+
+class PeerSignaling:
+    """
+    Data channel "signaling" (negotiated, id cố định) mà publisher và viewer cùng tạo trước offer đầu tiên.
+    Khi peer connection đã thông, offer/answer/candidate gửi cho chính peer đang kết nối (renegotiate,
+    ICE restart) đi thẳng P2P qua kênh này, websocket chỉ là đường dự phòng: không phải vòng qua
+    signaling server trên internet, và server sập thì vẫn renegotiate được.
+    """
+    def __init__(self, pc: RTCPeerConnection, role: str, p2p: bool = True):
+        self.pc = pc
+        self.role = role
+        self.p2p = p2p  # False: luôn đi websocket (để so sánh)
+        self.channel = pc.createDataChannel(SIGNALING_CHANNEL, negotiated=True, id=SIGNALING_CHANNEL_ID)
+        self.peer = None  # peer id phía bên kia (biết sau offer/answer đầu tiên)
+        self.ws = None  # websocket hiện tại, None khi đang rớt
+        self.handler = None  # async handler(msg), signaling_loop_pro gán (dùng chung với message từ websocket)
+        self.recovery = None  # IceRecovery nếu có, nhận message "ice-restart"
+        self.path_ok = True  # False khi đường ICE đang đứt: lúc đó data channel cũng không đi được
+        self.sent = {"p2p": 0, "ws": 0}
+
+        @self.channel.on("message")
+        def on_message(raw):
+            msg = json.loads(raw)
+            msg["from"] = self.peer  # kênh chỉ nối hai peer
+            if self.handler:
+                asyncio.ensure_future(self.handler(msg))
+
+    def direct(self, to) -> bool:
+        return (self.p2p and self.path_ok and to is not None and to == self.peer
+                and self.channel.readyState == "open")
+
+    async def send(self, msg: dict):
+        """Gửi qua data channel nếu tới đúng peer đang kết nối và kênh đang mở, không thì qua websocket."""
+        if self.direct(msg.get("to")):
+            self.channel.send(json.dumps(msg))
+            self.sent["p2p"] += 1
+        elif self.ws is not None:
+            await send_signal(self.ws, msg)
+            self.sent["ws"] += 1
+        else:
+            raise ConnectionError("no signaling server and no direct channel")
+
+    async def renegotiate(self) -> bool:
+        """
+        Publisher: offer mới cho peer đang kết nối. Viewer: nhờ publisher offer lại ({"type": "renegotiate"}).
+        Trả về False nếu chưa có peer hoặc đang dở một lượt offer/answer.
+        """
+        if self.peer is None or self.pc.signalingState != "stable":
+            return False
+        if self.role == "publisher":
+            offer = await self.pc.createOffer()
+            await self.pc.setLocalDescription(offer)
+            await self.send({
+                "type": "offer",
+                "to": self.peer,
+                "sdp": self.pc.localDescription.sdp,
+                "sdpType": self.pc.localDescription.type,
+                "renegotiate": True,  # SDP có thể y hệt lần trước, viewer vẫn phải trả lời
+            })
+        else:
+            await self.send({"type": "renegotiate", "to": self.peer})
+        return True
+
+# ===== ICE restart thay vì dựng lại peer connection =====
+def ice_transport(pc: RTCPeerConnection):
+    """RTCIceTransport của pc (BUNDLE: mọi track và data channel đi chung một transport)."""
+    if pc.sctp is not None:
+        return pc.sctp.transport.transport
+    for transceiver in pc.getTransceivers():
+        if transceiver.receiver.transport is not None:
+            return transceiver.receiver.transport.transport
+    return None
+
+# IceRecovery thay Connection của aioice dưới RTCIceTransport: dựa vào thuộc tính private, chỉ bật trên bản đã thử
+ICE_RESTART_VERSIONS = {"aiortc": "1.15.", "aioice": "0.10."}
+
+def ice_restart_supported(pc: RTCPeerConnection) -> bool:
+    """True nếu aiortc / aioice đúng bản đã thử và còn đủ các thuộc tính private mà IceRecovery dùng."""
+    if not (aiortc.__version__.startswith(ICE_RESTART_VERSIONS["aiortc"])
+            and aioice.__version__.startswith(ICE_RESTART_VERSIONS["aioice"])):
+        return False
+    transport = ice_transport(pc)
+    connection = getattr(transport, "_connection", None)
+    return (hasattr(transport, "_send") and isinstance(connection, Connection)
+            and all(hasattr(connection, name) for name in ("_nominated", "_queue", "_query_consent_task",
+                                                           "_use_ipv4", "_use_ipv6", "_transport_policy")))
+
+class IceRecovery:
+    """
+    Khôi phục kết nối theo từng bậc, chỉ dựng lại RTCPeerConnection khi hỏng hẳn:
+      connected -> disconnected:  STUN check trên cặp candidate đang dùng lỗi 2 lần liên tiếp
+      disconnected -> connected:  đường thông lại trong `grace` giây (mạng chập chờn) -> không làm gì
+      disconnected -> restarting: ICE restart: gather + check lại candidate, giữ nguyên DTLS/SRTP, track,
+                                  data channel và các task đọc camera / telemetry
+      restarting -> failed:       hết `restarts` lần (mỗi lần tối đa `restart_timeout` giây) -> lost_event.set()
+    aiortc không có ICE restart, cũng không có trạng thái "disconnected" (consent RFC 7675 ~30s mới "failed"),
+    nên làm ở tầng aioice: Connection mới thay chỗ Connection cũ dưới RTCIceTransport đang chạy.
+    Chỉ khi ice_restart_supported(): bản aiortc / aioice khác thì không làm gì, pc "failed" là dựng lại như cũ.
+    Consent freshness vẫn chạy trên Connection đang gửi dữ liệu: hết hạn thì DTLS đóng, pc "failed" -> dựng lại.
+    Phía controlling (bên offer) khởi động restart, phía controlled chỉ gửi {"type": "ice-restart"} nhờ.
+    Candidate mới đi qua PeerSignaling (websocket, vì data channel cũng đang đứt).
+    """
+    def __init__(self, pc: RTCPeerConnection, peer_signal: PeerSignaling, lost_event: asyncio.Event,
+                 check_interval: float = 0.5, grace: float = 2.0, restart_timeout: float = 10.0, restarts: int = 2):
+        self.pc = pc
+        self.signal = peer_signal
+        self.lost_event = lost_event
+        self.check_interval = check_interval
+        self.grace = grace
+        self.restart_timeout = restart_timeout
+        self.restarts = restarts  # 0: bỏ qua ICE restart, hết grace là dựng lại
+        self.state = "new"
+        self.events = []  # (time.monotonic(), state): đo thời gian từng bậc
+        self.down_since = None
+        self.connection = None  # aioice Connection đang gửi dữ liệu
+        self.queue = None  # hàng đợi nhận mà RTCIceTransport đang đọc (của Connection đầu tiên)
+        self.created = []  # Connection do restart tạo ra, đóng khi pc đóng
+        self.answer = None  # Future: tham số ICE mới của phía controlled
+        self.pending = None  # Future: restart mà phía controlled đã nhờ
+        self.watch_task = None
+        self.recover_task = None
+        self.answer_task = None
+        peer_signal.recovery = self
+
+        @pc.on("connectionstatechange")
+        def on_state():
+            if pc.connectionState == "connected" and self.watch_task is None:
+                self.watch_task = asyncio.ensure_future(self._watch())
+            elif pc.connectionState in ("failed", "closed"):
+                self.stop()
+
+    def _set(self, state: str):
+        if state != self.state:
+            self.state = state
+            self.events.append((time.monotonic(), state))
+            print(f"[{self.signal.role}] ice path: {state}")
+
+    def stop(self):
+        for task in (self.watch_task, self.recover_task, self.answer_task):
+            if task is not None:
+                task.cancel()
+        for connection in list(self.created):
+            asyncio.ensure_future(self._discard(connection))
+
+    async def _discard(self, connection):
+        """Đóng Connection do restart tạo ra. Tách hàng đợi trước: đóng socket đẩy None vào hàng đợi, DTLS đọc phải là đứt."""
+        if connection in self.created:
+            self.created.remove(connection)
+        connection._queue = asyncio.Queue()
+        await connection.close()
+
+    async def _check(self, connection) -> bool:
+        """Một STUN binding request (không gửi lại) trên cặp candidate đã chọn."""
+        pair = connection._nominated.get(1)
+        if pair is None:
+            return False
+        request = connection.build_request(pair, nominate=False)
+        try:
+            await asyncio.wait_for(pair.protocol.request(
+                request, pair.remote_addr,
+                integrity_key=connection.remote_password.encode("utf8"),
+                retransmissions=0,
+            ), self.check_interval * 2)
+            return True
+        except (TransactionError, asyncio.TimeoutError, ConnectionError, OSError):
+            return False
+
+    async def _watch(self):
+        if not ice_restart_supported(self.pc):
+            print(f"[{self.signal.role}] ICE restart off: aiortc {aiortc.__version__} / aioice {aioice.__version__} "
+                  f"not {ICE_RESTART_VERSIONS}, rebuild on failed")
+            return
+        transport = ice_transport(self.pc)
+        self.connection = transport._connection
+        self.queue = self.connection._queue
+        self._set("connected")
+        failures = 0
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if any(task is not None and not task.done() for task in (self.recover_task, self.answer_task)):
+                continue
+            if await self._check(self.connection):
+                failures = 0
+                if self.state != "connected":
+                    self._connected()
+                continue
+            failures += 1
+            if self.down_since is None:
+                if failures >= 2:
+                    self.down_since = time.monotonic()
+                    self.signal.path_ok = False
+                    self._set("disconnected")
+            elif time.monotonic() - self.down_since >= self.grace:
+                if not await self._recover():
+                    return
+                failures = 0
+
+    def _connected(self):
+        self.down_since = None
+        self.signal.path_ok = True
+        self._set("connected")
+
+    def _recover(self) -> asyncio.Future:
+        if self.recover_task is None or self.recover_task.done():
+            self.recover_task = asyncio.ensure_future(self._recover_loop())
+        return self.recover_task
+
+    async def _recover_loop(self) -> bool:
+        for _ in range(self.restarts):
+            self._set("restarting")
+            try:
+                if self.connection.ice_controlling:
+                    await asyncio.wait_for(self._restart(), self.restart_timeout)
+                else:
+                    self.pending = asyncio.get_running_loop().create_future()
+                    await self.signal.send({"type": "ice-restart", "to": self.signal.peer})
+                    await asyncio.wait_for(self.pending, self.restart_timeout)
+                return True
+            except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+                print(f"[{self.signal.role}] ICE restart failed:", e or "timeout")
+        self._set("failed")
+        self.lost_event.set()
+        return False
+
+    def _new_connection(self):
+        old = self.connection
+        connection = Connection(
+            ice_controlling=old.ice_controlling,
+            stun_server=old.stun_server,
+            turn_server=old.turn_server,
+            turn_username=old.turn_username,
+            turn_password=old.turn_password,
+            turn_ssl=old.turn_ssl,
+            turn_transport=old.turn_transport,
+            use_ipv4=old._use_ipv4,
+            use_ipv6=old._use_ipv6,
+            transport_policy=old._transport_policy,
+        )
+        # dữ liệu nhận trên cặp mới vào thẳng hàng đợi mà RTCIceTransport (DTLS) đang đọc
+        connection._queue = self.queue
+        self.created.append(connection)
+        return connection
+
+    def _params(self, connection, **extra) -> dict:
+        return {
+            "type": "ice-restart",
+            "to": self.signal.peer,
+            "ufrag": connection.local_username,
+            "pwd": connection.local_password,
+            "candidates": [c.to_sdp() for c in connection.local_candidates],
+            **extra,
+        }
+
+    async def _connect(self, connection, msg: dict):
+        connection.remote_username = msg["ufrag"]
+        connection.remote_password = msg["pwd"]
+        for sdp in msg.get("candidates", []):
+            await connection.add_remote_candidate(Candidate.from_sdp(sdp))
+        await connection.add_remote_candidate(None)
+        await connection.connect()  # consent của aioice chạy trên Connection mới
+        # RTCIceTransport giữ Connection cũ (monitor, stop()), chỉ đổi đường gửi
+        ice_transport(self.pc)._send = connection.send
+        retired, self.connection = self.connection, connection
+        if retired in self.created:
+            asyncio.ensure_future(self._discard(retired))
+        else:
+            # Connection đầu tiên phải mở tới khi pc đóng (RTCIceTransport đọc qua nó); cặp cũ không còn gửi gì,
+            # consent trên đó sẽ hết hạn và đóng cả transport
+            self._stop_consent(retired)
+        self._connected()
+
+    @staticmethod
+    def _stop_consent(connection):
+        if connection._query_consent_task is not None:
+            connection._query_consent_task.cancel()
+            connection._query_consent_task = None
+
+    async def _restart(self):
+        """Phía controlling: gather candidate mới, gửi cho peer, chờ candidate của peer rồi check."""
+        connection = self._new_connection()
+        try:
+            await connection.gather_candidates()
+            self.answer = asyncio.get_running_loop().create_future()
+            self.signal.path_ok = False
+            await self.signal.send(self._params(connection))
+            await self._connect(connection, await self.answer)
+        except BaseException:
+            if connection is not self.connection:
+                await self._discard(connection)
+            raise
+
+    async def _answer_restart(self, msg: dict):
+        """Phía controlled: trả candidate mới rồi check với candidate của phía controlling."""
+        self._set("restarting")
+        self.signal.path_ok = False
+        connection = self._new_connection()
+        try:
+            await connection.gather_candidates()
+            await self.signal.send(self._params(connection, answer=True))
+            await asyncio.wait_for(self._connect(connection, msg), self.restart_timeout)
+            if self.pending is not None and not self.pending.done():
+                self.pending.set_result(True)
+        except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+            print(f"[{self.signal.role}] ICE restart failed:", e or "timeout")
+            await self._discard(connection)
+
+    async def on_message(self, msg: dict):
+        """{"type": "ice-restart"} từ peer: yêu cầu (không có ufrag), tham số mới, hoặc trả lời (answer)."""
+        if msg.get("from") != self.signal.peer or self.connection is None:
+            return
+        if "ufrag" not in msg:
+            if self.connection.ice_controlling:
+                self.signal.path_ok = False
+                self._recover()
+        elif msg.get("answer"):
+            if self.answer is not None and not self.answer.done():
+                self.answer.set_result(msg)
+        elif not self.connection.ice_controlling:
+            self.answer_task = asyncio.ensure_future(self._answer_restart(msg))
+
+# ===== DNS của STUN/TURN dùng lại giữa các lần dựng peer connection =====
+ICE_URL_REGEX = re.compile(r"(?P<scheme>stuns?|turns?):(?P<host>[^?:]+)(:(?P<port>[0-9]+))?(\?transport=(?P<transport>.*))?")  # như aiortc.rtcicetransport
+class IceServerCache:
+    """
+    ice_servers với tên miền STUN/TURN đã phân giải sẵn ra IP, làm mới trong nền mỗi `ttl` giây.
+    Không có cache thì aioice gethostbyname lại mỗi lần gather (STUN: mỗi interface một lần, TURN: mỗi peer
+    connection). turns:/stuns: giữ nguyên tên miền (TLS cần tên để kiểm tra chứng chỉ).
+    Phân giải lỗi thì giữ IP cũ, chưa có IP nào thì để tên miền cho aioice tự phân giải.
+    """
+    def __init__(self, ice_servers: list = None, ttl: float = 300):
+        self.ice_servers = ice_servers if ice_servers is not None else RTCIceGatherer.getDefaultIceServers()
+        self.ttl = ttl
+        self.addresses = {}  # tên miền -> IP
+        self._servers = self.ice_servers
+        self.task = None
+
+    def _hosts(self) -> set:
+        hosts = set()
+        for server in self.ice_servers:
+            for url in ([server.urls] if isinstance(server.urls, str) else server.urls):
+                match = ICE_URL_REGEX.fullmatch(url)
+                if match and match["scheme"] in ("stun", "turn"):
+                    try:
+                        ipaddress.ip_address(match["host"])
+                    except ValueError:
+                        hosts.add(match["host"])
+        return hosts
+
+    async def refresh(self):
+        loop = asyncio.get_running_loop()
+        for host in self._hosts():
+            try:
+                infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+                self.addresses[host] = infos[0][4][0]
+            except OSError as e:
+                print(f"[dns] cannot resolve {host}:", e)
+        self._servers = [RTCIceServer(urls=[self._url(url) for url in ([s.urls] if isinstance(s.urls, str) else s.urls)],
+                                      username=s.username, credential=s.credential, credentialType=s.credentialType)
+                         for s in self.ice_servers]
+
+    def start(self):
+        async def loop():
+            while True:
+                await asyncio.sleep(self.ttl)
+                await self.refresh()
+        if self.task is None and self._hosts():
+            self.task = asyncio.ensure_future(loop())
+
+    def _url(self, url: str) -> str:
+        match = ICE_URL_REGEX.fullmatch(url)
+        if not match or match["scheme"] not in ("stun", "turn") or match["host"] not in self.addresses:
+            return url
+        start, end = match.span("host")
+        return url[:start] + self.addresses[match["host"]] + url[end:]
+
+    @property
+    def servers(self) -> list:
+        return self._servers
+
+# ===== pool peer connection "ấm" cho publisher =====
+class PeerConnectionPool:
+    """
+    Giữ sẵn `size` peer connection đã có local offer: track / data channel đã gắn, candidate đã gather
+    (cả cấp phát TURN) -> viewer vào là gửi offer ngay, không chờ createOffer + gather.
+    factory(): tạo (pc, ...) chưa offer, phần tử đầu là RTCPeerConnection; mọi thứ phải có trong SDP
+    (track, data channel, codec) tạo trong factory. Allocation TURN được aioice tự refresh khi pc còn mở;
+    pc nằm quá `max_age` giây thì thay pc mới (NAT mapping của candidate srflx có thể đã hết hạn).
+    """
+    def __init__(self, factory, size: int = 1, max_age: float = 60.0):
+        self.factory = factory
+        self.size = size
+        self.max_age = max_age
+        self.ready = []  # (time.monotonic() lúc ấm, item), cũ trước
+        self.taken = asyncio.Event()
+        self.added = asyncio.Event()
+        self.filling = False  # đang làm ấm một pc
+        self.task = None
+        self.stats = {"warm": 0, "cold": 0, "expired": 0}
+
+    def start(self):
+        if self.size > 0 and (self.task is None or self.task.done()):
+            self.filling = not self.ready
+            self.task = asyncio.ensure_future(self._fill())
+
+    async def _warm(self):
+        item = self.factory()
+        pc = item[0]
+        offer = await pc.createOffer()
+        await pc.setLocalDescription(offer)  # gather host / srflx / relay ở đây
+        return item
+
+    async def _expire(self):
+        while self.ready and time.monotonic() - self.ready[0][0] > self.max_age:
+            _, item = self.ready.pop(0)
+            self.stats["expired"] += 1
+            await item[0].close()
+
+    async def _fill(self):
+        while True:
+            await self._expire()
+            if len(self.ready) < self.size:
+                self.filling = True
+                try:
+                    item = await self._warm()
+                except Exception as e:
+                    print("[pool] warm-up failed:", e)
+                    self.filling = False
+                    self.added.set()
+                    await asyncio.sleep(1)
+                    continue
+                self.filling = False
+                self.ready.append((time.monotonic(), item))
+                self.added.set()
+                continue
+            # đủ rồi: chờ có pc bị lấy đi hoặc pc cũ nhất hết hạn
+            self.taken.clear()
+            try:
+                await asyncio.wait_for(self.taken.wait(), self.ready[0][0] + self.max_age - time.monotonic() + 0.1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def get(self, warm: bool = True):
+        """
+        (pc, ...) ấm nếu có, không thì dựng ngay như khi không có pool. pc ở trạng thái "have-local-offer".
+        warm=False: pc mới từ factory, chưa offer, để trả lời offer của viewer (WHEP).
+        """
+        if not warm:
+            self.stats["cold"] += 1
+            return self.factory()
+        self.start()
+        await self._expire()
+        while not self.ready and self.filling:
+            # pc đang ấm dở: chờ nó thay vì gather thêm một lần nữa
+            self.added.clear()
+            await self.added.wait()
+        self.taken.set()
+        if self.ready:
+            self.stats["warm"] += 1
+            return self.ready.pop()[1]  # mới nhất
+        self.stats["cold"] += 1
+        return await self._warm()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        while self.ready:
+            await self.ready.pop()[1][0].close()
+
 # ===== giữ kết nối với signaling server pro =====
+_identities = {}  # (role, stream) -> peer id của tiến trình này
+
+def peer_identity(role: str, stream: str = "") -> str:
+    """
+    Peer id duy nhất trong phòng: "<role>-<hostname>-<ngẫu nhiên>", sinh một lần cho mỗi tiến trình
+    nên các lần dựng lại peer connection / nối lại vẫn giữ id cũ (resume token gắn với id).
+    Trước đây id chính là role: drone thứ hai vào phòng sẽ đá drone thứ nhất ra.
+    """
+    key = (role, stream)
+    if key not in _identities:
+        _identities[key] = f"{role}-{socket.gethostname()}-{os.urandom(3).hex()}"
+    return _identities[key]
+
 async def signaling_loop_pro(pc: RTCPeerConnection,
                              lost_event: asyncio.Event,
                              on_icecandidate,
                              role: str,
                              timeout: int,
-                             signaling_server: str
+                             signaling_server: str,
+                             peer_signal: PeerSignaling = None,
+                             room: str = "home",
+                             peer_id: str = None,
+                             stream: str = "",
+                             handoff: dict = None
     ):
     """
     Trao đổi SDP/ICE
     Loop để duy trì kết nối với signaling server pro.
     Nếu WS rớt thì tự động reconnect.
+    peer_signal: kênh signaling P2P (tạo sẵn nếu muốn gọi renegotiate() từ ngoài),
+    phải có trước offer đầu tiên nên mặc định tạo ở đây.
+    room / stream: một phòng chứa nhiều publisher và viewer; publisher gửi luồng `stream`,
+    viewer chỉ gặp publisher có cùng stream (viewer để stream trống thì gặp mọi publisher).
+    peer_id: mặc định peer_identity(role, stream).
+    handoff: dict giữ qua các lần dựng lại (publisher). Viewer gửi offer (WHEP) lúc pc đang giữ offer chưa ai
+    trả lời (pc ấm từ pool, offer cho bootstrap cache) -> aiortc không rollback được: lưu offer vào
+    handoff["offer"] rồi set lost_event; lần dựng sau lấy pc chưa offer và trả lời nó ngay khi vào phòng.
     """
-    ROOM = "home"
-    url = f"{signaling_server}?room={ROOM}&peer={role}"
-    print(f"[{role}] connecting to signaling {url}")
+    peer_id = peer_id or peer_identity(role, stream)
+    # role=publisher/viewer: server chỉ báo join/leave của phía bên kia (cùng stream)
+    params = {"room": room, "peer": peer_id, "role": role}
+    if stream:
+        params["stream"] = stream
+    query = "?" + urllib.parse.urlencode(params)
+    print(f"[{role}] connecting to signaling {signaling_server}{query}")
+    # nhiều node signaling (consistent hashing theo room): node không giữ phòng trả
+    # {"type": "redirect", "url": ...} -> nối sang node đó, lần sau nối thẳng
+    server = signaling_server
+    redirect_url = None
+    redirects = 0
+    # server bật RESUME_GRACE: giữ chỗ vài giây sau khi WS rớt, nối lại kèm token
+    # thì phía bên kia không nhận peer-left và không phải dựng lại peer connection
+    resume_token = None
+    resume_grace = 0.0
+    dropped_at = None  # lúc WS rớt (time.monotonic)
+    failures = 0  # số lần nối liên tiếp không vào được phòng
+    reconnect_after = None  # server đang drain gửi {"type": "reconnect", "after": s}
+    last_offer_sdp = None  # viewer: offer đã nhận (server có thể gửi offer cache trước)
+    answered = set()  # publisher: viewer đã trả lời (có thể trước cả peer-joined nhờ cache)
+    # một peer connection chỉ nối với một peer: peer_signal.peer là peer đang kết nối,
+    # offered là viewer đang chờ answer ("*": offer nằm ở bootstrap cache)
+    offered = None
+    present = set()  # peer phía bên kia đang ở trong phòng (theo peers / presence)
+    if peer_signal is None:
+        peer_signal = PeerSignaling(pc, role)
+    negotiating = asyncio.Lock()  # message từ websocket và từ data channel xử lý lần lượt
+
+    async def make_offer():
+        """Tạo offer, trừ khi pc đã có sẵn (pc ấm từ PeerConnectionPool, offer chưa ai trả lời) thì dùng lại."""
+        if pc.signalingState != "have-local-offer":
+            offer = await pc.createOffer()
+            await pc.setLocalDescription(offer)
+
+    async def on_peer_joined(peer):
+        nonlocal offered
+        print(f"[{role}] Peer joined: {peer}")
+        present.add(peer)
+        async with negotiating:
+            if peer in answered:
+                pass
+            elif role == "publisher" and peer_signal.peer is not None and peer_signal.peer in present:
+                print(f"[{role}] busy with {peer_signal.peer}, not offering to {peer}")
+            elif role == "publisher" and pc.signalingState == "have-local-offer":
+                if offered not in (None, "*") and offered in present:
+                    return  # viewer trước vẫn có thể trả lời
+                # offer gửi trước (cho "*" hoặc viewer đã đi) chưa ai trả lời -> gửi lại cho viewer mới
+                offered = peer
+                await peer_signal.send({
+                    "type": "offer",
+                    "to": peer,
+                    "sdp": pc.localDescription.sdp,
+                    "sdpType": pc.localDescription.type,
+                })
+            elif role == "publisher" and pc.signalingState == "stable":
+                # khi có viewer mới -> gửi offer
+                print("creating offer")
+                offer = await pc.createOffer()
+                print("created offer")
+                await pc.setLocalDescription(offer)
+                print("set offer")
+                offered = peer
+                await peer_signal.send({
+                    "type": "offer",
+                    "to": peer,
+                    "sdp": pc.localDescription.sdp,
+                    "sdpType": pc.localDescription.type,
+                })
+                print("sent offer")
+
+    async def on_negotiation(msg):
+        """offer / answer / candidate / renegotiate / ice-restart, đến từ websocket hay data channel đều vào đây."""
+        nonlocal last_offer_sdp, offered
+        t = msg.get("type")
+        async with negotiating:
+            if t == "offer" and role == "viewer":
+                frm = msg["from"]
+                print(f"[viewer] got offer from {frm}")
+                if peer_signal.peer is not None and frm != peer_signal.peer:
+                    print(f"[viewer] already watching {peer_signal.peer}, ignoring offer from {frm}")
+                    return
+                if msg["sdp"] == last_offer_sdp and not msg.get("renegotiate"):
+                    return  # cùng offer đã xử lý (cache + publisher gửi lại)
+                last_offer_sdp = msg["sdp"]
+                peer_signal.peer = frm
+                offer = RTCSessionDescription(sdp=msg["sdp"], type=msg["sdpType"])
+                await pc.setRemoteDescription(offer)
+                answer = await pc.createAnswer()
+                await pc.setLocalDescription(answer)
+                await peer_signal.send({
+                    "type": "answer",
+                    "to": frm,
+                    "sdp": pc.localDescription.sdp,
+                    "sdpType": pc.localDescription.type,
+                })
+            elif t == "offer" and role == "publisher":
+                # viewer tự gửi offer (WHEP qua server): publisher trả lời
+                frm = msg["from"]
+                print(f"[publisher] got offer from {frm}")
+                if pc.signalingState == "stable" and frm == peer_signal.peer and msg["sdp"] == last_offer_sdp:
+                    # server gửi lại offer đã trả lời (publisher vừa vào lại phòng): gửi lại answer
+                    await peer_signal.send({
+                        "type": "answer",
+                        "to": frm,
+                        "sdp": pc.localDescription.sdp,
+                        "sdpType": pc.localDescription.type,
+                    })
+                    return
+                if pc.signalingState != "stable":
+                    if offered not in (None, "*", frm) and offered in present:
+                        print(f"[publisher] waiting for {offered} to answer, ignoring offer from {frm}")
+                        return
+                    # offer của mình chưa ai trả lời: bỏ pc này, trả lời trên pc mới (aiortc không rollback được)
+                    print("[publisher] dropping unanswered offer, answering on a fresh peer connection")
+                    if handoff is not None:
+                        handoff["offer"] = msg
+                    lost_event.set()
+                    return
+                answered.add(frm)
+                last_offer_sdp = msg["sdp"]
+                peer_signal.peer = frm
+                offer = RTCSessionDescription(sdp=msg["sdp"], type=msg.get("sdpType", "offer"))
+                await pc.setRemoteDescription(offer)
+                answer = await pc.createAnswer()
+                await pc.setLocalDescription(answer)
+                await peer_signal.send({
+                    "type": "answer",
+                    "to": frm,
+                    "sdp": pc.localDescription.sdp,
+                    "sdpType": pc.localDescription.type,
+                })
+            elif t == "answer" and role == "publisher":
+                frm = msg.get("from")
+                print(f"[publisher] got answer from {frm}")
+                if pc.signalingState != "have-local-offer" or (offered != "*" and frm not in (offered, peer_signal.peer)):
+                    print(f"[publisher] no offer pending for {frm}, ignoring answer")
+                    return
+                answered.add(frm)
+                peer_signal.peer = frm
+                offered = None
+                answer = RTCSessionDescription(sdp=msg["sdp"], type=msg["sdpType"])
+                await pc.setRemoteDescription(answer)
+            elif t == "renegotiate" and role == "publisher":
+                # viewer nhờ offer lại
+                if msg.get("from") == peer_signal.peer:
+                    await peer_signal.renegotiate()
+            elif t == "ice-restart":
+                if peer_signal.recovery is not None:
+                    await peer_signal.recovery.on_message(msg)
+            elif t == "candidate":
+                try:
+                    # cand = {
+                    #     "candidate": msg["candidate"],
+                    #     "sdpMid": msg.get("sdpMid"),
+                    #     "sdpMLineIndex": msg.get("sdpMLineIndex"),
+                    # }
+                    cand = candidate_from_sdp(msg["candidate"].split("\n")[0])
+                    await pc.addIceCandidate(cand)
+                except Exception as e:
+                    print("Failed to add ICE:", e)
+
+    def on_peers_left(peers):
+        """Chỉ dựng lại peer connection khi peer đang kết nối (hoặc đang chờ answer) rời phòng."""
+        present.difference_update(peers)
+        answered.difference_update(peers)
+        if any(p is not None and p in (peer_signal.peer, offered) for p in peers):
+            lost_event.set()
+
+    peer_signal.handler = on_negotiation
     while True:
+        url = server + query
+        if resume_token and dropped_at is not None:
+            url += f"&resume={resume_token}&gap={time.monotonic() - dropped_at:.3f}"
+        # wss: dùng context có cache TLS session -> reconnect bắt tay rút gọn
+        tls = {"ssl": signaling_tls()} if url.startswith("wss://") else {}
+        connect_started = time.monotonic()
         try:
-            async with websockets.connect(url, ping_interval=None, close_timeout=timeout) as ws:
+            async with websockets.connect(url, ping_interval=None, close_timeout=timeout, subprotocols=[SUBPROTOCOL], **tls) as ws:
                 # gắn ws vào on_icecandidate để gửi ICE
                 on_icecandidate.ws = ws
-
+                peer_signal.ws = ws
                 async for raw in ws:
                     try:
-                        msg = json.loads(raw)
+                        msg = parse_signal(raw)
                     except Exception:
                         print(f"[{role}] Bad signaling msg:", raw)
                         continue
 
                     t = msg.get("type")
                     if t == "peers":
+                        if tls:
+                            resumed = signaling_tls().remember(ws)
+                            print(f"[{role}] joined in {(time.monotonic() - connect_started) * 1000:.0f} ms, "
+                                  f"TLS {'resumed' if resumed else 'full handshake'}")
+                        resume_token = msg.get("resume")
+                        resume_grace = msg.get("resume_grace", 0.0)
+                        if msg.get("resumed"):
+                            # vẫn giữ chỗ cũ: message gửi tới trong lúc rớt sẽ được server gửi lại
+                            print(f"[{role}] signaling resumed after {time.monotonic() - dropped_at:.2f}s, keeping peer connection")
+                            dropped_at = None
+                            failures = 0
+                            continue
+                        if dropped_at is not None and pc.connectionState == "connected":
+                            # server mất một lúc nhưng peer connection vẫn chạy (renegotiate đi P2P): giữ nguyên
+                            print(f"[{role}] signaling back after {time.monotonic() - dropped_at:.2f}s, peer connection still up")
+                            dropped_at = None
+                            failures = 0
+                            continue
+                        dropped_at = None
+                        failures = 0
+                        redirects = 0
+                        last_offer_sdp = None
+                        answered.clear()
+                        offered = None
                         peers = msg.get("peers", [])
-                        print(f"[{role}] peers in room: {peers}")
-                        # Publisher -> gửi offer tới peer đầu tiên
-                        if role == "publisher" and peers:
-                            target = peers[0]
-                            offer = await pc.createOffer()
-                            await pc.setLocalDescription(offer)
-                            await ws.send(json.dumps({
-                                "type": "offer",
-                                "to": target,
-                                "sdp": pc.localDescription.sdp,
-                                "sdpType": pc.localDescription.type,
-                            }))
-                            print("sent offer")
+                        present.clear()
+                        present.update(peers)
+                        streams = msg.get("streams")
+                        print(f"[{role}] peers in room: {peers}" + (f", streams: {streams}" if streams else ""))
+                        pending = handoff.pop("offer", None) if handoff else None
+                        if pending is not None:
+                            # offer của viewer đến pc trước: trả lời trên pc này, không offer nữa
+                            await on_negotiation(pending)
+                            continue
+                        async with negotiating:
+                            # Publisher -> gửi offer tới peer đầu tiên (server chỉ đưa viewer cùng stream)
+                            if role == "publisher" and peers:
+                                target = offered = peers[0]
+                                await make_offer()
+                                await peer_signal.send({
+                                    "type": "offer",
+                                    "to": target,
+                                    "sdp": pc.localDescription.sdp,
+                                    "sdpType": pc.localDescription.type,
+                                })
+                                print("sent offer")
+                            # server có bootstrap cache: tạo offer sẵn, viewer vào sau nhận ngay
+                            elif role == "publisher" and msg.get("bootstrap") and pc.signalingState in ("stable", "have-local-offer"):
+                                await make_offer()
+                                offered = "*"
+                                await peer_signal.send({
+                                    "type": "offer",
+                                    "to": "*",
+                                    "sdp": pc.localDescription.sdp,
+                                    "sdpType": pc.localDescription.type,
+                                })
+                                print("sent offer to bootstrap cache")
                     elif t == "peer-joined":
-                        peer = msg["peer"]
-                        print(f"[{role}] Peer joined: {peer}")
-                        if role == "publisher" and pc.signalingState == "stable":
-                            # khi có viewer mới -> gửi offer
-                            print("creating offer")
-                            offer = await pc.createOffer()
-                            print("created offer")
-                            await pc.setLocalDescription(offer)
-                            print("set offer")
-                            await ws.send(json.dumps({
-                                "type": "offer",
-                                "to": peer,
-                                "sdp": pc.localDescription.sdp,
-                                "sdpType": pc.localDescription.type,
-                            }))
-                            print("sent offer")
-                    elif t == "offer" and role == "viewer":
-                        frm = msg["from"]
-                        print(f"[viewer] got offer from {frm}")
-                        offer = RTCSessionDescription(sdp=msg["sdp"], type=msg["sdpType"])
-                        await pc.setRemoteDescription(offer)
-                        answer = await pc.createAnswer()
-                        await pc.setLocalDescription(answer)
-                        await ws.send(json.dumps({
-                            "type": "answer",
-                            "to": frm,
-                            "sdp": pc.localDescription.sdp,
-                            "sdpType": pc.localDescription.type,
-                        }))
-                    elif t == "answer" and role == "publisher":
-                        print("[publisher] got answer")
-                        answer = RTCSessionDescription(sdp=msg["sdp"], type=msg["sdpType"])
-                        await pc.setRemoteDescription(answer)
-                    elif t == "candidate":
-                        try:
-                            # cand = {
-                            #     "candidate": msg["candidate"],
-                            #     "sdpMid": msg.get("sdpMid"),
-                            #     "sdpMLineIndex": msg.get("sdpMLineIndex"),
-                            # }
-                            cand = candidate_from_sdp(msg["candidate"].split("\n")[0])
-                            await pc.addIceCandidate(cand)
-                        except Exception as e:
-                            print("Failed to add ICE:", e)
+                        await on_peer_joined(msg["peer"])
+                    elif t == "presence":
+                        # nhiều join/leave gộp trong một cửa sổ: xử lý "left" trước rồi "joined"
+                        if msg.get("left"):
+                            print(f"[{role}] peer-left: {msg['left']}")
+                            on_peers_left(msg["left"])
+                        for peer in msg.get("joined", []):
+                            await on_peer_joined(peer)
+                    elif t in ("offer", "answer", "candidate", "renegotiate", "ice-restart"):
+                        await on_negotiation(msg)
                     elif t == "peer-left":
                         print(f"[{role}] peer-left: {msg['peer']}")
-                        lost_event.set()
+                        on_peers_left([msg["peer"]])
+                    elif t == "redirect":
+                        redirect_url = msg["url"]
+                        print(f"[{role}] room is on {redirect_url}, redirecting")
+                        break
+                    elif t == "reconnect":
+                        # server sắp restart: nối lại sau thời gian server chỉ định (đã có jitter)
+                        reconnect_after = float(msg.get("after", 0))
+                        print(f"[{role}] server draining, reconnect in {reconnect_after}s")
                     elif t == "error":
                         print(f"[{role}] signaling error:", msg)
                         lost_event.set()
@@ -162,11 +935,83 @@ async def signaling_loop_pro(pc: RTCPeerConnection,
                         pass
         except Exception as e:
             print(f"[{role}] Signaling loop error:", e)
+        peer_signal.ws = None  # WS rớt: chỉ còn đường P2P
 
-        # đợi vài giây rồi thử reconnect lại signaling server
-        await asyncio.sleep(timeout)
+        if redirect_url:
+            server, redirect_url = redirect_url, None
+            resume_token = None  # token chỉ có giá trị ở node đã cấp
+            redirects += 1
+            if redirects <= MAX_REDIRECTS:
+                continue
+            print(f"[{role}] too many redirects, back to {signaling_server}")
+            server, redirects = signaling_server, 0
+        if dropped_at is None:
+            dropped_at = time.monotonic()
+        if reconnect_after is not None:
+            await asyncio.sleep(reconnect_after)
+            reconnect_after = None
+            continue
+        # chờ theo backoff có jitter rồi thử reconnect lại signaling server
+        failures += 1
+        remaining = resume_grace - (time.monotonic() - dropped_at) if resume_token else 0.0
+        if remaining > 0:
+            # server còn giữ chỗ: vẫn backoff có jitter (không cả đàn client thử cùng nhịp), nhưng không chờ quá hạn giữ chỗ
+            await asyncio.sleep(min(reconnect_delay(failures, timeout), remaining))
+            continue
+        resume_token = None
+        if failures >= 2 and server != signaling_server:
+            server = signaling_server  # node được redirect tới không vào được: hỏi lại node ban đầu
+        await asyncio.sleep(reconnect_delay(failures, timeout))
         
         
+# ===== WHIP / WHEP: một request HTTP thay cho websocket =====
+def http_request(method: str, url: str, body: str = "", headers: dict = None, timeout: float = 15):
+    """Gửi một request (blocking, chạy trong executor). Trả về (status, headers, body)."""
+    req = urllib.request.Request(url, data=body.encode() if body else None, method=method, headers=headers or {})
+    context = signaling_tls() if url.startswith("https://") else None
+    try:
+        with urllib.request.urlopen(req, timeout=timeout, context=context) as r:
+            return r.status, r.headers, r.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read().decode()
+
+async def whip_whep_loop(pc: RTCPeerConnection,
+                         lost_event: asyncio.Event,
+                         url: str,
+                         role: str
+    ):
+    """
+    Signaling qua WHIP (publisher, url .../whip/<room>) hoặc WHEP (viewer, url .../whep/<room>):
+    POST offer -> nhận answer trong response, 1 round trip. aiortc gom xong ICE trong
+    setLocalDescription nên offer đã có đủ candidate (không cần PATCH trickle).
+    Chờ lost_event rồi DELETE phiên. Lỗi / hết giờ thì set lost_event để dựng lại.
+    """
+    loop = asyncio.get_running_loop()
+    offer = await pc.createOffer()
+    await pc.setLocalDescription(offer)
+    started = time.monotonic()
+    try:
+        status, headers, answer = await loop.run_in_executor(
+            None, http_request, "POST", url, pc.localDescription.sdp, {"Content-Type": "application/sdp"})
+    except OSError as e:
+        print(f"[{role}] {url} unreachable:", e)
+        lost_event.set()
+        return
+    if status != 201:
+        print(f"[{role}] {url} -> {status} {answer.strip()}")
+        lost_event.set()
+        return
+    session_url = urllib.parse.urljoin(url, headers["Location"])
+    print(f"[{role}] answer in {(time.monotonic() - started) * 1000:.0f} ms, session {session_url}")
+    await pc.setRemoteDescription(RTCSessionDescription(sdp=answer, type="answer"))
+    try:
+        await lost_event.wait()
+    finally:
+        try:
+            await loop.run_in_executor(None, http_request, "DELETE", session_url, "", None, 5)
+        except OSError:
+            pass
+
 # ====== Gửi ping - chờ pong ======
 async def heartbeat_task(channel, lost_event: asyncio.Event):
     ping_count = 0
@@ -196,29 +1041,343 @@ async def heartbeat_task(channel, lost_event: asyncio.Event):
 
 ##### CÁC HÀM DÀNH CHO PUBLISHER #####
 
+# ====== UART không chặn event loop ======
+class SerialTransport:
+    """
+    Cổng serial gắn thẳng vào event loop (add_reader / add_writer trên fd của tty), không đọc từng byte.
+    Đọc: mỗi lần fd sẵn sàng đọc một lượt tới READ_SIZE byte, read() trả hết những gì đang có.
+    Chưa ai lấy mà đã quá max_read_buffer thì ngừng đọc -> buffer của kernel đầy, có rtscts thì
+    RTS hạ xuống và autopilot tự dừng gửi (không mất byte giữa chừng).
+    Ghi: write() không chặn, phần chưa ghi được nằm trong hàng đợi và ghi tiếp khi fd sẵn sàng;
+    hàng đợi quá write_high thì drain() chờ xuống dưới write_low, quá max_write_buffer thì bỏ lệnh mới.
+    """
+    READ_SIZE = 65536
+
+    def __init__(self, ser: serial.Serial, max_read_buffer: int = 256 * 1024,
+                 write_high: int = 16 * 1024, write_low: int = 4 * 1024, max_write_buffer: int = 256 * 1024):
+        self.ser = ser
+        self.fd = ser.fileno()
+        self.loop = asyncio.get_running_loop()
+        self.max_read_buffer = max_read_buffer
+        self.write_high, self.write_low, self.max_write_buffer = write_high, write_low, max_write_buffer
+        self.rx = bytearray()
+        self.tx = bytearray()
+        self.waiter = None  # future của read() đang chờ dữ liệu
+        self.drained = None  # future của drain() đang chờ hàng đợi ghi vơi đi
+        self.reading = False
+        self.writing = False
+        self.closed = False
+        self.error = None
+        self.stats = {"reads": 0, "rx_bytes": 0, "writes": 0, "tx_bytes": 0, "paused": 0, "tx_dropped": 0}
+        os.set_blocking(self.fd, False)
+        self.resume_reading()
+
+    # ----- đọc -----
+    def resume_reading(self):
+        if not self.reading and not self.closed:
+            self.loop.add_reader(self.fd, self._on_readable)
+            self.reading = True
+
+    def pause_reading(self):
+        if self.reading:
+            self.loop.remove_reader(self.fd)
+            self.reading = False
+            self.stats["paused"] += 1
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.fd, self.READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            data, self.error = b"", e
+        if not data:
+            self.close()  # cổng bị rút (EOF / EIO)
+            return
+        self.rx += data
+        self.stats["reads"] += 1
+        self.stats["rx_bytes"] += len(data)
+        if len(self.rx) >= self.max_read_buffer:
+            self.pause_reading()
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def read(self) -> bytes:
+        """Chờ có dữ liệu rồi trả về tất cả byte đã đọc; cổng đóng thì ConnectionError."""
+        while not self.rx:
+            if self.closed:
+                raise ConnectionError(f"serial port closed: {self.error or 'EOF'}")
+            self.waiter = self.loop.create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        data, self.rx = bytes(self.rx), bytearray()
+        self.resume_reading()
+        return data
+
+    # ----- ghi -----
+    def write(self, data) -> bool:
+        """Ghi không chặn; False nếu hàng đợi đã đầy (lệnh bị bỏ) hoặc cổng đã đóng."""
+        if isinstance(data, str):
+            data = data.encode()
+        if self.closed:
+            return False
+        if len(self.tx) + len(data) > self.max_write_buffer:
+            self.stats["tx_dropped"] += 1
+            return False
+        self.stats["writes"] += 1
+        if not self.tx:
+            try:
+                n = os.write(self.fd, data)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            except OSError as e:
+                self.error = e
+                self.close()
+                return False
+            self.stats["tx_bytes"] += n
+            data = data[n:]
+        if data:
+            self.tx += data
+            if not self.writing:
+                self.loop.add_writer(self.fd, self._on_writable)
+                self.writing = True
+        return True
+
+    def _on_writable(self):
+        try:
+            n = os.write(self.fd, self.tx)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.error = e
+            self.close()
+            return
+        self.stats["tx_bytes"] += n
+        del self.tx[:n]
+        if not self.tx:
+            self.loop.remove_writer(self.fd)
+            self.writing = False
+        if len(self.tx) <= self.write_low and self.drained is not None and not self.drained.done():
+            self.drained.set_result(None)
+
+    async def drain(self):
+        """Chờ tới khi hàng đợi ghi không còn quá write_high (gửi dồn nhiều lệnh thì gọi sau mỗi lệnh)."""
+        while len(self.tx) > self.write_high and not self.closed:
+            self.drained = self.loop.create_future()
+            await self.drained
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.pause_reading()
+        if self.writing:
+            self.loop.remove_writer(self.fd)
+            self.writing = False
+        for fut in (self.waiter, self.drained):
+            if fut is not None and not fut.done():
+                fut.set_result(None)
+        self.ser.close()
+
+# ====== gửi lên data channel có giới hạn hàng đợi ======
+class ChannelSender:
+    """
+    Bọc một data channel: aiortc tự xếp hàng không giới hạn khi SCTP nghẽn (link vệ tinh yếu),
+    nên chỉ giao cho aiortc khi bufferedAmount <= high, phần còn lại giữ ở hàng đợi của mình
+    và gửi tiếp khi kênh báo "bufferedamountlow" (bufferedAmount xuống tới low).
+    send(message, key): key None = phải tới (lệnh, ack): xếp hàng theo thứ tự, hàng đợi quá max_queue
+    byte thì bỏ message mới (overflow); có key = trạng thái: chỉ giữ giá trị mới nhất của mỗi key.
+    split(message) -> [(key, piece)] tách message khi phải xếp hàng (telemetry_protocol.classify),
+    pack_size > 0 thì lúc gửi bù gộp các giá trị trạng thái vào một message tới pack_size byte.
+    Dùng thay channel ở mọi chỗ chỉ cần readyState / send().
+    """
+
+    def __init__(self, channel, high: int = 4 * 1024, low: int = 1024, max_queue: int = 64 * 1024,
+                 split=None, pack_size: int = 0):
+        self.channel = channel
+        self.high, self.max_queue = high, max_queue
+        self.split = split
+        self.pack_size = pack_size
+        self.fifo = collections.deque()  # message phải tới, theo thứ tự
+        self.state = collections.OrderedDict()  # key -> giá trị mới nhất, giữ chỗ của lần đầu
+        self.queued = 0  # byte đang giữ
+        self.stats = {"sent": 0, "queued": 0, "replaced": 0, "dropped": 0, "overflow": 0, "closed": 0}
+        channel.bufferedAmountLowThreshold = low
+        channel.on("bufferedamountlow", self.flush)
+        channel.on("open", self.flush)
+        channel.on("close", self._on_close)
+
+    @property
+    def readyState(self) -> str:
+        return self.channel.readyState
+
+    @property
+    def depth(self) -> int:
+        return len(self.fifo) + len(self.state)
+
+    def send(self, message, key=None) -> bool:
+        """False nếu message bị bỏ (kênh đã đóng, hoặc hàng đợi lệnh đầy)."""
+        state = self.channel.readyState
+        if state in ("closing", "closed"):
+            self.stats["closed"] += 1
+            return False
+        if state == "open" and not self.fifo and not self.state and self.channel.bufferedAmount <= self.high:
+            self._send(message)
+            return True
+        pieces = self.split(message) if self.split else [(key, message)]
+        return all([self._queue(piece, k) for k, piece in pieces])
+
+    def _queue(self, message, key) -> bool:
+        if key is not None and key in self.state:
+            self.queued += len(message) - len(self.state[key])
+            self.state[key] = message
+            self.stats["replaced"] += 1
+            return True
+        # chật thì bỏ trạng thái cũ nhất trước, lệnh không bao giờ bị bỏ khi đã vào hàng
+        while self.queued + len(message) > self.max_queue and self.state:
+            self.queued -= len(self.state.popitem(last=False)[1])
+            self.stats["dropped"] += 1
+        if self.queued + len(message) > self.max_queue:
+            self.stats["overflow" if key is None else "dropped"] += 1
+            return False
+        if key is None:
+            self.fifo.append(message)
+        else:
+            self.state[key] = message
+        self.queued += len(message)
+        self.stats["queued"] += 1
+        return True
+
+    def flush(self):
+        """Giao hàng đợi cho aiortc tới khi bufferedAmount vượt high: lệnh trước, rồi trạng thái."""
+        channel = self.channel
+        while channel.readyState == "open" and channel.bufferedAmount <= self.high:
+            if self.fifo:
+                message = self.fifo.popleft()
+            elif self.state:
+                message = self.state.popitem(last=False)[1]
+                if self.pack_size:
+                    parts = [message]
+                    size = len(message)
+                    while self.state and size + len(next(iter(self.state.values()))) <= self.pack_size:
+                        parts.append(self.state.popitem(last=False)[1])
+                        size += len(parts[-1])
+                    message = b"".join(parts)
+            else:
+                return
+            self.queued -= len(message)
+            self._send(message)
+
+    def _send(self, message):
+        self.channel.send(message)
+        self.stats["sent"] += 1
+
+    def _on_close(self):
+        self.stats["closed"] += self.depth
+        self.fifo.clear()
+        self.state.clear()
+        self.queued = 0
+
+# ====== mỗi loại message một data channel ======
+class ChannelManager:
+    """
+    Một kênh tin cậy, có thứ tự thì một gói SCTP mất chặn mọi gói sau nó (head-of-line), kể cả
+    attitude / vị trí mới hơn. ChannelManager mở nhiều data channel, mỗi kênh một kiểu giao:
+    channels: nhãn -> (loại, ordered, maxRetransmits, maxPacketLifeTime ms), loại "reliable" hoặc "state".
+    send(message): tách theo telemetry_protocol.classify, frame trạng thái đi kênh "state",
+    còn lại (ack, lệnh, param, mission, byte lạ) đi kênh "reliable"; loại không có kênh thì đi kênh đầu tiên.
+    Mỗi kênh có ChannelSender riêng; readyState / channel là của kênh đầu tiên (mở / đóng theo nó).
+    Peer cũ chỉ đọc kênh đầu tiên: các kênh khác gửi PROBE mỗi probe_interval giây tới khi peer trả READY
+    (ChannelManager.accept), chưa có READY thì mọi thứ vẫn đi kênh đầu tiên như trước.
+    """
+
+    PROBE, READY = "channel?", "channel!"  # str: telemetry / lệnh luôn là bytes
+
+    def __init__(self, pc, channels: dict, high: int = 4 * 1024, low: int = 1024, max_queue: int = 64 * 1024,
+                 pack_size: int = 0, probe_interval: float = 1.0):
+        self.channels = {}
+        self.senders = {}
+        self.routes = {}
+        self.probe_interval = probe_interval
+        for label, (kind, ordered, max_retransmits, max_lifetime) in channels.items():
+            channel = pc.createDataChannel(label, ordered=ordered, maxRetransmits=max_retransmits,
+                                           maxPacketLifeTime=max_lifetime)
+            self.channels[label] = channel
+            self.senders[label] = ChannelSender(channel, high, low, max_queue, classify, pack_size)
+            self.routes.setdefault(kind, label)
+        self.channel = next(iter(self.channels.values()))
+        self.ready = {self.channel.label}  # kênh peer đã xác nhận đọc được
+        for label, channel in self.channels.items():
+            if label not in self.ready:
+                channel.on("open", lambda label=label: self._probe(label))
+                channel.on("message", lambda message, label=label: self._on_message(label, message))
+
+    def _probe(self, label: str):
+        channel = self.channels[label]
+        if label in self.ready or channel.readyState != "open":
+            return
+        channel.send(self.PROBE)  # kênh không tin cậy có thể làm mất PROBE / READY: gửi lại tới khi có READY
+        asyncio.get_running_loop().call_later(self.probe_interval, self._probe, label)
+
+    def _on_message(self, label: str, message):
+        if message == self.READY and label not in self.ready:
+            self.ready.add(label)
+            print(f"[ChannelManager] peer reads {label}")
+
+    @staticmethod
+    def accept(channel, message) -> bool:
+        """Phía nhận (on_datachannel): trả READY cho PROBE. True nếu message là PROBE / READY, không phải dữ liệu."""
+        if message == ChannelManager.PROBE:
+            channel.send(ChannelManager.READY)
+            return True
+        return message == ChannelManager.READY
+
+    @property
+    def readyState(self) -> str:
+        return self.channel.readyState
+
+    @property
+    def stats(self) -> dict:
+        return {label: dict(sender.stats, depth=sender.depth) for label, sender in self.senders.items()}
+
+    def send(self, message) -> bool:
+        first = self.channel.label
+        parts = {}
+        for key, piece in classify(message):
+            label = self.routes.get("reliable" if key is None else "state", first)
+            if label not in self.ready:
+                label = first
+            parts.setdefault(label, []).append(piece)
+        return all([self.senders[label].send(b"".join(pieces)) for label, pieces in parts.items()])
+
 # ====== đọc từ uart rồi gửi đi ======
-async def uart_reader(channel, ser: serial.Serial):
-    data = b''
+async def uart_reader(channel, ser, pack_size: int = 1200, pack_delay: float = 0.005):
+    """
+    Gửi telemetry đọc từ UART lên data channel. ser: SerialTransport (hoặc serial.Serial, sẽ được bọc lại).
+    Cắt thành frame MAVLink nguyên vẹn và gộp nhiều frame vào một message (telemetry_protocol.TelemetryPacker):
+    tối đa pack_size byte, chờ tối đa pack_delay giây.
+    channel: ChannelSender / ChannelManager (hoặc data channel, sẽ được bọc lại): kênh nghẽn thì chỉ giữ frame trạng thái mới nhất.
+    """
+    transport = ser if isinstance(ser, SerialTransport) else SerialTransport(ser)
+    sender = channel if isinstance(channel, (ChannelSender, ChannelManager)) else ChannelSender(channel, split=classify, pack_size=pack_size)
+    packer = TelemetryPacker(sender.send, pack_size, pack_delay)
     try:
         while True:
-            while ser.in_waiting > 0:
-                byte = ser.read()
-                data = data + byte
-
-            if channel.readyState == "open":
-                if len(data) != 0:
-                    channel.send(data)
-                    # print("[Publisher] Sent UART -> webrtc", data)
-            else:
+            data = await transport.read()
+            if channel.readyState != "open":
                 print("[Publisher] No channel to send")
-                ser.close()
                 break
-            data = b''
-            asyncio.sleep(0.005)
+            packer.feed(data)
+            # print("[Publisher] Sent UART -> webrtc", data)
     except asyncio.CancelledError:
         print("[Publisher] UART reader cancelled")
+    except ConnectionError as e:
+        print("[Publisher] UART closed:", e)
     finally:
-        ser.close()
+        packer.close()
+        transport.close()
 
 # ====== Gửi dữ liệu linh tinh mỗi vài giây ======
 async def send_periodic(channel):
@@ -400,7 +1559,8 @@ def udp_multicast_track(udp_multicast_group: str, port: int, eth_ip_address: str
     return player
             
 # ====== send telemetry from udp ======
-async def send_telemetry_from_udp(channel, lost_event: asyncio.Event, udp_multicast_group: str, port: int, eth_ip_address: str):
+async def send_telemetry_from_udp(channel, lost_event: asyncio.Event, udp_multicast_group: str, port: int, eth_ip_address: str,
+                                  pack_size: int = 1200, pack_delay: float = 0.005):
     # Tạo UDP socket
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -418,13 +1578,16 @@ async def send_telemetry_from_udp(channel, lost_event: asyncio.Event, udp_multic
     udp_sock.setblocking(False)
     loop = asyncio.get_running_loop()
     print("Listening telemetry from udp multicast...")
+    # mỗi datagram thường chỉ một frame MAVLink: gộp lại (như uart_reader)
+    sender = channel if isinstance(channel, (ChannelSender, ChannelManager)) else ChannelSender(channel, split=classify, pack_size=pack_size)
+    packer = TelemetryPacker(sender.send, pack_size, pack_delay)
             
     try:
         while not lost_event.is_set():
             try:
                 packet, addr = await loop.sock_recvfrom(udp_sock, 65535)
                 if channel.readyState == "open":
-                    channel.send(packet)
+                    packer.feed(packet)
                     #print("[Publisher] sending telemetry data ->", packet)
                 else:
                     print("[Publisher] No channel to send") 
@@ -432,6 +1595,7 @@ async def send_telemetry_from_udp(channel, lost_event: asyncio.Event, udp_multic
                 print("[UDP exception]:", e)
                 await asyncio.sleep(1)
     finally:
+        packer.close()
         udp_sock.close()
 
 ##### CÁC HÀM DÀNH CHO VIEWER #####
@@ -464,70 +1628,90 @@ async def send_video_packet_udp(track, udp_sock: socket.socket, GCS_IP: str, VID
         except Exception as e:
             print("UDP send error: ", e)
             
-# ====== nhận lệnh điều khiển từ udp server rồi gửi đi ======
-async def send_command_from_gcs_server(channel, lost_event: asyncio.Event, udp_sock: socket.socket, GCS_IP: str, TELEMETRY_PORT: int):
-    udp_sock.setblocking(False)
+# ====== nhận lệnh điều khiển từ GCS qua UDP rồi gửi đi ======
+class GcsCommandProtocol(asyncio.DatagramProtocol):
+    """
+    Lệnh từ GCS (UDP) gửi lên data channel ngay khi tới, không còn poll select() rồi sleep.
+    Mỗi lần socket sẵn sàng thì đọc luôn các datagram đang chờ (tối đa BATCH) trong cùng một lượt.
+    hello = (ip, port) của GCS chạy kiểu server: gửi "Hello GCS" lúc đầu và mỗi khi quá hello_interval
+    giây không nhận được gì, để GCS biết địa chỉ của viewer (timer, không phải vòng lặp).
+    """
+    BATCH = 64
 
-    # gửi lần đầu
-    udp_sock.sendto(b"Hello GCS", (GCS_IP, TELEMETRY_PORT))
-    last_recv_time = time.time()
+    def __init__(self, channel, sock: socket.socket, hello: tuple = None, hello_interval: float = 2.0):
+        # lệnh phải tới: kênh nghẽn thì xếp hàng (có giới hạn) chứ không dồn hết cho aiortc
+        self.channel = channel if isinstance(channel, (ChannelSender, ChannelManager)) else ChannelSender(channel)
+        self.sock = sock
+        self.hello = hello
+        self.hello_interval = hello_interval
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.timer = None
+        self.last_recv = self.loop.time()
+        self.stats = {"received": 0, "batches": 0}  # gửi / bỏ: self.channel.stats
 
-    while True:
-        if lost_event.is_set():
-            break
-        try:
-            # kiểm tra có dữ liệu trong buffer không
-            rlist, _, _ = select.select([udp_sock], [], [], 0)
-            if rlist:
-                packet, addr = udp_sock.recvfrom(65535)
-                last_recv_time = time.time()   # cập nhật thời gian nhận
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.hello:
+            transport.sendto(b"Hello GCS", self.hello)
+            self.timer = self.loop.call_later(self.hello_interval, self._hello)
 
-                if channel.readyState == "open":
-                    channel.send(packet)
-                    # print("[Viewer] GCS Sent command ->", packet)
-                else:
-                    print("[Viewer] No channel to send") 
-            else:
-                await asyncio.sleep(0.005)
+    def connection_lost(self, exc):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
 
-            # 🔥 Nếu 1 giây chưa nhận được packet nào -> gửi lại Hello
-            if time.time() - last_recv_time >= 2.0:
-                udp_sock.sendto(b"Hello GCS", (GCS_IP, TELEMETRY_PORT))
-                print("[UDP] Resent Hello GCS")
-                last_recv_time = time.time()
+    def _hello(self):
+        now = self.loop.time()
+        if now - self.last_recv >= self.hello_interval:
+            self.transport.sendto(b"Hello GCS", self.hello)
+            print("[UDP] Resent Hello GCS")
+            self.last_recv = now
+        self.timer = self.loop.call_later(self.last_recv + self.hello_interval - now, self._hello)
 
-            await asyncio.sleep(0.1)
+    def datagram_received(self, data, addr):
+        self.last_recv = self.loop.time()
+        self.stats["batches"] += 1
+        self.forward(data)
+        for _ in range(self.BATCH - 1):
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except OSError:  # BlockingIOError: hết datagram đang chờ
+                break
+            self.forward(data)
+
+    def forward(self, packet: bytes):
+        self.stats["received"] += 1
+        if not self.channel.send(packet):
+            # print("[Viewer] GCS command dropped ->", packet)
+            if self.channel.readyState != "open":
+                print("[Viewer] No channel to send")
+
+    def error_received(self, exc):
+        print("[UDP exception]:", exc)
+
+async def gcs_command_bridge(channel, lost_event: asyncio.Event, udp_sock: socket.socket, hello: tuple = None):
+    """Chạy GcsCommandProtocol trên udp_sock tới khi lost_event được set."""
+    udp_sock.setblocking(False)
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: GcsCommandProtocol(channel, udp_sock, hello),
+                                                              sock=udp_sock)
+    try:
+        await lost_event.wait()
+    finally:
+        transport.close()
+    return {**protocol.stats, **protocol.channel.stats}
+
+# GCS là udp server: viewer gửi "Hello GCS" tới GCS, GCS trả lệnh về địa chỉ đó
+async def send_command_from_gcs_server(channel, lost_event: asyncio.Event, udp_sock: socket.socket, GCS_IP: str, TELEMETRY_PORT: int):
+    return await gcs_command_bridge(channel, lost_event, udp_sock, (GCS_IP, TELEMETRY_PORT))
 
-        except Exception as e:
-            print("[UDP exception]:", e) 
-            await asyncio.sleep(1)
-            
 # ====== nhận lệnh điều khiển từ udp client rồi gửi đi ======
+# GCS là udp client: viewer nghe ở GCS_IP:TELEMETRY_PORT
 async def send_command_from_gcs_client(channel, lost_event: asyncio.Event, udp_sock: socket.socket, GCS_IP: str, TELEMETRY_PORT: int):
     udp_sock.bind((GCS_IP, TELEMETRY_PORT))
-    udp_sock.setblocking(False)
     print("UDP server is listening")
-
-    while True:
-        if lost_event.is_set():
-            break
-        try:
-            # kiểm tra có dữ liệu trong buffer không
-            rlist, _, _ = select.select([udp_sock], [], [], 0)
-            while rlist:
-                packet, addr = udp_sock.recvfrom(65535)
-
-                if channel.readyState == "open":
-                    channel.send(packet)
-                    #print("[Viewer] GCS Sent command ->", packet)
-                else:
-                    print("[Viewer] No channel to send") 
-                rlist, _, _ = select.select([udp_sock], [], [], 0)
-            await asyncio.sleep(0.005)
-
-        except Exception as e:
-            print("[UDP exception]:", e) 
-            await asyncio.sleep(1)
+    return await gcs_command_bridge(channel, lost_event, udp_sock)
             
 async def opencv_to_gstreamer(track, lost_event: asyncio.Event):
     gst_cmd = (
@@ -10,8 +10,13 @@ from utils import (signaling_loop,
                    send_command_from_gcs_client,
                    opencv_to_gstreamer,
                    signaling_loop_pro,
+                   PeerSignaling,
+                   IceRecovery,
+                   ChannelManager,
+                   whip_whep_loop,
                    GCS_telemetry_data,
                    multicast_data_udp)
+from telemetry_protocol import unpack
 from config import *
 
 # ====== GCS PORT ======
@@ -20,7 +25,8 @@ TELEMETRY_PORT = 40001
 
 role = "viewer"
 
-async def run(GCS_IP: str, timeout: int):
+async def run(GCS_IP: str, timeout: int, whep: str = "", room: str = SIGNALING_ROOM, stream: str = STREAM_ID,
+              peer_id: str = None):
     pc = None
     GCS_udp_sock = None
     multicast_telemetry_sock = None
@@ -32,14 +38,14 @@ async def run(GCS_IP: str, timeout: int):
         @pc.on("connectionstatechange")
         async def on_state_change():
             print("[Viewer] state:", pc.connectionState)
-            if pc.connectionState in ("failed", "disconnected", "closed"):
+            if pc.connectionState in ("failed", "closed"):
                 print("[Viewer] connection lost")
                 lost_event.set()
                 
         @pc.on("iceconnectionstatechange")
         async def on_ice_state():
             print("[Viewer] ice:", pc.iceConnectionState)
-            if pc.iceConnectionState in ("failed", "disconnected", "closed"):
+            if pc.iceConnectionState in ("failed", "closed"):
                 print("[Viewer] ice connection lost")
                 lost_event.set()
                 
@@ -63,19 +69,22 @@ async def run(GCS_IP: str, timeout: int):
         multicast_telemetry_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
             
         # Tạo kênh gửi dữ liệu
-        command_channel = pc.createDataChannel("gcs_command")
+        # lệnh phải tới (kênh tin cậy), heartbeat / điều khiển tay đi kênh riêng không chặn lệnh;
+        # kênh nghẽn thì xếp hàng có giới hạn, đầy thì bỏ lệnh mới (đếm trong stats)
+        command_sender = ChannelManager(pc, COMMAND_CHANNELS, CHANNEL_BUFFER_HIGH, CHANNEL_BUFFER_LOW, CHANNEL_QUEUE_MAX)
+        command_channel = command_sender.channel
         # heartbeat_channel = pc.createDataChannel("heartbeat_viewer")
         
         # COMMAND CHANNEL
         @command_channel.on("open")
         def on_open():
             print("gcs command channel opened")
-            # asyncio.ensure_future(send_command_from_gcs_server(command_channel, lost_event, GCS_udp_sock, GCS_IP, TELEMETRY_PORT))
-            asyncio.ensure_future(send_command_from_gcs_client(command_channel, lost_event, GCS_udp_sock, GCS_IP, TELEMETRY_PORT))
+            # asyncio.ensure_future(send_command_from_gcs_server(command_sender, lost_event, GCS_udp_sock, GCS_IP, TELEMETRY_PORT))
+            asyncio.ensure_future(send_command_from_gcs_client(command_sender, lost_event, GCS_udp_sock, GCS_IP, TELEMETRY_PORT))
             
         @command_channel.on("close")
         def on_close():
-            print("[Viewer] Heartbeat channel closed")
+            print("[Viewer] Heartbeat channel closed", command_sender.stats)
             # lost_event.set() 
 
         @pc.on("datachannel")
@@ -91,12 +100,16 @@ async def run(GCS_IP: str, timeout: int):
                 #             channel.send(f"pong")
                 #         except Exception as e:
                 #             print(f"{channel.label} channel send error: ", e)
-                if channel.label == "telemetry":
+                if channel.label in TELEMETRY_CHANNELS:
+                    if ChannelManager.accept(channel, message):  # publisher hỏi kênh này có được đọc không
+                        return
                     print(f"Got data from {channel.label} channel, forwarding udp")
                     # if GCS_udp_sock is not None:
                     #     GCS_telemetry_data(GCS_udp_sock, message, GCS_IP, TELEMETRY_PORT)
                     if multicast_telemetry_sock is not None:
-                        multicast_data_udp(multicast_telemetry_sock, message, udp_multicast_telemetry_address, udp_multicast_telemetry_port)
+                        # publisher gộp nhiều frame MAVLink vào một message: tách ra, mỗi frame một datagram
+                        for frame in unpack(message) if isinstance(message, bytes) else [message]:
+                            multicast_data_udp(multicast_telemetry_sock, frame, udp_multicast_telemetry_address, udp_multicast_telemetry_port)
                         #multicast_data_udp(multicast_telemetry_sock, message, "225.1.2.3", 11024)
                 
             @channel.on("close")
@@ -130,7 +143,17 @@ async def run(GCS_IP: str, timeout: int):
                 
         # chạy signaling loop song song
         # signaling_task = asyncio.create_task(signaling_loop(pc, on_icecandidate, role, timeout, SIGNALING_SERVER))
-        signaling_task = asyncio.create_task(signaling_loop_pro(pc, lost_event, on_icecandidate, role, timeout, SIGNALING_SERVER))
+        if whep:
+            # WHEP: viewer tự tạo offer (nhận 2 luồng video của publisher), một POST là có answer
+            for _ in range(2):
+                pc.addTransceiver("video", direction="recvonly")
+            signaling_task = asyncio.create_task(whip_whep_loop(pc, lost_event, whep, role))
+        else:
+            # mạng chập chờn / đổi địa chỉ: chờ rồi ICE restart (giữ track, data channel), hỏng hẳn mới set lost_event
+            peer_signal = PeerSignaling(pc, role)
+            IceRecovery(pc, peer_signal, lost_event, ICE_CHECK_INTERVAL, ICE_DISCONNECTED_GRACE, ICE_RESTART_TIMEOUT, ICE_RESTARTS)
+            signaling_task = asyncio.create_task(signaling_loop_pro(pc, lost_event, on_icecandidate, role, timeout, SIGNALING_SERVER, peer_signal,
+                                                                     room, peer_id, stream))
 
         # chờ cho tới khi PC mất
         await lost_event.wait()
@@ -169,10 +192,22 @@ async def main():
     parser.add_argument(
         "--timeout", type=int, default=3, help="Signaling server connecting timeout (default: 3s)"
     )
+    parser.add_argument(
+        "--whep", default="", help="WHEP URL instead of the websocket, e.g. http://server:8890/whep/home"
+    )
+    parser.add_argument(
+        "--room", default=SIGNALING_ROOM, help=f"signaling room (default: {SIGNALING_ROOM})"
+    )
+    parser.add_argument(
+        "--stream", default=STREAM_ID, help="stream id to watch (default: any publisher in the room)"
+    )
+    parser.add_argument(
+        "--peer", default=None, help="peer id in the room (default: viewer-<hostname>-<random>)"
+    )
     args = parser.parse_args()
 
     while True:
-        result = await run(args.GCS_IP, args.timeout)
+        result = await run(args.GCS_IP, args.timeout, args.whep, args.room, args.stream, args.peer)
         if result == "retry":
             print("Got retry, retrying ...")
             await asyncio.sleep(PC_RETRY_TIME)  # retry sau vài giây